@@ -0,0 +1,226 @@
+"""Micro-benchmark for pdf_extraction.extract_data_from_text.
+
+Runs the compiled single-scan extractor and the previous regex-per-field
+implementation over the same synthetic corpus of normalized termo texts,
+checks that both return identical data and reports the speed-up.
+
+Usage: python benchmark/bench_extract_data.py [--documents N] [--repeat N] [--pages N]
+"""
+import os
+import re
+import sys
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'email-processor'))
+from pdf_extraction import extract_data_from_text # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+FIRST_NAMES = ["joao", "maria", "jose", "ana", "carlos", "fernanda", "paulo", "juliana"]
+LAST_NAMES = ["silva", "santos", "oliveira", "souza", "lima", "pereira", "costa", "almeida"]
+FUNCOES = ["tecnico de campo", "analista de suporte", "motorista", "supervisor de obras"]
+EMPREGADORES = ["construtora exemplo ltda", "servicos gerais sa", "engenharia modelo ltda"]
+EQUIPMENTS = ["celular samsung a12", "notebook dell latitude", "tablet lenovo m10", "radio motorola", "carregador"]
+MONTHS = ["janeiro", "fevereiro", "marco", "abril", "maio", "junho", "julho", "agosto",
+          "setembro", "outubro", "novembro", "dezembro"]
+BOILERPLATE = (
+    "o empregado compromete-se a zelar pela guarda e conservacao dos equipamentos "
+    "recebidos, responsabilizando-se por danos causados por mau uso, extravio ou perda, "
+    "autorizando desde ja o desconto dos valores correspondentes em folha de pagamento.\n"
+)
+
+
+def _equipment_line(rng):
+    line = rng.choice(["", "equipamento: "]) + rng.choice(EQUIPMENTS)
+    if rng.random() < 0.6:
+        line += f" imei: {rng.randrange(10**14, 10**15)}"
+    if rng.random() < 0.6:
+        line += f" patrimonio: {rng.randrange(10**5, 10**6)}"
+    if rng.random() < 0.05:
+        # OCR noise that makes the IMEI and patrimonio labels collide
+        line += rng.choice([" patrimonio: imei: 123", " imei:", " patrimonio:imei:9 x"])
+    return line
+
+
+def _ocr_garble(rng, label, probability):
+    """Misreads a label the way Tesseract sometimes does on phone-scanned pages."""
+    if rng.random() >= probability:
+        return label
+    position = rng.randrange(len(label) - 1)
+    return label[:position] + rng.choice("1l|0") + label[position + 1:]
+
+
+def make_termo_text(rng, pages=1, equipment_count=None, ocr_noise=0.0):
+    """Builds a normalized termo text with random fields, equipment and boilerplate pages.
+
+    ``ocr_noise`` is the probability that each field label is misread.
+    """
+    label = lambda text: _ocr_garble(rng, text, ocr_noise) # noqa: E731
+    equipment_count = rng.randint(1, 8) if equipment_count is None else equipment_count
+    cpf = f"{rng.randrange(100, 999)}.{rng.randrange(100, 999)}.{rng.randrange(100, 999)}-{rng.randrange(10, 99)}"
+    text = (
+        "termo de recebimento de ferramentas e equipamentos\n"
+        f"{label('empregado:')} {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}\n"
+        f"{label('matricula:')} {rng.randrange(1000, 99999)}\n"
+        f"{label('funcao:')} {rng.choice(FUNCOES)}\n"
+        f"{label('r.g. n:')} {rng.randrange(10**7, 10**8)}\n"
+        f"{label('empregador:')} {rng.choice(EMPREGADORES)}\n"
+        f"{label('cpf:')} {cpf if rng.random() < 0.9 else ''}\n"
+        f"recebi os seguintes equipamentos e {label('ferramentas:')}\n"
+        + "\n".join(_equipment_line(rng) for _ in range(equipment_count))
+        + f"\n{label('declaro')} ter recebido os itens acima em perfeito estado.\n"
+        + BOILERPLATE * rng.randint(3, 10)
+    )
+    for _ in range(pages - 1):
+        text += BOILERPLATE * 25
+    month = rng.choice(MONTHS + ["marc0"]) if rng.random() < 0.05 else rng.choice(MONTHS)
+    text += f"sao paulo, {rng.randint(1, 28)} de {month} de {rng.randint(2015, 2025)}\n"
+    return text
+
+
+def legacy_extract_data_from_text(text):
+    """The regex-per-field implementation that extract_data_from_text replaced, kept as the reference."""
+    data = {
+        "nome": None,
+        "matricula": None,
+        "funcao": None,
+        "empregador": None,
+        "rg": None,
+        "cpf": None,
+        "equipamentos": [],
+        "data": None
+    }
+
+    # Use the user-provided logic for extraction
+    # Nome
+    nome_match = re.search(r"empregado:\s*(.*?)\s*matricula:", text, re.DOTALL)
+    if nome_match:
+        data["nome"] = nome_match.group(1).strip()
+
+    # Matricula
+    matricula_match = re.search(r"matricula:\s*(.*?)\s*funcao:", text, re.DOTALL)
+    if matricula_match:
+        data["matricula"] = matricula_match.group(1).strip()
+
+    # Função
+    funcao_match = re.search(r"funcao:\s*(.*?)\s*r\.g\. n(?:º|°)?:", text, re.DOTALL)
+    if funcao_match:
+        data["funcao"] = funcao_match.group(1).strip()
+
+    # RG
+    rg_match = re.search(r"r\.g\. n(?:º|°)?:(?:\s*nº:)?\s*(.*?)\s*empregador:", text, re.DOTALL)
+    if rg_match:
+        data["rg"] = rg_match.group(1).strip()
+
+    # Empregador
+    empregador_match = re.search(r"empregador:\s*(.*?)\s*cpf:", text, re.DOTALL)
+    if empregador_match:
+        data["empregador"] = empregador_match.group(1).strip()
+
+    # CPF - Adjusted to be more precise and stop before the junk text
+    cpf_match = re.search(r"cpf:\s*([\d\.\-]{11,14}|)", text, re.DOTALL)
+    if cpf_match:
+        data["cpf"] = cpf_match.group(1).strip()
+        if not data["cpf"]:
+            data["cpf"] = ""
+
+    # Equipamentos - Refined based on new user feedback
+    equipamentos_block_match = re.search(r"ferramentas:\s*(.*?)\s*declaro", text, re.DOTALL)
+    if equipamentos_block_match:
+        equipamentos_block = equipamentos_block_match.group(1).strip()
+        
+        for line in equipamentos_block.split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+
+            equipment_name = line
+            imei = None
+            patrimonio = None
+
+            imei_match = re.search(r"imei:\s*(\S+)", equipment_name, re.IGNORECASE)
+            if imei_match:
+                imei = imei_match.group(1).strip()
+                equipment_name = re.sub(r"imei:\s*\S+", "", equipment_name, flags=re.IGNORECASE).strip()
+
+            patrimonio_match = re.search(r"patrimonio:\s*(\S+)", equipment_name, re.IGNORECASE)
+            if patrimonio_match:
+                patrimonio = patrimonio_match.group(1).strip()
+                equipment_name = re.sub(r"patrimonio:\s*\S+", "", equipment_name, flags=re.IGNORECASE).strip()
+            
+            equipment_name = re.sub(r"^equipamento:\s*", "", equipment_name, flags=re.IGNORECASE).strip()
+
+            if equipment_name:
+                equipment_info = {"nome_equipamento": equipment_name}
+                if imei:
+                    equipment_info["imei"] = imei
+                if patrimonio:
+                    equipment_info["patrimonio"] = patrimonio
+                data["equipamentos"].append(equipment_info)
+
+    # Date
+    date_match = re.search(r"sao paulo,\s*(\d{1,2})\s*de\s*([a-zçãõáéíóúàèìòùâêîôûäëïöüñ]+)\s*de\s*(\d{4})", text)
+    if date_match:
+        day = date_match.group(1)
+        month_name = date_match.group(2)
+        year = date_match.group(3)
+        
+        month_mapping = {
+            "janeiro": "01", "fevereiro": "02", "marco": "03", "abril": "04", "maio": "05", "junho": "06",
+            "julho": "07", "agosto": "08", "setembro": "09", "outubro": "10", "novembro": "11", "dezembro": "12"
+        }
+        month = month_mapping.get(month_name, "00")
+        if month != "00":
+            data["data"] = f"{day}/{month}/{year}"
+        else:
+            logger.warning(f"Could not parse month name: {month_name}")
+
+    return data
+
+
+def _time(function, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            function(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=2000, help="number of synthetic documents")
+    parser.add_argument('--repeat', type=int, default=5, help="timing repetitions (best is reported)")
+    parser.add_argument('--pages', type=int, default=3, help="boilerplate pages per document")
+    parser.add_argument('--ocr-noise', type=float, default=0.1,
+                        help="probability that a field label is misread, as in OCRed text")
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING) # Unknown month names are logged on purpose
+    rng = random.Random(args.seed)
+    corpus = [make_termo_text(rng, pages=rng.randint(1, args.pages), ocr_noise=args.ocr_noise)
+              for _ in range(args.documents)]
+
+    mismatches = sum(1 for text in corpus
+                     if extract_data_from_text(text) != legacy_extract_data_from_text(text))
+    if mismatches:
+        print(f"ERROR: {mismatches} of {len(corpus)} documents differ from the reference implementation")
+        sys.exit(1)
+
+    size_mb = sum(len(text) for text in corpus) / (1024 * 1024)
+    legacy_seconds = _time(legacy_extract_data_from_text, corpus, args.repeat)
+    compiled_seconds = _time(extract_data_from_text, corpus, args.repeat)
+    print(f"Corpus: {len(corpus)} documents, {size_mb:.1f} MiB of text (outputs identical)")
+    print(f"Reference extractor: {legacy_seconds:.3f}s ({len(corpus) / legacy_seconds:.0f} docs/s)")
+    print(f"Compiled extractor:  {compiled_seconds:.3f}s ({len(corpus) / compiled_seconds:.0f} docs/s)")
+    print(f"Speed-up: {legacy_seconds / compiled_seconds:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""End-to-end benchmark of the PDF extraction pipeline on a synthetic termo corpus.
+
+Generates text-layer and image-only termos with known field values (see
+synthetic_termos.py) and extracts them through ``process_pdf``, the same
+code the application runs, with the cache disabled. The time of every stage
+(text layer, rasterization, preprocessing, OCR, normalize_text,
+extract_data_from_text) is read from the document traces of the metrics
+module, and the database insert is timed around ``bulk_insert_documents``.
+Reports throughput, latency percentiles, peak memory and field accuracy,
+and can write the results as JSON so two runs can be compared.
+
+Rasterization and OCR need Poppler and Tesseract; when they are missing
+the documents that need them are reported as not OCRed and left out of the
+accuracy. With ``--layout`` scanned pages are OCRed only inside
+OCR_LAYOUT_REGIONS, falling back to full pages when a required field is
+missing, and the OCRed pixel volume is reported. ``--preprocess`` turns on
+OCR_PREPROCESS, ``--ocr-backend`` picks the OCR_BACKEND, and
+``--scan-artifacts`` gives the image termos the defects of phone scans, so
+time and accuracy can be compared across settings.
+
+Usage:
+    python benchmark/bench_pipeline.py [--documents N] [--output run.json]
+    python benchmark/bench_pipeline.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+try:
+    import resource # Not available on Windows
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'email-processor'))
+from flask import Flask # noqa: E402
+import pdf_extraction # noqa: E402
+from database import bulk_insert_documents, db # noqa: E402
+from metrics import counter_value, document_trace, reset_metrics # noqa: E402
+from pdf_extraction import ( # noqa: E402
+    OCR_BACKENDS,
+    OCR_DPI,
+    IncompleteExtractionError,
+    check_poppler_installed,
+    check_tesseract_installed,
+    process_pdf,
+)
+from synthetic_termos import generate_corpus # noqa: E402
+
+STAGES = ("text_layer", "rasterize", "preprocess", "ocr", "normalize", "extract_fields", "db_insert")
+# Stages timed per page rather than per document
+PAGE_STAGES = ("rasterize", "preprocess", "ocr")
+FIELDS = ("nome", "matricula", "funcao", "empregador", "rg", "cpf", "equipamentos", "data")
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize_timings(samples, items):
+    """Throughput and latency percentiles of one stage. ``items`` is what throughput counts."""
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "total_s": round(total, 6),
+        "throughput_per_s": round(items / total, 3) if total else None,
+        "p50_ms": _ms(percentile(samples, 0.50)),
+        "p90_ms": _ms(percentile(samples, 0.90)),
+        "p99_ms": _ms(percentile(samples, 0.99)),
+        "max_ms": _ms(max(samples) if samples else None),
+    }
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+class _Timer:
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.stage].append(time.perf_counter() - self.start)
+
+def run_document(document, timings, ocr_dpi, layout=False):
+    """Extracts one document and adds its stage timings to ``timings``. Returns ``(result, ocr_skipped)``.
+
+    ``ocr_skipped`` is set when pages needing OCR could not be OCRed; the
+    timings of their failed rasterization are left out.
+    """
+    path = document["path"]
+    with document_trace(path) as trace:
+        try:
+            text, data = process_pdf(path, cache=False, dpi=ocr_dpi, layout=layout, early_stop=False,
+                                     parallel=False, max_resident_pages=1)
+            ocr_skipped = False
+        except IncompleteExtractionError as e:
+            text, data, ocr_skipped = e.text, e.data, True
+    for record in trace["stages"]:
+        if not (ocr_skipped and record["stage"] in PAGE_STAGES):
+            timings[record["stage"]].append(record["seconds"])
+    result = dict(data, subject="benchmark", filename=os.path.basename(path), extracted_text=text)
+    return result, ocr_skipped
+
+def score_fields(results):
+    """Fraction of correctly extracted fields, per variant and per field."""
+    accuracy = {}
+    for variant in ("text", "image"):
+        scored = [(data, truth) for data, truth, doc_variant, skipped in results
+                  if doc_variant == variant and not skipped]
+        if not scored:
+            continue
+        per_field = {field: round(sum(data[field] == truth[field] for data, truth in scored) / len(scored), 4)
+                     for field in FIELDS}
+        accuracy[variant] = {
+            "documents": len(scored),
+            "all_fields_correct": round(sum(all(data[f] == truth[f] for f in FIELDS)
+                                            for data, truth in scored) / len(scored), 4),
+            "fields": per_field,
+        }
+    return accuracy
+
+def _peak_rss():
+    if resource is None:
+        return None, None
+    # ru_maxrss is reported in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="termo-bench-")
+    corpus = generate_corpus(workdir, args.documents, args.max_pages, args.max_equipment,
+                             args.image_ratio, args.render_dpi, args.seed, args.scan_artifacts)
+    can_rasterize = check_poppler_installed()
+    can_ocr = check_tesseract_installed()
+    if not (can_rasterize and can_ocr):
+        # Every scanned page fails to OCR; the report counts them instead
+        logging.getLogger("pdf_extraction").setLevel(logging.CRITICAL)
+    pdf_extraction.OCR_PREPROCESS = args.preprocess
+    if args.ocr_backend:
+        pdf_extraction.OCR_BACKEND = args.ocr_backend
+    reset_metrics()
+
+    timings = {stage: [] for stage in STAGES}
+    results = []
+    rows = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for document in corpus:
+        result, ocr_skipped = run_document(document, timings, args.ocr_dpi, args.layout)
+        results.append((result, document["truth"], document["variant"], ocr_skipped))
+        rows.append(result)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for start in range(0, len(rows), args.batch_size):
+            with _Timer(timings, "db_insert"):
+                bulk_insert_documents(rows[start:start + args.batch_size], batch_size=args.batch_size)
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    self_rss, children_rss = _peak_rss()
+
+    ocr_page_count = len(timings["ocr"])
+    stages = {}
+    for stage in STAGES:
+        if stage in PAGE_STAGES:
+            stages[stage] = dict(summarize_timings(timings[stage], ocr_page_count), unit="page")
+        elif stage == "db_insert":
+            stages[stage] = dict(summarize_timings(timings[stage], len(rows)), unit="batch")
+        else:
+            stages[stage] = dict(summarize_timings(timings[stage], len(corpus)), unit="document")
+    skipped = sum(1 for *_, ocr_skipped in results if ocr_skipped)
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "poppler": can_rasterize,
+            "tesseract": can_ocr,
+        },
+        "corpus": {
+            "documents": len(corpus),
+            "pages": sum(document["pages"] for document in corpus),
+            "image_documents": sum(document["variant"] == "image" for document in corpus),
+            "ocr_skipped_documents": skipped,
+        },
+        "ocr": {
+            "megapixels": round(counter_value("pdf_ocr_pixels_total") / 1e6, 3),
+            "layout_fallback_documents": counter_value("pdf_layout_documents_total", result="fallback"),
+        },
+        "total_s": round(elapsed, 3),
+        "documents_per_s": round(len(corpus) / elapsed, 3),
+        "stages": stages,
+        "memory": {
+            "python_heap_peak_bytes": traced_peak,
+            "peak_rss_bytes": self_rss,
+            "peak_child_rss_bytes": children_rss,
+        },
+        "accuracy": score_fields(results),
+    }
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def print_report(report):
+    corpus = report["corpus"]
+    print(f"\n{corpus['documents']} documents ({corpus['image_documents']} image-only), {corpus['pages']} pages "
+          f"in {report['total_s']}s: {report['documents_per_s']} docs/s")
+    if corpus["ocr_skipped_documents"]:
+        print(f"Rasterization/OCR unavailable: {corpus['ocr_skipped_documents']} image documents not OCRed")
+    elif corpus["image_documents"]:
+        ocr = report["ocr"]
+        print(f"OCRed {ocr['megapixels']} megapixels"
+              + (f", {ocr['layout_fallback_documents']} layout fallbacks to full pages" if report["config"]["layout"] else ""))
+    print(f"\n{'stage':<16}{'count':>7}{'per s':>12}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, numbers in report["stages"].items():
+        if not numbers["count"]:
+            print(f"{stage:<16}{'skipped':>7}")
+            continue
+        print(f"{stage:<16}{numbers['count']:>7}{numbers['throughput_per_s'] or 0:>12.1f}"
+              f"{numbers['p50_ms']:>10.2f}{numbers['p90_ms']:>10.2f}{numbers['p99_ms']:>10.2f}{numbers['max_ms']:>10.2f}"
+              f"  ({numbers['unit']})")
+    memory = report["memory"]
+    print(f"\nPython heap peak: {memory['python_heap_peak_bytes'] / 2**20:.1f} MiB", end="")
+    if memory["peak_rss_bytes"]:
+        print(f", peak RSS: {memory['peak_rss_bytes'] / 2**20:.1f} MiB, "
+              f"largest child RSS: {memory['peak_child_rss_bytes'] / 2**20:.1f} MiB")
+    else:
+        print()
+    for variant, accuracy in report["accuracy"].items():
+        fields = ", ".join(f"{field} {value:.0%}" for field, value in accuracy["fields"].items())
+        print(f"Accuracy ({variant}, {accuracy['documents']} docs): {accuracy['all_fields_correct']:.0%} fully correct; {fields}")
+
+def compare_reports(before_path, after_path):
+    """Prints per-stage throughput and median latency changes between two JSON reports."""
+    with open(before_path) as file:
+        before = json.load(file)
+    with open(after_path) as file:
+        after = json.load(file)
+    print(f"{'stage':<16}{'per s before':>14}{'per s after':>13}{'p50 before':>12}{'p50 after':>11}{'change':>9}")
+    for stage in STAGES:
+        old, new = before["stages"].get(stage), after["stages"].get(stage)
+        if not old or not new or not old["count"] or not new["count"]:
+            print(f"{stage:<16}{'n/a':>14}")
+            continue
+        change = (new["p50_ms"] - old["p50_ms"]) / old["p50_ms"] if old["p50_ms"] else 0
+        print(f"{stage:<16}{old['throughput_per_s'] or 0:>14.1f}{new['throughput_per_s'] or 0:>13.1f}"
+              f"{old['p50_ms']:>12.2f}{new['p50_ms']:>11.2f}{change:>+9.0%}")
+    for variant in sorted(set(before["accuracy"]) | set(after["accuracy"])):
+        old = before["accuracy"].get(variant, {}).get("all_fields_correct")
+        new = after["accuracy"].get(variant, {}).get("all_fields_correct")
+        print(f"Accuracy ({variant}): {old} -> {new}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF extraction pipeline on synthetic termos.")
+    parser.add_argument('--documents', type=int, default=40)
+    parser.add_argument('--max-pages', type=int, default=4)
+    parser.add_argument('--max-equipment', type=int, default=8)
+    parser.add_argument('--image-ratio', type=float, default=0.5, help="fraction of image-only documents")
+    parser.add_argument('--render-dpi', type=int, default=150, help="resolution of the synthetic scans")
+    parser.add_argument('--ocr-dpi', type=int, default=OCR_DPI, help="rasterization resolution used for OCR")
+    parser.add_argument('--batch-size', type=int, default=50, help="rows per database insert batch")
+    parser.add_argument('--layout', action='store_true', help="OCR only the termo layout regions")
+    parser.add_argument('--preprocess', action='store_true', help="preprocess page images before OCR")
+    parser.add_argument('--ocr-backend', choices=['auto'] + sorted(OCR_BACKENDS),
+                        help="OCR engine, instead of the OCR_BACKEND setting")
+    parser.add_argument('--scan-artifacts', action='store_true',
+                        help="skew, uneven lighting, noise and borders on the image termos")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--workdir', help="keep the generated PDFs and database in this directory")
+    parser.add_argument('--output', help="write the report as JSON to this file")
+    parser.add_argument('--compare', nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON reports")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+    logging.basicConfig(level=logging.ERROR)
+    report = run_benchmark(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nReport written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Synthetic "termo de recebimento/devolução" PDFs with known field values.
+
+Documents are generated locally, without any third-party PDF library: text
+variants get a real text layer (Helvetica, WinAnsi encoding) written by a
+minimal PDF writer, image variants are pages rendered with Pillow and saved
+as image-only PDFs, like phone-scanned termos. Image pages can be given the
+defects of a phone scan: skew, uneven lighting, sensor noise and a dark
+border.
+"""
+import os
+import sys
+import random
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'email-processor'))
+from pdf_extraction import normalize_text # noqa: E402
+
+FIRST_NAMES = ["João", "Maria", "José", "Ana", "Carlos", "Fernanda", "Paulo", "Júlia", "Antônio", "Lúcia"]
+LAST_NAMES = ["Silva", "Santos", "Oliveira", "Souza", "Lima", "Pereira", "Conceição", "Araújo", "Gonçalves"]
+FUNCOES = ["Técnico de Campo", "Analista de Suporte", "Motorista", "Supervisor de Obras", "Eletricista"]
+EMPREGADORES = ["Construtora Exemplo Ltda", "Serviços Gerais SA", "Engenharia Modelo Ltda"]
+EQUIPMENTS = ["Celular Samsung A12", "Notebook Dell Latitude", "Tablet Lenovo M10", "Rádio Motorola",
+              "Carregador Universal", "Trena Digital", "Multímetro"]
+MONTHS = ["janeiro", "fevereiro", "março", "abril", "maio", "junho", "julho", "agosto",
+          "setembro", "outubro", "novembro", "dezembro"]
+BOILERPLATE = [
+    "O empregado compromete-se a zelar pela guarda e conservação dos equipamentos",
+    "recebidos, responsabilizando-se por danos causados por mau uso, extravio ou",
+    "perda, autorizando desde já o desconto dos valores correspondentes em folha.",
+    "Os equipamentos deverão ser devolvidos ao término do contrato de trabalho ou",
+    "sempre que solicitados pela empresa, nas mesmas condições em que foram entregues.",
+]
+LINES_PER_PAGE = 52
+
+# A4 in PDF points
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+def make_termo(rng, pages=1, equipment_count=3):
+    """Builds the text lines of a termo and its expected extraction result.
+
+    Returns ``(page_lines, truth)`` where ``page_lines`` is a list of pages,
+    each a list of text lines, and ``truth`` is what ``extract_data_from_text``
+    should return for the normalized text of the document.
+    """
+    nome = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    matricula = str(rng.randrange(1000, 99999))
+    funcao = rng.choice(FUNCOES)
+    rg = str(rng.randrange(10**7, 10**8))
+    empregador = rng.choice(EMPREGADORES)
+    cpf = f"{rng.randrange(100, 999)}.{rng.randrange(100, 999)}.{rng.randrange(100, 999)}-{rng.randrange(10, 99)}"
+    day, month, year = rng.randint(1, 28), rng.randrange(12), rng.randint(2015, 2025)
+
+    equipamentos = []
+    equipment_lines = []
+    for _ in range(equipment_count):
+        name = rng.choice(EQUIPMENTS)
+        line = name
+        expected = {"nome_equipamento": normalize_text(name)}
+        if rng.random() < 0.6:
+            expected["imei"] = str(rng.randrange(10**14, 10**15))
+            line += f" IMEI: {expected['imei']}"
+        if rng.random() < 0.6:
+            expected["patrimonio"] = str(rng.randrange(10**5, 10**6))
+            line += f" Patrimônio: {expected['patrimonio']}"
+        equipment_lines.append(line)
+        equipamentos.append(expected)
+
+    first_page = [
+        rng.choice(["TERMO DE RECEBIMENTO DE EQUIPAMENTOS", "TERMO DE DEVOLUÇÃO DE EQUIPAMENTOS"]),
+        "",
+        f"Empregado: {nome}",
+        f"Matrícula: {matricula}",
+        f"Função: {funcao}",
+        f"R.G. nº: {rg}",
+        f"Empregador: {empregador}",
+        f"CPF: {cpf}",
+        "",
+        "Recebi da empresa os seguintes equipamentos e ferramentas:",
+        *equipment_lines,
+        "Declaro ter recebido os itens acima em perfeito estado de conservação.",
+        "",
+        *BOILERPLATE,
+        "",
+        f"São Paulo, {day} de {MONTHS[month]} de {year}",
+        "",
+        "_______________________________",
+        "Assinatura do empregado",
+    ]
+    page_lines = [first_page]
+    for _ in range(pages - 1):
+        page_lines.append([BOILERPLATE[i % len(BOILERPLATE)] for i in range(LINES_PER_PAGE)])
+
+    truth = {
+        "nome": normalize_text(nome),
+        "matricula": matricula,
+        "funcao": normalize_text(funcao),
+        "empregador": normalize_text(empregador),
+        "rg": rg,
+        "cpf": cpf,
+        "equipamentos": equipamentos,
+        "data": f"{day}/{month + 1:02d}/{year}",
+    }
+    return page_lines, truth
+
+def _pdf_string(line):
+    escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return b"(" + escaped.encode("cp1252") + b")"
+
+def write_text_pdf(path, page_lines):
+    """Writes a PDF whose pages carry a real text layer."""
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    pages_id = add(b"")
+    kids = []
+    for lines in page_lines:
+        operations = [b"BT /F1 10 Tf 14 TL 50 800 Td"]
+        operations += [_pdf_string(line) + b" Tj T*" for line in lines]
+        operations.append(b"ET")
+        stream = b"\n".join(operations)
+        content_id = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, PAGE_WIDTH, PAGE_HEIGHT, font_id, content_id)
+        ))
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % kid for kid in kids), len(kids))
+    catalog_id = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_id, xref_offset)
+    with open(path, 'wb') as file:
+        file.write(output)
+
+def _load_font(size):
+    for name in ("DejaVuSans.ttf", "Arial.ttf", "arial.ttf", "LiberationSans-Regular.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+def add_scan_artifacts(image, rng):
+    """Gives a clean page image the defects of a phone scan. Returns an RGB image."""
+    image = image.rotate(rng.uniform(-2.5, 2.5), resample=Image.BILINEAR, fillcolor=255)
+    pixels = np.asarray(image, dtype=np.float32)
+    height, width = pixels.shape
+    # Light falling off towards one side, sensor noise and a dark border strip
+    lighting = np.linspace(rng.uniform(0.7, 0.9), 1.0, width, dtype=np.float32)
+    if rng.random() < 0.5:
+        lighting = lighting[::-1]
+    pixels = pixels * lighting[None, :]
+    pixels += np.random.default_rng(rng.randrange(2**32)).normal(0, 6, pixels.shape).astype(np.float32)
+    border = int(rng.uniform(0.01, 0.03) * height)
+    pixels[:border] = rng.uniform(20, 60)
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels).convert("RGB")
+
+def render_page_images(page_lines, dpi=150, scan_artifacts=False, rng=None):
+    """Renders pages to images, the way a scanner (or with ``scan_artifacts``, a phone) would capture them."""
+    scale = dpi / 72
+    font = _load_font(int(10 * scale))
+    rng = rng or random.Random(0)
+    images = []
+    for lines in page_lines:
+        image = Image.new("L", (int(PAGE_WIDTH * scale), int(PAGE_HEIGHT * scale)), 255)
+        draw = ImageDraw.Draw(image)
+        for number, line in enumerate(lines):
+            draw.text((50 * scale, (42 + 14 * number) * scale), line, fill=0, font=font)
+        images.append(add_scan_artifacts(image, rng) if scan_artifacts else image)
+    return images
+
+def write_image_pdf(path, page_lines, dpi=150, scan_artifacts=False, rng=None):
+    """Writes an image-only PDF, with no text layer, as produced by scanning apps."""
+    images = render_page_images(page_lines, dpi, scan_artifacts, rng)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+    for image in images:
+        image.close()
+
+def generate_corpus(directory, documents, max_pages=4, max_equipment=8, image_ratio=0.5, dpi=150, seed=1234,
+                    scan_artifacts=False):
+    """Writes a mixed corpus of text and image termos. Returns one dict per document.
+
+    Each dict holds the ``path``, the ``variant`` ("text" or "image"), the
+    number of ``pages`` and the ground-truth field values under ``truth``.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for index in range(documents):
+        pages = rng.randint(1, max_pages)
+        page_lines, truth = make_termo(rng, pages, rng.randint(1, max_equipment))
+        variant = "image" if rng.random() < image_ratio else "text"
+        path = os.path.join(directory, f"termo_{index:04d}_{variant}.pdf")
+        if variant == "image":
+            write_image_pdf(path, page_lines, dpi, scan_artifacts, rng)
+        else:
+            write_text_pdf(path, page_lines)
+        corpus.append({"path": path, "variant": variant, "pages": pages, "truth": truth})
+    return corpus
@@ -0,0 +1,239 @@
+"""Batch ingestion of PDF files into the PdfDocument table.
+
+Walks a directory (or reads a manifest with one PDF path per line, optionally
+followed by a tab and the email subject), extracts every PDF on a pool of
+worker processes and saves the results in batches. Every saved or failed file
+is appended to a checkpoint file, so a run that is killed can be started
+again with the same arguments and resumes where it left off: saved files are
+skipped and failed ones are tried again. Near-duplicates of stored documents,
+or of earlier files of the same batch, are flagged or skipped according to
+FINGERPRINT_MODE, like in the email pipeline. Files already stored under the same
+``pdf_filepath``, such as the last batch of a run killed before its
+checkpoint entries were written, are recorded as saved instead of inserted
+twice. Paths are stored resolved to absolute paths, so these checks hold
+whatever the working directory of the run.
+
+Usage: python batch_ingest.py <directory-or-manifest> [--workers N] [--checkpoint FILE]
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timezone
+from flask import Flask
+from sqlalchemy import select
+from database import BULK_INSERT_BATCH_SIZE, PdfDocument, db, insert_documents_checking_duplicates
+from metrics import METRICS_FILE, document_trace, write_prometheus
+from pdf_extraction import OCR_WORKERS, extraction_fingerprint, process_pdf
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUBJECT = "importacao em lote"
+
+def iter_source_files(source, default_subject=DEFAULT_SUBJECT):
+    """Yields ``(pdf_path, subject)`` pairs from a directory tree or a manifest file.
+
+    Paths are absolute and free of symlinks, so the same file has the same
+    path in every run.
+    """
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(os.path.realpath(source)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith('.pdf'):
+                    yield os.path.join(root, name), default_subject
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as manifest:
+        for line in manifest:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            pdf_path, _, subject = line.partition('\t')
+            yield os.path.realpath(os.path.join(base_dir, pdf_path.strip())), subject.strip() or default_subject
+
+def load_checkpoint(checkpoint_path):
+    """Returns the set of paths already saved, or skipped as near-duplicates, according to the checkpoint file.
+
+    Failed entries are kept in the file as a record but not returned, so
+    those files are tried again.
+    """
+    finished = set()
+    if not os.path.exists(checkpoint_path):
+        return finished
+    with open(checkpoint_path, 'r', encoding='utf-8') as checkpoint:
+        for line in checkpoint:
+            try:
+                entry = json.loads(line)
+                if entry["status"] in ("done", "skipped"):
+                    finished.add(entry["path"])
+            except (ValueError, KeyError):
+                continue # A line cut short by a killed run
+    return finished
+
+def find_stored_documents(paths, chunk_size=None):
+    """Returns ``{pdf_path: document id}`` for the paths already saved as a PdfDocument."""
+    chunk_size = chunk_size or BULK_INSERT_BATCH_SIZE
+    stored = {}
+    for start in range(0, len(paths), chunk_size):
+        stored.update(db.session.execute(
+            select(PdfDocument.pdf_filepath, PdfDocument.id)
+            .where(PdfDocument.pdf_filepath.in_(paths[start:start + chunk_size]))
+        ).all())
+    return stored
+
+def _append_checkpoint(checkpoint, entries):
+    for entry in entries:
+        checkpoint.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+
+def _process_file(pdf_path, subject):
+    """Extracts one PDF through ``process_pdf``, with its cache and settings. Runs inside the worker pool.
+
+    Returns the result and the number of pages read, 0 for a cache hit.
+    """
+    with document_trace(pdf_path) as trace:
+        text, data = process_pdf(pdf_path, parallel=False)
+        if not text.strip():
+            raise ValueError("no text could be extracted")
+        # Stored so that later ingestions can recognize re-scans of these files
+        fingerprint = extraction_fingerprint(pdf_path, text)
+    result = dict(data, subject=subject, filename=os.path.basename(pdf_path), extracted_text=text,
+                  processed_at=datetime.now(timezone.utc), pdf_filepath=pdf_path, fingerprint=fingerprint)
+    return result, trace.get("pages", 0)
+
+class _Progress:
+    """Running document and page throughput of the ingestion."""
+
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.documents = 0
+        self.pages = 0
+        self.skipped = 0
+        self.failures = []
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        print(f"{self.documents + self.skipped + len(self.failures)}/{self.total} files, {self.pages} pages, "
+              f"{self.documents / elapsed:.2f} docs/s, {self.pages / elapsed:.2f} pages/s, "
+              f"{self.skipped} near-duplicates skipped, {len(self.failures)} failures", flush=True)
+
+def ingest(files, checkpoint_path, workers=None, batch_size=100, progress_interval=5.0):
+    """Extracts and saves ``(pdf_path, subject)`` pairs, skipping the ones in the checkpoint.
+
+    Must run inside a Flask app context. Returns the list of ``(pdf_path, error)`` failures.
+    """
+    finished = load_checkpoint(checkpoint_path)
+    pending_files = [(path, subject) for path, subject in files if path not in finished]
+    if finished:
+        print(f"Resuming: skipping {len(finished)} files already in {checkpoint_path}")
+    stored = find_stored_documents([path for path, _ in pending_files])
+    if stored:
+        print(f"Skipping {len(stored)} files already in the database")
+        pending_files = [(path, subject) for path, subject in pending_files if path not in stored]
+    progress = _Progress(len(pending_files), progress_interval)
+    workers = workers or OCR_WORKERS
+    batch = []
+
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        if stored:
+            _append_checkpoint(checkpoint, [{"path": path, "status": "done", "id": document_id}
+                                            for path, document_id in stored.items()])
+
+        def save_batch():
+            ids, skipped = insert_documents_checking_duplicates([result for result, _ in batch],
+                                                                batch_size=len(batch))
+            entries = []
+            for index, ((result, page_count), document_id) in enumerate(zip(batch, ids)):
+                path = result["pdf_filepath"]
+                if index in skipped:
+                    logger.info(f"Skipping {path}: near-duplicate of document {skipped[index]}")
+                    progress.skipped += 1
+                    entries.append({"path": path, "status": "skipped", "duplicate_of": skipped[index]})
+                elif document_id is None:
+                    progress.failures.append((path, "could not be saved to the database"))
+                    entries.append({"path": path, "status": "failed", "error": "database"})
+                else:
+                    progress.documents += 1
+                    progress.pages += page_count
+                    entries.append({"path": path, "status": "done", "id": document_id})
+            _append_checkpoint(checkpoint, entries)
+            batch.clear()
+
+        # Keep a bounded number of files in flight so huge directories do not pile up in memory
+        queue = iter(pending_files)
+        in_flight = {}
+        max_in_flight = workers * 2
+        while True:
+            for path, subject in queue:
+                in_flight[pool.submit(_process_file, path, subject)] = path
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = in_flight.pop(future)
+                try:
+                    batch.append(future.result())
+                except Exception as e:
+                    logger.error(f"Failed to extract {path}: {e}")
+                    progress.failures.append((path, str(e)))
+                    _append_checkpoint(checkpoint, [{"path": path, "status": "failed", "error": str(e)}])
+            if len(batch) >= batch_size:
+                save_batch()
+            progress.report()
+        if batch:
+            save_batch()
+
+    progress.report(force=True)
+    if METRICS_FILE:
+        write_prometheus()
+    return progress.failures
+
+def create_app(database_url):
+    """Minimal Flask app giving the ingestion access to the database."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract a directory or manifest of PDFs into the database.")
+    parser.add_argument('source', help="directory to walk, or manifest file with one PDF path per line")
+    parser.add_argument('--subject', default=DEFAULT_SUBJECT, help="subject stored for files without one")
+    parser.add_argument('--workers', type=int, default=OCR_WORKERS, help="number of extraction processes")
+    parser.add_argument('--batch-size', type=int, default=100, help="documents saved per transaction")
+    parser.add_argument('--checkpoint', help="checkpoint file (default: <source>.checkpoint.jsonl)")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///site.db'))
+    parser.add_argument('--progress-interval', type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    checkpoint_path = args.checkpoint or os.path.abspath(args.source).rstrip(os.sep) + ".checkpoint.jsonl"
+    files = list(iter_source_files(args.source, args.subject))
+
+    with create_app(args.database_url).app_context():
+        db.create_all()
+        failures = ingest(files, checkpoint_path, args.workers, args.batch_size, args.progress_interval)
+
+    print(f"\n--- Summary: {len(files)} files, {len(failures)} failures ---")
+    for path, error in failures:
+        print(f"  {path}: {error}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
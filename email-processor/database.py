@@ -1,32 +1,75 @@
+import os
+import logging
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import insert, inspect, select, update
 from sqlalchemy.dialects.postgresql import JSONB # Import JSONB for PostgreSQL specific type
-from datetime import datetime, timezone
+from datetime import date, datetime, timezone
 import json # For serializing/deserializing JSON data
+from fingerprint import (FINGERPRINT_MAX_DISTANCE, FINGERPRINT_MODE, band_probes, fingerprint_bands, from_signed, hamming_distance,
+                         probe_radius, simhash, termo_type, to_signed)
+from metrics import inc, stage
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
+# Number of rows written per transaction by bulk_insert_documents
+BULK_INSERT_BATCH_SIZE = int(os.environ.get('BULK_INSERT_BATCH_SIZE', 500))
+
 class PdfDocument(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    subject = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
-    pdf_filepath = db.Column(db.String(512), nullable=True) # New column for PDF file path
+    pdf_filepath = db.Column(db.String(512), nullable=True, index=True) # New column for PDF file path
     extracted_text = db.Column(db.Text, nullable=True) # Raw extracted text
+    # False while extracted_text covers only the pages read before every field was
+    # found (OCR_FULL_TEXT='lazy'); complete_extracted_texts reads the rest
+    text_complete = db.Column(db.Boolean, nullable=True)
     processed_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
 
     # Extracted structured data fields
-    nome = db.Column(db.String(255), nullable=True)
-    matricula = db.Column(db.String(255), nullable=True)
+    nome = db.Column(db.String(255), nullable=True, index=True)
+    matricula = db.Column(db.String(255), nullable=True, index=True)
     funcao = db.Column(db.String(255), nullable=True)
     empregador = db.Column(db.String(255), nullable=True)
     rg = db.Column(db.String(255), nullable=True)
-    cpf = db.Column(db.String(255), nullable=True)
+    cpf = db.Column(db.String(255), nullable=True, index=True)
     
     # Equipamentos: Store as JSONB for PostgreSQL, or Text for generic DBs
     # If using PostgreSQL, uncomment the line below and comment out the db.Text line
     # equipamentos = db.Column(JSONB, nullable=True)
     equipamentos = db.Column(db.Text, nullable=True) # Storing as JSON string for broader compatibility
 
-    data_documento = db.Column(db.String(10), nullable=True) # Storing date as string "DD/MM/YYYY"
+    data_documento = db.Column(db.Date, nullable=True, index=True) # Real date so it can be sorted and filtered by range
+
+    # SimHash of the first page (see fingerprint.py), stored signed, and its bands for indexed lookups
+    fingerprint = db.Column(db.BigInteger, nullable=True)
+    fingerprint_band0 = db.Column(db.Integer, nullable=True, index=True)
+    fingerprint_band1 = db.Column(db.Integer, nullable=True, index=True)
+    fingerprint_band2 = db.Column(db.Integer, nullable=True, index=True)
+    fingerprint_band3 = db.Column(db.Integer, nullable=True, index=True)
+    # "recebimento" or "devolucao" (see fingerprint.termo_type); near-duplicates must share it
+    tipo_termo = db.Column(db.String(16), nullable=True)
+    # Email message and attachment the document was ingested from (see pipeline.py), so a
+    # message retried after a partial failure does not save its other attachments again
+    source_key = db.Column(db.String(512), nullable=True, index=True)
+    # Earlier document this one is a near-duplicate of (re-scan or re-print), if any
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('pdf_document.id', ondelete='SET NULL'),
+                                nullable=True, index=True)
+
+    # One row per equipment, so IMEI and patrimônio lookups can use indexes.
+    # The JSON copy in `equipamentos` is kept for display.
+    equipamento_rows = db.relationship('Equipamento', backref='document', cascade='all, delete-orphan',
+                                       passive_deletes=True, order_by='Equipamento.id')
+
+    # Keyset pagination and exports walk documents in (processed_at, id) order.
+    # PostgreSQL only uses an index for the `nome` prefix search (LIKE 'x%')
+    # when it compares bytes, whatever the database collation.
+    __table_args__ = (
+        db.Index('ix_pdf_document_processed_at_id', 'processed_at', 'id'),
+        db.Index('ix_pdf_document_nome_pattern', 'nome',
+                 postgresql_ops={'nome': 'varchar_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
 
     def __repr__(self):
         return f"<PdfDocument {self.filename} - {self.subject}>"
@@ -34,7 +77,8 @@ class PdfDocument(db.Model):
     def __init__(self, subject, filename, extracted_text, processed_at,
                  nome=None, matricula=None, funcao=None, empregador=None,
                  rg=None, cpf=None, equipamentos=None, data_documento=None,
-                 pdf_filepath=None): # Added pdf_filepath to init
+                 pdf_filepath=None, fingerprint=None, duplicate_of_id=None, tipo_termo=None,
+                 source_key=None, text_complete=True): # Added pdf_filepath to init
         self.subject = subject
         self.filename = filename
         self.extracted_text = extracted_text
@@ -46,15 +90,478 @@ class PdfDocument(db.Model):
         self.rg = rg
         self.cpf = cpf
         self.equipamentos = json.dumps(equipamentos) if equipamentos is not None else None
-        self.data_documento = data_documento
+        self.equipamento_rows = [Equipamento(**equipment_mapping(item)) for item in equipamentos or []]
+        self.data_documento = parse_data_documento(data_documento)
         self.pdf_filepath = pdf_filepath # Assign new field
+        for column, value in fingerprint_columns(fingerprint).items():
+            setattr(self, column, value)
+        self.duplicate_of_id = duplicate_of_id
+        self.tipo_termo = tipo_termo or termo_type(extracted_text, subject)
+        self.source_key = source_key
+        self.text_complete = text_complete
 
     # Method to deserialize equipments when retrieving from DB (optional, can be done in application logic)
     @property
     def equipamentos_list(self):
-        if self.equipamentos:
-            return json.loads(self.equipamentos)
-        return []
+        # Decoded once and cached until the JSON string is replaced
+        cached = self.__dict__.get('_equipamentos_cache')
+        if cached is None or cached[0] is not self.equipamentos:
+            cached = (self.equipamentos, json.loads(self.equipamentos) if self.equipamentos else [])
+            self._equipamentos_cache = cached
+        return cached[1]
+
+    @property
+    def data_documento_str(self):
+        """The document date formatted as "DD/MM/YYYY", as extracted from the PDF."""
+        return self.data_documento.strftime("%d/%m/%Y") if self.data_documento else None
+
+class Equipamento(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('pdf_document.id', ondelete='CASCADE'),
+                            nullable=False, index=True)
+    nome_equipamento = db.Column(db.String(255), nullable=False)
+    imei = db.Column(db.String(255), nullable=True, index=True)
+    patrimonio = db.Column(db.String(255), nullable=True, index=True)
+
+    def __repr__(self):
+        return f"<Equipamento {self.nome_equipamento} - IMEI {self.imei} - Patrimônio {self.patrimonio}>"
+
+class ProcessingJob(db.Model):
+    """A PDF waiting to be extracted, shared by every worker replica (see job_queue.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default='pending') # pending, leased, done or failed
+    pdf_filepath = db.Column(db.String(512), nullable=False) # Must be readable by every replica
+    subject = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    available_at = db.Column(db.DateTime, nullable=False) # Not claimed before this time (retry backoff)
+    lease_owner = db.Column(db.String(255), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('pdf_document.id', ondelete='SET NULL'), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # Claiming scans pending jobs by availability and expired leases by expiry
+    __table_args__ = (
+        db.Index('ix_processing_job_status_available_at', 'status', 'available_at'),
+        db.Index('ix_processing_job_status_lease_expires_at', 'status', 'lease_expires_at'),
+    )
+
+    def __repr__(self):
+        return f"<ProcessingJob {self.id} {self.filename} - {self.status}>"
+
+def equipment_mapping(item):
+    """Converts an equipment dict from extract_data_from_text into Equipamento columns."""
+    return {
+        "nome_equipamento": item["nome_equipamento"],
+        "imei": item.get("imei"),
+        "patrimonio": item.get("patrimonio"),
+    }
+
+def fingerprint_columns(fingerprint):
+    """Converts a 64-bit SimHash into the fingerprint columns of PdfDocument."""
+    if fingerprint is None:
+        return {"fingerprint": None, **{f"fingerprint_band{band}": None for band in range(4)}}
+    columns = {"fingerprint": to_signed(fingerprint)}
+    for band, value in enumerate(fingerprint_bands(fingerprint)):
+        columns[f"fingerprint_band{band}"] = value
+    return columns
+
+def parse_data_documento(value):
+    """Converts a "DD/MM/YYYY" date from extract_data_from_text into a date, or None."""
+    if value is None or isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(value.strip(), "%d/%m/%Y").date()
+    except ValueError:
+        logger.warning(f"Could not parse document date: {value}")
+        return None
+
+def document_mapping(result):
+    """Converts an extraction result into a PdfDocument column mapping for bulk inserts.
+
+    ``result`` is a dict with the keyword arguments of ``PdfDocument.__init__``.
+    The date may also be given under the ``"data"`` key used by
+    ``extract_data_from_text``, and ``processed_at`` defaults to now. The
+    ``fingerprint`` of the first page, when known, fills the fingerprint columns,
+    and ``tipo_termo`` is read from the text unless given.
+    """
+    equipamentos = result.get("equipamentos")
+    return {
+        "subject": result["subject"],
+        "filename": result["filename"],
+        "extracted_text": result.get("extracted_text"),
+        "processed_at": result.get("processed_at") or datetime.now(timezone.utc),
+        "nome": result.get("nome"),
+        "matricula": result.get("matricula"),
+        "funcao": result.get("funcao"),
+        "empregador": result.get("empregador"),
+        "rg": result.get("rg"),
+        "cpf": result.get("cpf"),
+        "equipamentos": json.dumps(equipamentos) if equipamentos is not None else None,
+        "data_documento": parse_data_documento(result.get("data_documento", result.get("data"))),
+        "pdf_filepath": result.get("pdf_filepath"),
+        **fingerprint_columns(result.get("fingerprint")),
+        "duplicate_of_id": result.get("duplicate_of_id"),
+        "tipo_termo": result.get("tipo_termo") or termo_type(result.get("extracted_text"), result["subject"]),
+        "source_key": result.get("source_key"),
+        "text_complete": result.get("text_complete", True),
+    }
+
+def insert_documents(results, session=None):
+    """Inserts extraction results with one executemany per table, without committing.
+
+    The rows join the open transaction of ``session`` (``db.session`` by
+    default), so callers can save them together with other changes. Returns
+    the new PdfDocument ids in input order.
+    """
+    session = session or db.session
+    entries = [(document_mapping(result), [equipment_mapping(item) for item in result.get("equipamentos") or []])
+               for result in results]
+    statement = insert(PdfDocument).returning(PdfDocument.id, sort_by_parameter_order=True)
+    ids = list(session.execute(statement, [row for row, _ in entries]).scalars())
+    equipment_rows = [
+        dict(equipment, document_id=document_id)
+        for document_id, (_, equipments) in zip(ids, entries)
+        for equipment in equipments
+    ]
+    if equipment_rows:
+        session.execute(insert(Equipamento), equipment_rows)
+    return ids
+
+def insert_document(result, session=None):
+    """Inserts one extraction result without committing; see ``insert_documents``. Returns its id."""
+    return insert_documents([result], session)[0]
+
+def _insert_one_by_one(results):
+    """Inserts results in separate transactions so one bad row does not reject the others."""
+    ids = []
+    for result in results:
+        try:
+            ids.append(insert_document(result))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Could not save extraction result {result!r:.200}: {e}")
+            ids.append(None)
+    return ids
+
+def bulk_insert_documents(results, batch_size=None):
+    """Saves many extraction results as PdfDocument rows, one transaction per batch.
+
+    ``results`` is any iterable of dicts accepted by ``document_mapping``; it is
+    consumed lazily, so generators of arbitrary length can be passed. If a
+    batch fails, invalid results included, its rows are retried individually
+    and only the bad rows are skipped. Returns the new ids in input order,
+    with None for rejected rows.
+    """
+    batch_size = batch_size or BULK_INSERT_BATCH_SIZE
+    ids = []
+    batch = []
+
+    def flush():
+        with stage("persist"):
+            try:
+                ids.extend(insert_documents(batch))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                inc("pdf_failures_total", stage="persist")
+                logger.warning(f"Bulk insert of {len(batch)} PdfDocument rows failed: {e}. Retrying row by row.")
+                ids.extend(_insert_one_by_one(batch))
+        batch.clear()
+
+    for result in results:
+        batch.append(result)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return ids
+
+def find_document_by_source(source_key):
+    """Returns the id of the document ingested from ``source_key`` (see ``PdfDocument.source_key``), or None."""
+    return db.session.scalar(select(PdfDocument.id).where(PdfDocument.source_key == source_key).limit(1))
+
+def find_near_duplicate(fingerprint, tipo_termo, max_distance=None):
+    """Finds the stored document whose fingerprint is closest to ``fingerprint``, within ``max_distance`` bits.
+
+    Only documents of the same ``tipo_termo`` count, those of unknown type
+    when it is None. Only documents sharing a (nearly) equal band are read,
+    through the band indexes. Returns ``(document_id, distance)``, preferring
+    the oldest document on ties, or None.
+    """
+    max_distance = FINGERPRINT_MAX_DISTANCE if max_distance is None else max_distance
+    radius = probe_radius(max_distance)
+    bands = [PdfDocument.fingerprint_band0, PdfDocument.fingerprint_band1,
+             PdfDocument.fingerprint_band2, PdfDocument.fingerprint_band3]
+    candidates = db.session.execute(
+        select(PdfDocument.id, PdfDocument.fingerprint).where(db.or_(*(
+            column.in_(band_probes(value, radius)) for column, value in zip(bands, fingerprint_bands(fingerprint))
+        ))).where(PdfDocument.tipo_termo == tipo_termo if tipo_termo else PdfDocument.tipo_termo.is_(None))
+    ).all()
+    best = None
+    for document_id, stored in candidates:
+        distance = hamming_distance(fingerprint, from_signed(stored))
+        if distance <= max_distance and (best is None or (distance, document_id) < (best[1], best[0])):
+            best = (document_id, distance)
+    return best
+
+def check_near_duplicate(fingerprint, data=None, tipo_termo=None, max_distance=None):
+    """Applies FINGERPRINT_MODE to the first-page fingerprint of a new document.
+
+    Only stored termos of the same ``tipo_termo`` are considered, so a
+    devolução is never taken for a copy of its recebimento. Returns
+    ``(duplicate_of_id, skip)``. ``skip`` is set only in "skip" mode, and only
+    if ``data``, the fields read from the new document, agree with the stored
+    one on the date and on the CPF or matrícula: the termos of one person and
+    one set of equipment on different days differ by a few characters, too
+    few for the fingerprint alone to tell them apart.
+    """
+    if fingerprint is None or FINGERPRINT_MODE == 'off':
+        return None, False
+    match = find_near_duplicate(fingerprint, tipo_termo, max_distance)
+    if match is None:
+        return None, False
+    document_id, distance = match
+    skip = FINGERPRINT_MODE == 'skip' and _same_termo(document_id, data or {})
+    inc("pdf_near_duplicates_total", action="skipped" if skip else "flagged")
+    logger.info(f"Near-duplicate of PdfDocument {document_id} ({distance} bits apart); "
+                f"{'skipping it' if skip else 'flagging it'}.")
+    return document_id, skip
+
+def insert_documents_checking_duplicates(results, checked=False, batch_size=None):
+    """Saves extraction results like ``bulk_insert_documents``, applying FINGERPRINT_MODE to each of them.
+
+    Every result is checked against the stored documents with
+    ``check_near_duplicate``, unless ``checked`` says the caller already did,
+    and against the results before it. A result that is a near-duplicate of
+    an earlier one waits until that one is committed and is then checked
+    again, so it is flagged (or skipped) like a duplicate of any stored
+    document. Returns ``(ids, skipped)``: the new ids in input order, None
+    for results not saved, and a dict mapping the index of each skipped
+    result to the document it duplicates.
+    """
+    ids = [None] * len(results)
+    skipped = {}
+    pending = list(range(len(results)))
+    recheck = not checked
+    while pending:
+        saving, waiting = [], []
+        for index in pending:
+            result = results[index]
+            if FINGERPRINT_MODE != 'off' and any(_near_duplicates(result, results[other]) for other in saving):
+                waiting.append(index)
+                continue
+            if recheck:
+                duplicate_of_id, skip = check_near_duplicate(
+                    result.get("fingerprint"), result, result.get("tipo_termo") or _result_type(result))
+                if skip:
+                    skipped[index] = duplicate_of_id
+                    continue
+                result["duplicate_of_id"] = duplicate_of_id
+            saving.append(index)
+        for index, document_id in zip(saving, bulk_insert_documents([results[i] for i in saving], batch_size)):
+            ids[index] = document_id
+        pending = waiting
+        recheck = True
+    return ids, skipped
+
+def _result_type(result):
+    return termo_type(result.get("extracted_text"), result["subject"])
+
+def _near_duplicates(result, other):
+    """Whether two unsaved results would be near-duplicates once stored."""
+    fingerprint, other_fingerprint = result.get("fingerprint"), other.get("fingerprint")
+    if fingerprint is None or other_fingerprint is None:
+        return False
+    return ((result.get("tipo_termo") or _result_type(result)) == (other.get("tipo_termo") or _result_type(other))
+            and hamming_distance(fingerprint, other_fingerprint) <= FINGERPRINT_MAX_DISTANCE)
+
+def _same_termo(document_id, data):
+    stored = db.session.execute(
+        select(PdfDocument.cpf, PdfDocument.matricula, PdfDocument.data_documento).where(PdfDocument.id == document_id)
+    ).one_or_none()
+    data_documento = parse_data_documento(data.get("data_documento", data.get("data")))
+    if stored is None or data_documento is None or data_documento != stored.data_documento:
+        return False
+    return any(data.get(field) and data.get(field) == getattr(stored, field) for field in ("cpf", "matricula"))
+
+def upgrade_document_schema():
+    """Brings an existing pdf_document table up to date with the model.
+
+    Adds the columns and lookup indexes that ``db.create_all()`` does not add
+    to existing tables, and converts ``data_documento`` from the former
+    "DD/MM/YYYY" strings to real dates.
+    """
+    table = PdfDocument.__table__
+    column_type = {column["name"]: column["type"] for column in inspect(db.engine).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in column_type:
+            # Added as plain nullable columns; the foreign key of duplicate_of_id needs a migration
+            db.session.execute(db.text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}"
+            ))
+            logger.info(f"Added column {table.name}.{column.name}.")
+    db.session.commit()
+    if not isinstance(column_type["data_documento"], db.Date):
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute(db.text(
+                "ALTER TABLE pdf_document ALTER COLUMN data_documento TYPE date "
+                "USING to_date(NULLIF(data_documento, ''), 'DD/MM/YYYY')"
+            ))
+        else:
+            # SQLite keeps dates as ISO strings, so rewriting the values is enough
+            legacy_dates = db.session.execute(
+                select(table.c.id, table.c.data_documento.cast(db.String)).where(table.c.data_documento.like("%/%"))
+            ).all()
+            for document_id, value in legacy_dates:
+                db.session.execute(
+                    update(table).where(table.c.id == document_id).values(data_documento=parse_data_documento(value))
+                )
+            logger.info(f"Converted {len(legacy_dates)} document dates to ISO format.")
+        db.session.commit()
+
+    for index in table.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+def backfill_equipamentos(batch_size=None):
+    """Creates Equipamento rows from the JSON equipamentos column of older documents.
+
+    Only documents that have equipment JSON but no Equipamento rows are
+    processed, so the backfill can be interrupted and run again. Commits once
+    per batch and returns the number of equipment rows created.
+    """
+    batch_size = batch_size or BULK_INSERT_BATCH_SIZE
+    created = 0
+    last_id = 0
+    while True:
+        documents = db.session.execute(
+            select(PdfDocument.id, PdfDocument.equipamentos)
+            .where(PdfDocument.id > last_id)
+            .where(PdfDocument.equipamentos.is_not(None))
+            .where(~PdfDocument.equipamento_rows.any())
+            .order_by(PdfDocument.id)
+            .limit(batch_size)
+        ).all()
+        if not documents:
+            break
+        equipment_rows = []
+        for document_id, equipamentos in documents:
+            try:
+                items = json.loads(equipamentos)
+            except ValueError as e:
+                logger.warning(f"Skipping invalid equipamentos JSON of PdfDocument {document_id}: {e}")
+                continue
+            equipment_rows.extend(dict(equipment_mapping(item), document_id=document_id) for item in items)
+        if equipment_rows:
+            db.session.execute(insert(Equipamento), equipment_rows)
+        db.session.commit()
+        created += len(equipment_rows)
+        last_id = documents[-1][0]
+    logger.info(f"Backfilled {created} equipment rows.")
+    return created
+
+def backfill_fingerprints(batch_size=None):
+    """Computes the fingerprint and termo type of older documents.
+
+    The fingerprint must cover page 1 only, as at ingestion, but a stored
+    text read from a text layer does not show where page 1 ends. Page 1 is
+    therefore recovered from the kept original (``pdf_filepath``) with
+    ``first_page_of_extraction``; documents whose original is gone only get
+    their type. Commits once per batch and returns the number of documents
+    updated.
+    """
+    from pdf_extraction import first_page_of_extraction
+
+    batch_size = batch_size or BULK_INSERT_BATCH_SIZE
+    updated = 0
+    unrecoverable = 0
+    last_id = 0
+    while True:
+        documents = db.session.execute(
+            select(PdfDocument.id, PdfDocument.subject, PdfDocument.extracted_text, PdfDocument.pdf_filepath,
+                   PdfDocument.fingerprint, PdfDocument.tipo_termo)
+            .where(PdfDocument.id > last_id)
+            .where(db.or_(PdfDocument.fingerprint.is_(None), PdfDocument.tipo_termo.is_(None)))
+            .where(PdfDocument.extracted_text.is_not(None))
+            .order_by(PdfDocument.id)
+            .limit(batch_size)
+        ).all()
+        if not documents:
+            break
+        rows = []
+        for document_id, subject, text, pdf_filepath, stored_fingerprint, stored_type in documents:
+            row = {}
+            if stored_type is None and termo_type(text, subject):
+                row["tipo_termo"] = termo_type(text, subject)
+            if stored_fingerprint is None:
+                first_page = None
+                if pdf_filepath and os.path.exists(pdf_filepath):
+                    first_page = first_page_of_extraction(pdf_filepath, text)
+                fingerprint = simhash(first_page) if first_page else None
+                if fingerprint is None:
+                    unrecoverable += 1
+                else:
+                    row.update(fingerprint_columns(fingerprint))
+            if row:
+                rows.append(dict(row, id=document_id))
+        if rows:
+            db.session.execute(update(PdfDocument), rows)
+        db.session.commit()
+        updated += len(rows)
+        last_id = documents[-1][0]
+    logger.info(f"Backfilled {updated} document fingerprints and types.")
+    if unrecoverable:
+        logger.warning(f"Left {unrecoverable} documents without a fingerprint: their first page could not be recovered.")
+    return updated
+
+def complete_extracted_texts(batch_size=None):
+    """Replaces the partial text of documents extracted with OCR_FULL_TEXT='lazy' by their whole text.
+
+    The text is read from the kept original (``pdf_filepath``) with early
+    termination and the layout mode off; documents whose original is gone
+    keep their partial text. Commits once per batch, so it can be
+    interrupted and run again, and returns the number of documents completed.
+    """
+    from pdf_extraction import process_pdf
+
+    batch_size = batch_size or BULK_INSERT_BATCH_SIZE
+    completed = 0
+    unrecoverable = 0
+    last_id = 0
+    while True:
+        documents = db.session.execute(
+            select(PdfDocument.id, PdfDocument.pdf_filepath)
+            .where(PdfDocument.id > last_id)
+            .where(PdfDocument.text_complete.is_(False))
+            .order_by(PdfDocument.id)
+            .limit(batch_size)
+        ).all()
+        if not documents:
+            break
+        rows = []
+        for document_id, pdf_filepath in documents:
+            if not pdf_filepath or not os.path.exists(pdf_filepath):
+                unrecoverable += 1
+                continue
+            try:
+                text, _ = process_pdf(pdf_filepath, layout=False, early_stop=False)
+            except Exception as e:
+                logger.error(f"Could not read the full text of PdfDocument {document_id}: {e}")
+                continue
+            rows.append({"id": document_id, "extracted_text": text, "text_complete": True})
+        if rows:
+            db.session.execute(update(PdfDocument), rows)
+        db.session.commit()
+        completed += len(rows)
+        last_id = documents[-1][0]
+    logger.info(f"Completed the extracted text of {completed} documents.")
+    if unrecoverable:
+        logger.warning(f"Left {unrecoverable} documents with a partial text: their original PDF is gone.")
+    return completed
 
 # Note: You will need to run Flask database migrations (e.g., using Flask-Migrate)
 # to apply these schema changes to your PostgreSQL database.
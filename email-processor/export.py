@@ -0,0 +1,161 @@
+"""Streaming export of processed documents to CSV or JSONL.
+
+Rows are read from the database in batches through a server-side cursor
+(``yield_per``) and written as they arrive, so memory use stays constant
+however many documents match. Each equipment item gets its own row, with the
+document columns repeated; documents without equipment get a single row.
+
+Usage:
+    python export.py --format csv --output termos.csv [--cpf CPF] [--date-from 2024-01-01] ...
+"""
+import io
+import os
+import sys
+import csv
+import json
+import logging
+import argparse
+from datetime import date, datetime
+from flask import Blueprint, Response, request, stream_with_context
+from sqlalchemy import select
+from database import db, Equipamento, PdfDocument
+from search import filter_documents, parse_filters, parse_flag
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the database per round trip
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+# Bytes of output buffered before they are written or sent
+_CHUNK_SIZE = 64 * 1024
+
+DOCUMENT_FIELDS = ("id", "subject", "filename", "processed_at", "data_documento", "nome", "matricula", "funcao",
+                   "empregador", "rg", "cpf", "pdf_filepath", "duplicate_of_id")
+EQUIPMENT_FIELDS = ("nome_equipamento", "imei", "patrimonio")
+
+def export_fields(with_text=False):
+    return DOCUMENT_FIELDS + (("extracted_text",) if with_text else ()) + EQUIPMENT_FIELDS
+
+def iter_export_rows(query=None, cpf=None, matricula=None, nome=None, subject=None, date_from=None, date_to=None,
+                     with_text=False, batch_size=None):
+    """Yields one flat dict per equipment row of the matching documents, oldest first.
+
+    Takes the filters of ``search.search_documents``. Only the exported
+    columns are selected, and ``extracted_text`` only ``with_text``; the
+    equipment comes from the Equipamento rows (see ``backfill_equipamentos``).
+    """
+    fields = export_fields(with_text)
+    columns = [getattr(Equipamento if field in EQUIPMENT_FIELDS else PdfDocument, field) for field in fields]
+    statement = select(*columns).select_from(PdfDocument).outerjoin(
+        Equipamento, Equipamento.document_id == PdfDocument.id)
+    statement = filter_documents(statement, query, cpf, matricula, nome, subject, date_from, date_to)
+    if statement is None:
+        return
+    statement = (
+        statement.order_by(PdfDocument.processed_at, PdfDocument.id, Equipamento.id)
+        .execution_options(yield_per=batch_size or EXPORT_BATCH_SIZE)
+    )
+    for row in db.session.execute(statement):
+        yield dict(zip(fields, row))
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+def _chunked(pieces):
+    """Joins small strings into chunks of about _CHUNK_SIZE characters."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= _CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
+
+def _csv_lines(rows, fields):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([_plain(row[field]) for field in fields])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    if line.tell():
+        yield line.getvalue() # Only the header: no rows matched
+
+def _jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps({key: _plain(value) for key, value in row.items()}, ensure_ascii=False) + "\n"
+
+def iter_export(export_format, with_text=False, **filters):
+    """Yields the export as text chunks, in "csv" or "jsonl" format."""
+    rows = iter_export_rows(with_text=with_text, **filters)
+    if export_format == "csv":
+        return _chunked(_csv_lines(rows, export_fields(with_text)))
+    if export_format == "jsonl":
+        return _chunked(_jsonl_lines(rows))
+    raise ValueError(f"Unknown export format: {export_format}")
+
+def write_export(file, export_format, with_text=False, **filters):
+    """Writes the export to a text file object. Returns the number of characters written."""
+    written = 0
+    for chunk in iter_export(export_format, with_text, **filters):
+        file.write(chunk)
+        written += len(chunk)
+    return written
+
+_MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+export_blueprint = Blueprint('export', __name__)
+
+@export_blueprint.route('/export.<export_format>')
+def export_endpoint(export_format):
+    """Streams the export; register with ``app.register_blueprint(export_blueprint)``.
+
+    Takes the filters of the search API as query arguments, and
+    ``with_text=1`` to include the extracted text.
+    """
+    if export_format not in _MIMETYPES:
+        return Response(f"Unknown export format: {export_format}\n", status=404, mimetype='text/plain')
+    try:
+        filters = parse_filters(request.args)
+    except ValueError as e:
+        return Response(f"{e}\n", status=400, mimetype='text/plain')
+    chunks = iter_export(export_format, parse_flag(request.args, "with_text"), **filters)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=_MIMETYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=termos.{export_format}"},
+    )
+
+def main(argv=None):
+    from batch_ingest import create_app
+
+    parser = argparse.ArgumentParser(description="Export processed documents to CSV or JSONL.")
+    parser.add_argument('--format', choices=sorted(_MIMETYPES), default='csv')
+    parser.add_argument('--output', help="output file (default: standard output)")
+    parser.add_argument('--with-text', action='store_true', help="include the extracted text")
+    parser.add_argument('--query', help="full-text search over the extracted text")
+    for name in ("cpf", "matricula", "nome", "subject"):
+        parser.add_argument(f'--{name}')
+    parser.add_argument('--date-from', type=date.fromisoformat, help="first document date, YYYY-MM-DD")
+    parser.add_argument('--date-to', type=date.fromisoformat, help="last document date, YYYY-MM-DD")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///site.db'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    filters = dict(query=args.query, cpf=args.cpf, matricula=args.matricula, nome=args.nome, subject=args.subject,
+                   date_from=args.date_from, date_to=args.date_to)
+    with create_app(args.database_url).app_context():
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8', newline='') as file:
+                write_export(file, args.format, args.with_text, **filters)
+        else:
+            write_export(sys.stdout, args.format, args.with_text, **filters)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Cache settings, overridable through the environment (.env)
+EXTRACTION_CACHE_ENABLED = os.environ.get('EXTRACTION_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+EXTRACTION_CACHE_DIR = os.environ.get(
+    'EXTRACTION_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extraction_cache'),
+)
+EXTRACTION_CACHE_MAX_BYTES = int(os.environ.get('EXTRACTION_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def hash_pdf_file(pdf_path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a PDF file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """On-disk cache of extraction results keyed by the content of the PDF.
+
+    Each entry is a small JSON file holding the raw text and the extracted
+    field dict. Entries are touched on every hit, and the least recently used
+    ones are evicted once the directory grows past ``max_bytes``.
+    """
+
+    def __init__(self, directory=EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_hash, lang, dpi, extractor_version):
+        """Builds the cache key for a PDF digest and the settings that affect its result."""
+        return hashlib.sha256(f"{pdf_hash}:{lang}:{dpi}:{extractor_version}".encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """Returns the cached ``{"text": ..., "data": ...}`` entry for the key, or None."""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                entry = json.load(file)
+            os.utime(path) # Mark as recently used for LRU eviction
+        except FileNotFoundError:
+            entry = None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key, text, data):
+        """Stores an extraction result and evicts old entries if the cache is over its size limit."""
+        payload = json.dumps({"text": text, "data": data}, ensure_ascii=False).encode('utf-8')
+        path = self._entry_path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(payload)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            self._remove(tmp_path)
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._directory_size()
+            else:
+                self._size += len(payload) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        """Returns the hit/miss counters of this cache instance."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _directory_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits in ``max_bytes``."""
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._size <= self.max_bytes:
+                break
+            if self._remove(path):
+                self._size -= size
+                logger.info(f"Evicted extraction cache entry: {path}")
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+def get_extraction_cache():
+    """Returns the process-wide extraction cache, or None when caching is disabled."""
+    global _default_cache
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ExtractionCache()
+        return _default_cache
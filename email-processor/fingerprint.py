@@ -0,0 +1,110 @@
+"""SimHash fingerprints of document text, for spotting re-scanned or re-printed termos.
+
+A re-scan of the same termo has different PDF bytes, so the extraction
+cache misses it, but its text differs from the original only by OCR noise.
+The fingerprint is a 64-bit SimHash of the first page's character 4-grams:
+near-identical texts get fingerprints a few bits apart. Termos share most of
+their wording, so grams containing digits (CPF, matrícula, IMEI, dates),
+which tell one termo from another, weigh more.
+
+Fingerprints are indexed as four 16-bit bands (see ``PdfDocument``). Two
+fingerprints within ``4 * (radius + 1) - 1`` bits agree on at least one band
+to within ``radius`` bits, so probing each band and its one-bit neighbours
+finds every match up to 7 bits apart through the indexes.
+
+A termo de recebimento and the termo de devolução of the same person and
+equipment differ by little more than their title, so they are only compared
+with termos of the same type (``termo_type``).
+"""
+import os
+import hashlib
+import unicodedata
+from collections import Counter
+import numpy as np
+
+# Near-duplicate settings, overridable through the environment (.env).
+# "flag" saves near-duplicates with PdfDocument.duplicate_of_id set, "skip"
+# does not process or save them, "off" disables the check.
+FINGERPRINT_MODE = os.environ.get('FINGERPRINT_MODE', 'flag').lower()
+# Largest Hamming distance between the fingerprints of near-duplicates (at most 7)
+FINGERPRINT_MAX_DISTANCE = min(7, int(os.environ.get('FINGERPRINT_MAX_DISTANCE', 6)))
+
+SHINGLE_CHARS = 4
+DIGIT_WEIGHT = 4
+BANDS = 4
+BAND_BITS = 16
+_BAND_MASK = (1 << BAND_BITS) - 1
+_BIT_POSITIONS = np.arange(64, dtype=np.uint64)
+# Values of PdfDocument.tipo_termo, as they appear in the canonical title "termo de <type>"
+TERMO_TYPES = ("recebimento", "devolucao")
+
+def canonical_text(text):
+    """Lowercases, strips accents and reduces the text to words separated by single spaces.
+
+    Line breaks, spacing and punctuation vary between OCR runs, so they are dropped.
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    folded = "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+    return " ".join("".join(char if char.isalnum() else " " for char in folded).split())
+
+def first_page_text(text):
+    """Returns the first page of an extracted text, which ends at the form feed tesseract puts after each page.
+
+    Text-layer documents have no page breaks, so their whole text is returned.
+    """
+    return text.split("\f", 1)[0]
+
+def termo_type(text, subject=None):
+    """Returns the type of a termo, "recebimento" or "devolucao", or None if it cannot be told.
+
+    The title is looked for in the text first; when OCR garbled it, the email
+    subject (e.g. "Termo de Devolução") decides.
+    """
+    for source in (text, subject):
+        canonical = canonical_text(source)
+        positions = [(canonical.find(f"termo de {kind}"), kind) for kind in TERMO_TYPES]
+        found = [(position, kind) for position, kind in positions if position >= 0]
+        if found:
+            return min(found)[1]
+    return None
+
+def simhash(text):
+    """Returns the 64-bit SimHash of a text, or None if it is too short to fingerprint."""
+    canonical = canonical_text(text)
+    grams = Counter(canonical[i:i + SHINGLE_CHARS] for i in range(len(canonical) - SHINGLE_CHARS + 1))
+    if not grams:
+        return None
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), 'little') for gram in grams),
+        dtype=np.uint64, count=len(grams))
+    weights = np.fromiter(
+        (count * (DIGIT_WEIGHT if any(char.isdigit() for char in gram) else 1) for gram, count in grams.items()),
+        dtype=np.int64, count=len(grams))
+    bits = ((hashes[:, None] >> _BIT_POSITIONS) & np.uint64(1)).astype(np.int64)
+    totals = weights @ (2 * bits - 1)
+    return sum(1 << bit for bit in np.nonzero(totals > 0)[0].tolist())
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
+def to_signed(fingerprint):
+    """Converts a fingerprint to the signed 64-bit range of a BIGINT column."""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def from_signed(value):
+    return value + (1 << 64) if value < 0 else value
+
+def fingerprint_bands(fingerprint):
+    """Splits a fingerprint into its four 16-bit bands, lowest bits first."""
+    return [(fingerprint >> (band * BAND_BITS)) & _BAND_MASK for band in range(BANDS)]
+
+def band_probes(band_value, radius):
+    """Returns the band values within ``radius`` bits (0 or 1) of ``band_value``."""
+    probes = [band_value]
+    if radius >= 1:
+        probes.extend(band_value ^ (1 << bit) for bit in range(BAND_BITS))
+    return probes
+
+def probe_radius(max_distance):
+    """Smallest band radius for which probing the bands finds every match within ``max_distance`` bits."""
+    return max(0, max_distance // BANDS)
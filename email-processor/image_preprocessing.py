@@ -0,0 +1,173 @@
+import os
+import logging
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Preprocessing settings, overridable through the environment (.env)
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', '').lower() in ('1', 'true', 'yes')
+# Pages rasterized above this resolution are downscaled before OCR (0 keeps the resolution)
+OCR_PREPROCESS_DPI = int(os.environ.get('OCR_PREPROCESS_DPI', 0))
+# Adaptive threshold: a pixel is ink when it is this much darker than the mean of its window
+OCR_THRESHOLD_WINDOW_INCHES = float(os.environ.get('OCR_THRESHOLD_WINDOW_INCHES', 0.15))
+OCR_THRESHOLD_OFFSET = int(os.environ.get('OCR_THRESHOLD_OFFSET', 12))
+# Skew angles tried, in degrees (0 disables deskewing)
+OCR_DESKEW_MAX_ANGLE = float(os.environ.get('OCR_DESKEW_MAX_ANGLE', 3.0))
+OCR_DESKEW_STEP = 0.25
+
+# Deskew angles are estimated on a copy of the page at most this wide
+_DESKEW_SAMPLE_WIDTH = 800
+# Edge rows and columns mostly darker than this fraction of the paper are scanner or camera borders
+_BORDER_DARKNESS = 0.6
+_BORDER_INK_FRACTION = 0.5
+# Pixels also dropped inside a border, where it fades into the paper
+_BORDER_SLACK = 3
+# Margin kept around the text when cropping borders, in inches
+_CROP_MARGIN_INCHES = 0.1
+
+def to_grayscale(image):
+    """Returns the page as a 2-D uint8 array, converting colour scans to luminance."""
+    if image.mode != 'L':
+        image = image.convert('L')
+    return np.asarray(image, dtype=np.uint8)
+
+def downscale(image, dpi, target_dpi):
+    """Resizes a page rendered at ``dpi`` down to ``target_dpi``. Returns ``(image, dpi)``."""
+    if not target_dpi or target_dpi >= dpi:
+        return image, dpi
+    scale = target_dpi / dpi
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS), target_dpi
+
+def _window_sums(gray, radius):
+    """Sums every (2 * radius + 1)-pixel square window through an integral image.
+
+    Windows are clipped at the page edges. Returns the sums and the number
+    of pixels in each window; the cost does not depend on the window size.
+    """
+    height, width = gray.shape
+    # The integral may wrap around in 32 bits on large pages, but window sums
+    # are differences far below 2**31, which modular arithmetic keeps exact
+    integral = np.zeros((height + 1, width + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(gray, axis=0, dtype=np.int32), axis=1, out=integral[1:, 1:])
+    # Edge padding clips the windows at the borders, so the corners are plain slices
+    padded = np.pad(integral, ((radius, radius + 1), (radius, radius + 1)), mode='edge')
+    size = 2 * radius + 1
+    sums = (padded[size:size + height, size:size + width] - padded[:height, size:size + width]
+            - padded[size:size + height, :width] + padded[:height, :width])
+    rows = np.arange(height)
+    cols = np.arange(width)
+    counts = ((np.minimum(rows + radius + 1, height) - np.maximum(rows - radius, 0))[:, None]
+              * (np.minimum(cols + radius + 1, width) - np.maximum(cols - radius, 0))[None, :]).astype(np.int32)
+    return sums, counts
+
+def box_blur(gray, radius=1):
+    """Averages each pixel with its neighbours, suppressing sensor noise before thresholding."""
+    sums, counts = _window_sums(gray, radius)
+    return (sums // counts).astype(np.uint8)
+
+def adaptive_threshold(gray, window, offset):
+    """Binarizes against the local mean of a ``window`` x ``window`` neighbourhood.
+
+    Unlike a global threshold this copes with the uneven lighting of
+    phone-scanned pages. Returns 0 for ink and 255 for paper.
+    """
+    sums, counts = _window_sums(gray, max(1, window // 2))
+    # gray * counts < sums - offset * counts  <=>  gray < local mean - offset, without a float array
+    ink = gray.astype(np.int32) * counts < sums - offset * counts
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+def estimate_skew(binary, max_angle=OCR_DESKEW_MAX_ANGLE, step=OCR_DESKEW_STEP):
+    """Estimates the skew of text lines in degrees from a binarized page.
+
+    For each candidate angle the ink pixels are projected onto rows along
+    that angle; the angle aligned with the text lines gives the sharpest
+    profile, i.e. the largest sum of squared row counts.
+    """
+    if max_angle <= 0:
+        return 0.0
+    scale = min(1.0, _DESKEW_SAMPLE_WIDTH / binary.shape[1])
+    if scale < 1.0:
+        step_pixels = int(round(1 / scale))
+        binary = binary[::step_pixels, ::step_pixels]
+    ys, xs = np.nonzero(binary == 0)
+    if len(ys) < 100:
+        return 0.0
+    xs = xs - binary.shape[1] / 2
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        projected = np.round(ys - xs * np.tan(np.radians(angle))).astype(np.int64)
+        counts = np.bincount(projected - projected.min())
+        score = float(np.dot(counts, counts))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def deskew(binary, angle):
+    """Rotates a binarized page by ``angle`` degrees, filling the corners with paper.
+
+    Rotating after binarization keeps the new corners the same white as the
+    paper, where a grayscale rotation would leave edges the threshold picks up.
+    """
+    if abs(angle) < OCR_DESKEW_STEP / 2:
+        return binary
+    rotated = Image.fromarray(binary).rotate(angle, resample=Image.NEAREST, fillcolor=255)
+    return np.asarray(rotated, dtype=np.uint8)
+
+def crop_dark_borders(gray):
+    """Crops the dark scanner or camera borders along the edges of a grayscale page.
+
+    An edge row or column is a border when most of it is much darker than
+    the paper, taken as the median of the page.
+    """
+    dark = gray < np.median(gray) * _BORDER_DARKNESS
+    row_dark = dark.mean(axis=1) > _BORDER_INK_FRACTION
+    col_dark = dark.mean(axis=0) > _BORDER_INK_FRACTION
+    top, bottom = _edge_run(row_dark)
+    left, right = _edge_run(col_dark)
+    if bottom - top < gray.shape[0] // 2 or right - left < gray.shape[1] // 2:
+        return gray # Mostly dark: a dark page rather than a border
+    return gray[top:bottom, left:right]
+
+def _edge_run(is_border):
+    """Returns the bounds inside the border runs at both ends of a row or column mask."""
+    start, end = 0, len(is_border)
+    while start < end and is_border[start]:
+        start += 1
+    while end > start and is_border[end - 1]:
+        end -= 1
+    # The transition into the border is dark too
+    if start:
+        start = min(end, start + _BORDER_SLACK)
+    if end < len(is_border):
+        end = max(start, end - _BORDER_SLACK)
+    return start, end
+
+def crop_margins(binary, margin):
+    """Crops the empty margins around the text of a binarized page, keeping ``margin`` pixels."""
+    ink = binary == 0
+    rows = np.nonzero(ink.any(axis=1))[0]
+    cols = np.nonzero(ink.any(axis=0))[0]
+    if not len(rows):
+        return binary
+    return binary[max(0, rows[0] - margin):rows[-1] + 1 + margin, max(0, cols[0] - margin):cols[-1] + 1 + margin]
+
+def preprocess_page(image, dpi, target_dpi=None):
+    """Prepares a rasterized page for Tesseract: grayscale, downscale, crop borders, binarize, deskew, crop margins.
+
+    ``dpi`` is the resolution the page was rasterized at. Returns a new
+    1-bit-like grayscale PIL image; the input image is left untouched.
+    """
+    target_dpi = OCR_PREPROCESS_DPI if target_dpi is None else target_dpi
+    image, dpi = downscale(image, dpi, target_dpi)
+    gray = to_grayscale(image)
+    window = max(3, int(OCR_THRESHOLD_WINDOW_INCHES * dpi) | 1)
+    # Borders go first: their edges would dominate the skew estimate
+    gray = crop_dark_borders(gray)
+    binary = adaptive_threshold(box_blur(gray), window, OCR_THRESHOLD_OFFSET)
+    angle = estimate_skew(binary)
+    if angle:
+        logger.debug(f"Deskewing page by {angle:.2f} degrees")
+        binary = deskew(binary, angle)
+    return Image.fromarray(crop_margins(binary, int(_CROP_MARGIN_INCHES * dpi)))
@@ -0,0 +1,371 @@
+"""Database-backed job queue that spreads PDF extraction across worker replicas.
+
+Jobs live in the processing_job table. A worker claims one job at a time by
+leasing it: the claim is a single UPDATE, guarded on PostgreSQL by
+SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers never wait on or
+take the same row, and serialized by SQLite's write lock otherwise. While a
+job is processed a heartbeat keeps extending its lease; if the worker dies
+the lease expires and another worker picks the job up. Failed jobs are
+retried with exponential backoff until they run out of attempts.
+
+Usage:
+    python job_queue.py enqueue <directory-or-manifest> [--subject SUBJECT]
+    python job_queue.py work [--worker-id ID] [--exit-when-idle]
+"""
+import os
+import sys
+import random
+import signal
+import socket
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import and_, or_, select, update
+from database import ProcessingJob, check_near_duplicate, db, insert_document
+from fingerprint import FINGERPRINT_MODE, termo_type
+from metrics import inc, stage
+from pdf_extraction import extraction_fingerprint, first_page_fingerprint, process_pdf
+
+logger = logging.getLogger(__name__)
+
+# Queue settings, overridable through the environment (.env)
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300))
+JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', 60))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_BACKOFF_BASE_SECONDS = int(os.environ.get('JOB_BACKOFF_BASE_SECONDS', 30))
+JOB_BACKOFF_MAX_SECONDS = int(os.environ.get('JOB_BACKOFF_MAX_SECONDS', 3600))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+
+JOB_PENDING = 'pending'
+JOB_LEASED = 'leased'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+def _utcnow():
+    # Stored without a time zone, like the other timestamps; every replica must use UTC clocks
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def enqueue_job(pdf_filepath, subject, filename=None, max_attempts=None):
+    """Adds a PDF to the queue and returns the job id. The file must be readable by every worker."""
+    now = _utcnow()
+    job = ProcessingJob(status=JOB_PENDING, pdf_filepath=pdf_filepath, subject=subject,
+                        filename=filename or os.path.basename(pdf_filepath), attempts=0,
+                        max_attempts=max_attempts or JOB_MAX_ATTEMPTS, available_at=now, created_at=now)
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+def claim_job(worker_id, lease_seconds=None):
+    """Leases the next available job to ``worker_id``. Returns the ProcessingJob, or None if there is none.
+
+    A job is available when it is pending and its backoff has elapsed, or when
+    the lease of the worker that held it expired. Claiming counts an attempt.
+    """
+    now = _utcnow()
+    claimable = or_(
+        and_(ProcessingJob.status == JOB_PENDING, ProcessingJob.available_at <= now),
+        and_(ProcessingJob.status == JOB_LEASED, ProcessingJob.lease_expires_at < now,
+             ProcessingJob.attempts < ProcessingJob.max_attempts),
+    )
+    candidate = (select(ProcessingJob.id).where(claimable)
+                 .order_by(ProcessingJob.available_at, ProcessingJob.id).limit(1))
+    if db.engine.dialect.name == 'postgresql':
+        # Skip rows other workers are claiming instead of queueing behind their locks
+        candidate = candidate.with_for_update(skip_locked=True)
+    statement = (
+        update(ProcessingJob)
+        .where(ProcessingJob.id == candidate.scalar_subquery(), claimable)
+        .values(status=JOB_LEASED, lease_owner=worker_id,
+                lease_expires_at=now + timedelta(seconds=lease_seconds or JOB_LEASE_SECONDS),
+                attempts=ProcessingJob.attempts + 1)
+        .returning(ProcessingJob.id)
+        .execution_options(synchronize_session=False)
+    )
+    try:
+        job_id = db.session.execute(statement).scalar()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if job_id is None:
+        return None
+    return db.session.get(ProcessingJob, job_id, populate_existing=True)
+
+def heartbeat(job_id, worker_id, lease_seconds=None):
+    """Extends the lease of a job. Returns False if the worker no longer holds it."""
+    expires = _utcnow() + timedelta(seconds=lease_seconds or JOB_LEASE_SECONDS)
+    try:
+        result = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, ProcessingJob.status == JOB_LEASED,
+                   ProcessingJob.lease_owner == worker_id)
+            .values(lease_expires_at=expires)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result.rowcount == 1
+
+def complete_job(job_id, worker_id, result, document_id=None):
+    """Saves an extraction result and marks its job done, in one transaction.
+
+    With ``result`` None nothing is saved and the job points at the existing
+    ``document_id``, e.g. the document it near-duplicates. Nothing is saved
+    either if the worker lost the lease in the meantime, so a job taken over
+    by another worker does not produce a duplicate document. Returns the
+    PdfDocument id, or None if the lease was lost.
+    """
+    try:
+        if result is not None:
+            with stage("persist"):
+                document_id = insert_document(result)
+        updated = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job_id, ProcessingJob.status == JOB_LEASED,
+                   ProcessingJob.lease_owner == worker_id)
+            .values(status=JOB_DONE, document_id=document_id, finished_at=_utcnow(),
+                    lease_owner=None, lease_expires_at=None, last_error=None)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db.session.rollback()
+            return None
+        db.session.commit()
+        return document_id
+    except Exception:
+        db.session.rollback()
+        raise
+
+def backoff_seconds(attempts):
+    """Delay before retrying a job that failed ``attempts`` times: exponential, capped, with jitter."""
+    delay = min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+def fail_job(job, worker_id, error):
+    """Schedules a retry of a failed job, or marks it failed once it has used all its attempts.
+
+    Returns the new status, or None if the worker no longer held the lease.
+    """
+    now = _utcnow()
+    if job.attempts >= job.max_attempts:
+        values = dict(status=JOB_FAILED, finished_at=now)
+    else:
+        values = dict(status=JOB_PENDING, available_at=now + timedelta(seconds=backoff_seconds(job.attempts)))
+    try:
+        updated = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.id == job.id, ProcessingJob.status == JOB_LEASED,
+                   ProcessingJob.lease_owner == worker_id)
+            .values(lease_owner=None, lease_expires_at=None, last_error=str(error)[:2000], **values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return values["status"] if updated else None
+
+def fail_abandoned_jobs():
+    """Marks failed the jobs whose lease expired after their last allowed attempt. Returns how many."""
+    try:
+        result = db.session.execute(
+            update(ProcessingJob)
+            .where(ProcessingJob.status == JOB_LEASED, ProcessingJob.lease_expires_at < _utcnow(),
+                   ProcessingJob.attempts >= ProcessingJob.max_attempts)
+            .values(status=JOB_FAILED, finished_at=_utcnow(), lease_owner=None, lease_expires_at=None,
+                    last_error="lease expired on the last attempt")
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result.rowcount
+
+def queue_counts():
+    """Returns the number of jobs in each status."""
+    rows = db.session.execute(select(ProcessingJob.status, db.func.count()).group_by(ProcessingJob.status))
+    return dict(rows.all())
+
+class _Heartbeat(threading.Thread):
+    """Keeps extending a job's lease from a background thread while the job is processed."""
+
+    def __init__(self, app, job_id, worker_id, interval, lease_seconds):
+        super().__init__(name=f"heartbeat-{job_id}", daemon=True)
+        self.app = app
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                while not self.stopped.wait(self.interval):
+                    try:
+                        if not heartbeat(self.job_id, self.worker_id, self.lease_seconds):
+                            self.lost = True
+                            logger.warning(f"Lost the lease of job {self.job_id}")
+                            return
+                    except Exception as e:
+                        logger.warning(f"Heartbeat of job {self.job_id} failed: {e}")
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def process_job(job):
+    """Extracts the PDF of a job and checks whether it near-duplicates a stored document.
+
+    In FINGERPRINT_MODE "skip" the first page is read and checked before the
+    full extraction, so a skipped near-duplicate is never fully processed. In
+    "flag" mode nothing is skipped, so page 1 is taken from the full
+    extraction instead of being read, and possibly OCRed, twice. Returns
+    ``(result, duplicate_of_id)``, where ``result`` is the dict expected by
+    ``document_mapping``, or None if the PDF was skipped.
+    """
+    fingerprint, duplicate_of_id = None, None
+    if FINGERPRINT_MODE == 'skip':
+        fingerprint, first_page_data, tipo_termo = first_page_fingerprint(job.pdf_filepath, job.subject)
+        duplicate_of_id, skip = check_near_duplicate(fingerprint, first_page_data, tipo_termo)
+        if skip:
+            return None, duplicate_of_id
+    text, data = process_pdf(job.pdf_filepath)
+    if not text.strip():
+        raise ValueError("no text could be extracted")
+    if fingerprint is None and FINGERPRINT_MODE != 'off':
+        # Flag mode, or a single-page scan whose first page only the full extraction reads
+        fingerprint = extraction_fingerprint(job.pdf_filepath, text)
+        duplicate_of_id, skip = check_near_duplicate(fingerprint, data, termo_type(text, job.subject))
+        if skip:
+            return None, duplicate_of_id
+    result = dict(data, subject=job.subject, filename=job.filename, extracted_text=text,
+                  processed_at=datetime.now(timezone.utc), pdf_filepath=job.pdf_filepath,
+                  fingerprint=fingerprint, duplicate_of_id=duplicate_of_id)
+    return result, duplicate_of_id
+
+def _report_completion(job, result, document_id):
+    if document_id is None:
+        inc("pdf_jobs_total", outcome="lease_lost")
+        logger.warning(f"Discarded the result of job {job.id}: its lease was taken over")
+    elif result is None:
+        inc("pdf_jobs_total", outcome=JOB_DONE)
+        logger.info(f"Job {job.id} skipped as a near-duplicate of document {document_id}")
+    else:
+        inc("pdf_jobs_total", outcome=JOB_DONE)
+        logger.info(f"Job {job.id} saved as document {document_id}")
+
+def run_worker(worker_id=None, stop_event=None, exit_when_idle=False, max_jobs=None,
+               lease_seconds=None, heartbeat_seconds=None, poll_seconds=None):
+    """Claims and processes jobs until stopped. Must run inside a Flask app context.
+
+    Returns the number of jobs processed. Run one worker per process, and as
+    many processes or replicas as needed: they coordinate through the table.
+    """
+    worker_id = worker_id or default_worker_id()
+    stop_event = stop_event or threading.Event()
+    lease_seconds = lease_seconds or JOB_LEASE_SECONDS
+    heartbeat_seconds = heartbeat_seconds or min(JOB_HEARTBEAT_SECONDS, lease_seconds / 3)
+    poll_seconds = JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+    app = current_app._get_current_object()
+    processed = 0
+    logger.info(f"Worker {worker_id} started")
+
+    while not stop_event.is_set() and (max_jobs is None or processed < max_jobs):
+        try:
+            job = claim_job(worker_id, lease_seconds)
+            abandoned = fail_abandoned_jobs() if job is None else 0
+        except Exception as e:
+            logger.error(f"Worker {worker_id} could not claim a job: {e}")
+            stop_event.wait(poll_seconds)
+            continue
+        if job is None:
+            if abandoned:
+                logger.warning(f"Marked {abandoned} abandoned jobs as failed")
+            if exit_when_idle:
+                break
+            stop_event.wait(poll_seconds)
+            continue
+
+        logger.info(f"Worker {worker_id} processing job {job.id} ({job.filename}), attempt {job.attempts}")
+        beat = _Heartbeat(app, job.id, worker_id, heartbeat_seconds, lease_seconds)
+        beat.start()
+        try:
+            result, duplicate_of_id = process_job(job)
+        except Exception as e:
+            beat.stop()
+            logger.error(f"Job {job.id} ({job.filename}) failed on attempt {job.attempts}: {e}")
+            try:
+                status = fail_job(job, worker_id, e)
+            except Exception as db_error:
+                # The lease expires and the job is retried, as if this worker had died
+                inc("pdf_jobs_total", outcome="db_error")
+                logger.error(f"Worker {worker_id} could not record the failure of job {job.id}: {db_error}")
+                stop_event.wait(poll_seconds)
+            else:
+                inc("pdf_jobs_total", outcome="retry" if status == JOB_PENDING else status or "lease_lost")
+        else:
+            beat.stop()
+            try:
+                document_id = complete_job(job.id, worker_id, result, duplicate_of_id)
+            except Exception as db_error:
+                # Nothing was saved; the lease expires and the job is retried
+                inc("pdf_jobs_total", outcome="db_error")
+                logger.error(f"Worker {worker_id} could not save the result of job {job.id}: {db_error}")
+                stop_event.wait(poll_seconds)
+            else:
+                _report_completion(job, result, document_id)
+        processed += 1
+
+    logger.info(f"Worker {worker_id} stopped after {processed} jobs")
+    return processed
+
+def main(argv=None):
+    from batch_ingest import DEFAULT_SUBJECT, create_app, iter_source_files
+
+    parser = argparse.ArgumentParser(description="Shared PDF extraction queue.")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///site.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    enqueue = commands.add_parser('enqueue', help="queue a directory or manifest of PDFs")
+    enqueue.add_argument('source', help="directory to walk, or manifest file with one PDF path per line")
+    enqueue.add_argument('--subject', default=DEFAULT_SUBJECT, help="subject stored for files without one")
+    work = commands.add_parser('work', help="process queued jobs")
+    work.add_argument('--worker-id', help="name of this worker (default: host:pid)")
+    work.add_argument('--exit-when-idle', action='store_true', help="stop when no job is available")
+    work.add_argument('--max-jobs', type=int, help="stop after this many jobs")
+    commands.add_parser('status', help="print the number of jobs in each status")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    with create_app(args.database_url).app_context():
+        db.create_all()
+        if args.command == 'enqueue':
+            count = 0
+            for pdf_path, subject in iter_source_files(args.source, args.subject):
+                enqueue_job(os.path.abspath(pdf_path), subject)
+                count += 1
+            print(f"Queued {count} files")
+        elif args.command == 'work':
+            stop_event = threading.Event()
+            # Finish the current job before stopping on docker stop / Ctrl+C
+            signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+            signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+            run_worker(args.worker_id, stop_event, args.exit_when_idle, args.max_jobs)
+        else:
+            for status, count in sorted(queue_counts().items()):
+                print(f"{status}: {count}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+import os
+import io
+import json
+import time
+import pstats
+import bisect
+import logging
+import cProfile
+import tempfile
+import threading
+from contextlib import contextmanager
+from flask import Blueprint, Response
+
+logger = logging.getLogger(__name__)
+
+# Metrics settings, overridable through the environment (.env).
+# "{pid}" in the metrics file name is replaced by the process id, so each
+# gunicorn or batch worker writes its own file.
+METRICS_FILE = os.environ.get('METRICS_FILE')
+# Documents slower than this many seconds get a cProfile dump (0 disables profiling)
+PROFILE_SLOW_DOCUMENT_SECONDS = float(os.environ.get('PROFILE_SLOW_DOCUMENT_SECONDS', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'email-processor-profiles'))
+
+# Histogram buckets in seconds, from a fast text-layer page to a long scanned document
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_HELP = {
+    "pdf_stage_seconds": "Time spent in each extraction stage.",
+    "pdf_document_seconds": "Time spent processing a whole document.",
+    "pdf_pages_total": "Pages processed, by how their text was obtained.",
+    "pdf_ocr_fallback_documents_total": "Documents that needed OCR for at least one page.",
+    "pdf_documents_total": "Documents processed, by outcome.",
+    "pdf_failures_total": "Failures, by the innermost extraction stage they passed through.",
+    "pdf_layout_documents_total": "Layout-aware extractions, by whether the regions sufficed or full-page OCR was needed.",
+    "pdf_jobs_total": "Queued jobs finished by a worker, by outcome (done, retry, failed, lease_lost, db_error).",
+    "pdf_pipeline_attachments_total": "Email attachments handled by the ingestion pipeline, by outcome (saved, already_saved, skipped, failed).",
+    "pdf_near_duplicates_total": "Near-duplicates of stored documents found at ingestion, by action (flagged, skipped).",
+    "pdf_ocr_pixels_total": "Pixels passed to the OCR engine, after layout cropping and preprocessing.",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_local = threading.local()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, amount=1, **labels):
+    """Increments a counter."""
+    with _lock:
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+def counter_value(name, **labels):
+    """Returns the current value of a counter, 0 if it was never incremented."""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+def observe(name, seconds, **labels):
+    """Records a duration in a histogram."""
+    with _lock:
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(DEFAULT_BUCKETS, seconds)
+        if index < len(DEFAULT_BUCKETS):
+            histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+def record_stage(stage_name, seconds, page=None):
+    """Records a stage duration that was measured elsewhere, e.g. in an OCR worker process."""
+    observe("pdf_stage_seconds", seconds, stage=stage_name)
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace["stages"].append({"stage": stage_name, "page": page, "seconds": round(seconds, 6)})
+
+def count_failure(stage_name, error):
+    """Counts ``error`` in ``pdf_failures_total``, unless this process already counted it.
+
+    A failure is counted by the innermost ``stage`` it passes through, so a
+    handler further out may call this for errors that passed through no
+    stage without counting the others twice. The mark is the process id: an
+    error re-raised from a pool worker, whose metrics are lost, still counts.
+    """
+    if getattr(error, "_failure_counted_by", None) == os.getpid():
+        return
+    inc("pdf_failures_total", stage=stage_name)
+    try:
+        error._failure_counted_by = os.getpid()
+    except AttributeError:
+        pass # Exceptions without a __dict__ cannot be marked
+
+@contextmanager
+def stage(stage_name, page=None):
+    """Times a pipeline stage (text_layer, rasterize, preprocess, ocr, normalize, extract_fields,
+    persist).
+
+    The duration goes to the ``pdf_stage_seconds`` histogram and, inside
+    ``document_trace``, to the per-document timing record. Exceptions are
+    counted with ``count_failure`` and re-raised.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        count_failure(stage_name, e)
+        raise
+    finally:
+        record_stage(stage_name, time.perf_counter() - start, page)
+
+@contextmanager
+def document_trace(document_name):
+    """Collects the stage timings of one document and logs them as a single JSON record.
+
+    When PROFILE_SLOW_DOCUMENT_SECONDS is set, the document is run under
+    cProfile and the profile is dumped to PROFILE_DIR if it was slower than
+    the threshold. Yields the trace dict, where callers may add fields.
+    """
+    if getattr(_local, "trace", None) is not None:
+        # Already traced by an outer call: its record covers this one
+        yield _local.trace
+        return
+
+    trace = {"document": document_name, "stages": []}
+    _local.trace = trace
+    profiler = cProfile.Profile() if PROFILE_SLOW_DOCUMENT_SECONDS > 0 else None
+    status = "ok"
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield trace
+    except Exception:
+        status = "failed"
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        elapsed = time.perf_counter() - start
+        _local.trace = None
+        trace["status"] = status
+        trace["seconds"] = round(elapsed, 6)
+        observe("pdf_document_seconds", elapsed)
+        inc("pdf_documents_total", status=status)
+        logger.info(f"Document timings: {json.dumps(trace, ensure_ascii=False)}")
+        if profiler and elapsed >= PROFILE_SLOW_DOCUMENT_SECONDS:
+            _dump_profile(profiler, document_name, elapsed)
+        if METRICS_FILE:
+            write_prometheus()
+
+def _dump_profile(profiler, document_name, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(char if char.isalnum() or char in "-_." else "_" for char in os.path.basename(document_name))
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{safe_name}.prof")
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(15)
+    logger.warning(f"Slow document {document_name} took {elapsed:.1f}s; profile written to {path}\n{summary.getvalue()}")
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus():
+    """Renders every counter and histogram in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((key, {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]})
+                            for key, value in _histograms.items())
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in counters:
+        declare(name, "counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in histograms:
+        declare(name, "histogram")
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, histogram["buckets"]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path=None):
+    """Writes the metrics to a file, e.g. for the node_exporter textfile collector."""
+    path = (path or METRICS_FILE).replace("{pid}", str(os.getpid()))
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            file.write(render_prometheus())
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics file {path}: {e}")
+
+def reset_metrics():
+    """Clears every counter and histogram."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+metrics_blueprint = Blueprint('metrics', __name__)
+
+@metrics_blueprint.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint; register with ``app.register_blueprint(metrics_blueprint)``."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -1,11 +1,29 @@
 import os
 import re
+import json
+import atexit
 import logging
+import tempfile
+import threading
 import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import pytesseract
 import unicodedata
+try:
+    import tesserocr # Optional: keeps the Tesseract engine loaded in-process
+except ImportError:
+    tesserocr = None
+from image_preprocessing import (
+    OCR_DESKEW_MAX_ANGLE, OCR_PREPROCESS, OCR_PREPROCESS_DPI, OCR_THRESHOLD_OFFSET, OCR_THRESHOLD_WINDOW_INCHES,
+    preprocess_page,
+)
+from extraction_cache import ExtractionCache, get_extraction_cache, hash_pdf_file
+from fingerprint import first_page_text, simhash, termo_type
+from metrics import count_failure, document_trace, inc, record_stage, stage
+from pdf_source import InMemoryPdf, open_pdf_stream, rasterizer_path, store_pdf
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +39,114 @@ if os.path.exists(poppler_path) and poppler_path not in os.environ['PATH']:
     os.environ['PATH'] += os.pathsep + poppler_path
     logger.info(f"Added Poppler path to environment PATH: {poppler_path}")
 
+# OCR settings, overridable through the environment (.env)
+OCR_LANG = os.environ.get('OCR_LANG', 'por')
+# Parallel OCR is opt-in; OCR_WORKERS defaults to the number of CPUs
+OCR_PARALLEL = os.environ.get('OCR_PARALLEL', '').lower() in ('1', 'true', 'yes')
+OCR_WORKERS = int(os.environ.get('OCR_WORKERS') or os.cpu_count() or 1)
+# Rasterization resolution, and how many rasterized pages may be held in memory at once
+OCR_DPI = int(os.environ.get('OCR_DPI', 200))
+OCR_MAX_RESIDENT_PAGES = int(os.environ.get('OCR_MAX_RESIDENT_PAGES', 1))
+# OCR engine: "tesserocr" (in-process, loaded once per worker), "batch" (one
+# tesseract run per window of pages), "pytesseract" (one tesseract run per
+# image) or "auto" for tesserocr when it is installed and pytesseract otherwise
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'auto').lower()
+
+# A page's text layer is used instead of OCR when it has at least this many
+# non-space characters and enough of them are letters or digits
+TEXT_LAYER_MIN_CHARS = int(os.environ.get('TEXT_LAYER_MIN_CHARS', 20))
+TEXT_LAYER_MIN_ALNUM_RATIO = float(os.environ.get('TEXT_LAYER_MIN_ALNUM_RATIO', 0.5))
+
+# Layout-aware OCR: scanned termos are OCRed only inside these regions, given
+# as [page, left, top, right, bottom] with coordinates as fractions of the
+# page size. The default covers the header, the equipment block and the
+# "São Paulo, dd de mês de aaaa" line of a standard first page, and skips the
+# legal boilerplate and any further pages.
+OCR_LAYOUT_MODE = os.environ.get('OCR_LAYOUT_MODE', '').lower() in ('1', 'true', 'yes')
+OCR_LAYOUT_REGIONS = json.loads(os.environ.get('OCR_LAYOUT_REGIONS') or '[[1, 0.0, 0.0, 1.0, 0.6]]')
+# Early termination: stop reading pages once every required field has been found
+OCR_EARLY_STOP = os.environ.get('OCR_EARLY_STOP', '').lower() in ('1', 'true', 'yes')
+# What early termination does with the pages after the fields: "eager" reads
+# them before returning, so the stored text is complete; "lazy" returns the
+# text of the pages read, marked incomplete, and leaves the rest to
+# database.complete_extracted_texts for archival
+OCR_FULL_TEXT = os.environ.get('OCR_FULL_TEXT', 'eager').lower()
+# Fields that must be found in the layout regions, or the document is OCRed in
+# full; the early-termination mode stops as soon as all of them are found
+REQUIRED_FIELDS = ("nome", "matricula", "cpf", "equipamentos", "data")
+
+# How each page's text was obtained, as recorded by extract_pages_from_pdf
+PAGE_TEXT_LAYER = 'text'
+PAGE_OCR = 'ocr'
+PAGE_OCR_FAILED = 'ocr_failed'
+
+# Field extraction patterns, compiled once at import.
+# Labels are plain strings located with str.find, which is much faster than
+# scanning the text with a regular expression; only the R.G. label needs one.
+_LABELS = {
+    "empregado": "empregado:",
+    "matricula": "matricula:",
+    "funcao": "funcao:",
+    "empregador": "empregador:",
+    "cpf": "cpf:",
+    "ferramentas": "ferramentas:",
+    "declaro": "declaro",
+}
+_RG_LABEL_PREFIX = "r.g. n"
+_RG_LABEL_RE = re.compile(r"r\.g\. n(?:º|°)?:")
+# (field, label that precedes the value, label that ends it)
+_LABELED_FIELDS = (
+    ("nome", "empregado", "matricula"),
+    ("matricula", "matricula", "funcao"),
+    ("funcao", "funcao", "rg"),
+    ("rg", "rg", "empregador"),
+    ("empregador", "empregador", "cpf"),
+)
+_DATE_PREFIX = "sao paulo,"
+_RG_EXTRA_LABEL_RE = re.compile(r"\s*nº:")
+_CPF_VALUE_RE = re.compile(r"\s*([\d\.\-]{11,14}|)")
+_DATE_RE = re.compile(r"sao paulo,\s*(\d{1,2})\s*de\s*([a-zçãõáéíóúàèìòùâêîôûäëïöüñ]+)\s*de\s*(\d{4})")
+_MONTHS = {
+    "janeiro": "01", "fevereiro": "02", "marco": "03", "abril": "04", "maio": "05", "junho": "06",
+    "julho": "07", "agosto": "08", "setembro": "09", "outubro": "10", "novembro": "11", "dezembro": "12"
+}
+# Equipment lines: IMEI and patrimônio tokens are parsed by one combined pattern
+_EQUIPMENT_TOKEN_RE = re.compile(r"imei:\s*(?P<imei>\S+)|patrimonio:\s*(?P<patrimonio>\S+)", re.IGNORECASE)
+_IMEI_LABEL_RE = re.compile(r"imei:", re.IGNORECASE)
+_IMEI_RE = re.compile(r"imei:\s*(\S+)", re.IGNORECASE)
+_PATRIMONIO_RE = re.compile(r"patrimonio:\s*(\S+)", re.IGNORECASE)
+_EQUIPMENT_PREFIX_RE = re.compile(r"^equipamento:\s*", re.IGNORECASE)
+
+# Bump whenever a change to the extraction logic would alter cached results
+EXTRACTOR_VERSION = '5'
+
+# Process pool shared by every parallel OCR call in this process
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+# OCR backends of this process, by (backend name, language)
+_ocr_backends = {}
+_ocr_backends_pid = None
+_ocr_backends_lock = threading.Lock()
+
+
+class IncompleteExtractionError(RuntimeError):
+    """Raised by ``process_pdf`` when some pages could not be OCRed.
+
+    The partial result is kept in ``text`` and ``data``; it is not cached, so
+    the document is extracted again on the next attempt.
+    """
+
+    def __init__(self, pdf_path, failed_pages, text, data):
+        super().__init__(f"OCR failed on page(s) {', '.join(map(str, failed_pages))} of {pdf_path}")
+        self.pdf_path = str(pdf_path)
+        self.failed_pages = failed_pages
+        self.text = text
+        self.data = data
+
+    def __reduce__(self):
+        # Raised inside pool workers, so it must survive pickling
+        return type(self), (self.pdf_path, self.failed_pages, self.text, self.data)
 
 def check_tesseract_installed():
     """Checks if Tesseract OCR is installed and accessible."""
@@ -57,42 +183,662 @@ def normalize_text(text):
     normalized_text = normalized_text.encode('ascii', 'ignore').decode('utf-8').lower()
     return normalized_text
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a PDF file using OCR if direct extraction fails."""
-    logger.info(f"Attempting to extract text from PDF: {pdf_path}")
-    text = ""
+def get_ocr_pool(max_workers=None):
+    """Returns the process pool used for parallel OCR, creating it on first use."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            workers = max_workers or OCR_WORKERS
+            _ocr_pool = ProcessPoolExecutor(max_workers=workers)
+            logger.info(f"Started OCR process pool with {workers} workers.")
+        return _ocr_pool
+
+def shutdown_ocr_pool():
+    """Shuts down the parallel OCR process pool, if one was started."""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=True)
+            _ocr_pool = None
+
+atexit.register(shutdown_ocr_pool)
+
+def _page_windows(page_numbers, window):
+    """Groups sorted page numbers into runs of consecutive pages at most ``window`` long."""
+    runs = []
+    for page_number in page_numbers:
+        if runs and page_number == runs[-1][-1] + 1 and len(runs[-1]) < window:
+            runs[-1].append(page_number)
+        else:
+            runs.append([page_number])
+    return runs
+
+def iter_pdf_page_windows(pdf_path, dpi=None, max_resident_pages=None, page_numbers=None):
+    """Rasterizes a PDF lazily, yielding lists of ``(page_number, image)`` pairs.
+
+    At most ``max_resident_pages`` pages are rasterized at a time and each
+    window is closed before the next one is rendered, so peak memory depends
+    on the window size rather than on the page count of the document.
+    ``page_numbers`` restricts rasterization to the given (1-based) pages.
+    """
+    dpi = dpi or OCR_DPI
+    window = max(1, max_resident_pages or OCR_MAX_RESIDENT_PAGES)
+    if page_numbers is None:
+        page_numbers = range(1, pdfinfo_from_path(rasterizer_path(pdf_path))['Pages'] + 1)
+    for run in _page_windows(sorted(page_numbers), window):
+        with stage("rasterize", page=run[0]):
+            images = convert_from_path(rasterizer_path(pdf_path), dpi=dpi, first_page=run[0], last_page=run[-1])
+        try:
+            yield list(zip(run, images))
+        finally:
+            for image in images:
+                image.close()
+            del images
+
+def iter_pdf_page_images(pdf_path, dpi=None, max_resident_pages=None, page_numbers=None):
+    """Rasterizes a PDF lazily, yielding ``(page_number, image)`` pairs; see ``iter_pdf_page_windows``."""
+    for window in iter_pdf_page_windows(pdf_path, dpi, max_resident_pages, page_numbers):
+        yield from window
+
+class PytesseractBackend:
+    """Runs one tesseract process per image through pytesseract. Always available."""
+
+    name = 'pytesseract'
+
+    def __init__(self, lang):
+        self.lang = lang
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def images_to_strings(self, images):
+        return [self.image_to_string(image) for image in images]
+
+    def close(self):
+        pass
+
+class BatchTesseractBackend(PytesseractBackend):
+    """OCRs a list of images in a single tesseract run, loading the language model once per batch."""
+
+    name = 'batch'
+
+    def images_to_strings(self, images):
+        if len(images) < 2:
+            return super().images_to_strings(images)
+        with tempfile.TemporaryDirectory(prefix='ocr-batch-') as directory:
+            paths = []
+            for index, image in enumerate(images):
+                path = os.path.join(directory, f"{index:05d}.png")
+                image.save(path)
+                paths.append(path)
+            list_path = os.path.join(directory, 'images.txt')
+            with open(list_path, 'w') as list_file:
+                list_file.write("\n".join(paths) + "\n")
+            result = subprocess.run([pytesseract.pytesseract.tesseract_cmd, list_path, 'stdout', '-l', self.lang],
+                                    capture_output=True, check=True)
+        # Tesseract ends every page with a form feed, as in pytesseract's output
+        texts = result.stdout.decode('utf-8').split('\f')[:len(images)]
+        if len(texts) != len(images):
+            raise RuntimeError(f"tesseract returned {len(texts)} pages for a batch of {len(images)} images")
+        return [text + '\f' for text in texts]
+
+class TesserocrBackend:
+    """Keeps a Tesseract engine loaded in this process through the tesserocr binding.
+
+    Loading the language model once per process, rather than once per page,
+    removes the process spawn, temporary files and model load that
+    dominate the OCR time of small pages.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang):
+        self.lang = lang
+        self._api = tesserocr.PyTessBaseAPI(lang=lang)
+        self._lock = threading.Lock()
+
+    def image_to_string(self, image):
+        with self._lock:
+            self._api.SetImage(image)
+            # Match the page separator of the tesseract command line output
+            return self._api.GetUTF8Text() + '\f'
+
+    def images_to_strings(self, images):
+        return [self.image_to_string(image) for image in images]
+
+    def close(self):
+        with self._lock:
+            self._api.End()
+
+OCR_BACKENDS = {
+    PytesseractBackend.name: PytesseractBackend,
+    BatchTesseractBackend.name: BatchTesseractBackend,
+    TesserocrBackend.name: TesserocrBackend,
+}
+
+def ocr_backend_name(name=None):
+    """Resolves a backend name, OCR_BACKEND by default, picking the backend that "auto" stands for."""
+    name = name or OCR_BACKEND
+    if name == 'auto':
+        return TesserocrBackend.name if tesserocr is not None else PytesseractBackend.name
+    return name
+
+def get_ocr_backend(lang=None, name=None):
+    """Returns this process's OCR backend for a language, creating it on first use.
+
+    Backends are kept for the life of the process, so pool and batch
+    workers reuse one engine across all their documents. An unavailable
+    backend falls back to pytesseract.
+    """
+    global _ocr_backends_pid
+    lang = lang or OCR_LANG
+    name = ocr_backend_name(name)
+    with _ocr_backends_lock:
+        if _ocr_backends_pid != os.getpid():
+            # A forked child must not share the engines of its parent
+            _ocr_backends.clear()
+            _ocr_backends_pid = os.getpid()
+        backend = _ocr_backends.get((name, lang))
+        if backend is None:
+            try:
+                if name == TesserocrBackend.name and tesserocr is None:
+                    raise ImportError("tesserocr is not installed")
+                backend = OCR_BACKENDS[name](lang)
+            except Exception as e:
+                logger.warning(f"OCR backend {name!r} is unavailable: {e}. Falling back to pytesseract.")
+                backend = PytesseractBackend(lang)
+            else:
+                logger.info(f"Started the {name} OCR backend for language {lang}")
+            _ocr_backends[(name, lang)] = backend
+        return backend
+
+def shutdown_ocr_backends():
+    """Releases the OCR engines of this process."""
+    with _ocr_backends_lock:
+        for backend in _ocr_backends.values():
+            backend.close()
+        _ocr_backends.clear()
+
+atexit.register(shutdown_ocr_backends)
+
+def _ocr_images(images, lang, dpi, page_numbers):
+    """OCRs rasterized pages or regions in one backend call, preprocessing them first when OCR_PREPROCESS is set."""
+    if OCR_PREPROCESS:
+        prepared = []
+        for image, page_number in zip(images, page_numbers):
+            with stage("preprocess", page=page_number):
+                prepared.append(preprocess_page(image, dpi))
+        images = prepared
+    start = time.perf_counter()
+    texts = get_ocr_backend(lang).images_to_strings(images)
+    seconds = (time.perf_counter() - start) / max(1, len(images))
+    for page_number in page_numbers:
+        record_stage("ocr", seconds, page=page_number)
+    inc("pdf_ocr_pixels_total", sum(image.size[0] * image.size[1] for image in images))
+    return texts
+
+def _ocr_image(image, lang, dpi, page=None):
+    return _ocr_images([image], lang, dpi, [page])[0]
+
+def _ocr_page(pdf_path, page_number, lang, dpi, preprocess):
+    """Rasterizes and OCRs a single page. Runs inside the OCR process pool.
+
+    Returns ``(text, timings, pixels)`` where ``timings`` maps stage names
+    to seconds and ``pixels`` is the size of the OCRed image; they are
+    recorded by the parent process, which owns the metrics.
+    """
+    start = time.perf_counter()
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    timings = {"rasterize": time.perf_counter() - start}
+    try:
+        image = images[0]
+        if preprocess:
+            start = time.perf_counter()
+            image = preprocess_page(image, dpi)
+            timings["preprocess"] = time.perf_counter() - start
+        start = time.perf_counter()
+        text = get_ocr_backend(lang).image_to_string(image)
+        timings["ocr"] = time.perf_counter() - start
+        return text, timings, image.size[0] * image.size[1]
+    finally:
+        images[0].close()
+
+def _extract_text_layer_pages(pdf_path):
+    """Returns the PyPDF2 text of every page, or None if the PDF cannot be parsed."""
     try:
         from PyPDF2 import PdfReader
-        with open(pdf_path, 'rb') as file:
+        with open_pdf_stream(pdf_path) as file:
             reader = PdfReader(file)
-            for page_num in range(len(reader.pages)):
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text
-        
-        if text.strip():
-            logger.info(f"Successfully extracted text directly from PDF: {pdf_path}")
-            return text
-        else:
-            logger.info(f"No direct text extracted from {pdf_path}, attempting OCR.")
-
+            page_texts = []
+            for page_num, page in enumerate(reader.pages):
+                try:
+                    page_texts.append(page.extract_text() or "")
+                except Exception as e:
+                    logger.warning(f"Direct text extraction failed for page {page_num+1} of {pdf_path}: {e}.")
+                    page_texts.append("")
+            return page_texts
     except Exception as e:
         logger.warning(f"Direct text extraction failed for {pdf_path}: {e}. Attempting OCR.")
-    
+        return None
+
+def is_plausible_text_layer(page_text):
+    """Tells whether a page's embedded text is usable, rather than empty or garbage."""
+    characters = "".join(page_text.split())
+    if len(characters) < TEXT_LAYER_MIN_CHARS:
+        return False
+    alphanumeric = sum(1 for char in characters if char.isalnum())
+    return alphanumeric / len(characters) >= TEXT_LAYER_MIN_ALNUM_RATIO
+
+def _plan_pages(pdf_path):
+    """Reads the text layer and decides, page by page, whether it can be used or OCR is needed."""
+    with stage("text_layer"):
+        page_texts = _extract_text_layer_pages(pdf_path)
+    if page_texts is None:
+        page_texts = [""] * pdfinfo_from_path(rasterizer_path(pdf_path))['Pages']
+    return [
+        {
+            "page": page_number,
+            "method": PAGE_TEXT_LAYER if is_plausible_text_layer(page_text) else PAGE_OCR,
+            "text": page_text,
+        }
+        for page_number, page_text in enumerate(page_texts, start=1)
+    ]
+
+def _pages_needing_ocr(pages):
+    return {page["page"]: page for page in pages if page["method"] == PAGE_OCR}
+
+def _submit_ocr_pages(pool, pdf_path, page_numbers, lang, dpi):
+    """Submits one OCR task per page and returns ``(page_number, future)`` pairs in page order."""
+    logger.info(f"Performing parallel OCR on {len(page_numbers)} pages of {pdf_path}")
+    return [(page_number, pool.submit(_ocr_page, rasterizer_path(pdf_path), page_number, lang, dpi, OCR_PREPROCESS))
+            for page_number in page_numbers]
+
+def _collect_ocr_results(pdf_path, ocr_pages, page_results):
+    """Stores OCR results on their pages, marking the pages that could not be OCRed."""
+    done = set()
     try:
-        images = convert_from_path(pdf_path)
-        for i, image in enumerate(images):
-            logger.info(f"Performing OCR on page {i+1} of {pdf_path}")
-            page_text = pytesseract.image_to_string(image, lang='por')
-            text += page_text + "\n"
+        for page_number, page_text in page_results:
+            ocr_pages[page_number]["text"] = page_text
+            done.add(page_number)
         logger.info(f"Successfully extracted text from PDF using OCR: {pdf_path}")
     except Exception as e:
+        count_failure("ocr", e)
         logger.error(f"Error extracting text from PDF {pdf_path} using OCR: {e}. Make sure Tesseract and Poppler are installed and configured correctly.")
-    return text
+    for page_number, page in ocr_pages.items():
+        if page_number not in done:
+            page["method"] = PAGE_OCR_FAILED
+
+def _iter_sequential_ocr(pdf_path, page_numbers, lang, dpi, max_resident_pages):
+    # Each window of pages goes to the backend in one call, so the batch backend runs tesseract once per window
+    for window in iter_pdf_page_windows(pdf_path, dpi, max_resident_pages, page_numbers):
+        window_pages = [page_number for page_number, _ in window]
+        logger.info(f"Performing OCR on pages {', '.join(map(str, window_pages))} of {pdf_path}")
+        texts = _ocr_images([image for _, image in window], lang, dpi, window_pages)
+        yield from zip(window_pages, texts)
+
+def _iter_pool_ocr(futures):
+    """Yields the OCR results of pool futures, recording the timings measured in the workers."""
+    for page_number, future in futures:
+        page_text, timings, pixels = future.result()
+        for stage_name, seconds in timings.items():
+            record_stage(stage_name, seconds, page=page_number)
+        inc("pdf_ocr_pixels_total", pixels)
+        yield page_number, page_text
+
+def _log_page_routes(pdf_path, pages):
+    counts = summarize_page_routes(pages)
+    for method, count in counts.items():
+        if count:
+            inc("pdf_pages_total", count, method=method)
+    if counts[PAGE_OCR] or counts[PAGE_OCR_FAILED]:
+        inc("pdf_ocr_fallback_documents_total")
+    logger.info(f"Used the text layer for {counts[PAGE_TEXT_LAYER]} and OCR for "
+                f"{counts[PAGE_OCR]} of {len(pages)} pages of {pdf_path}"
+                + (f" ({counts[PAGE_OCR_FAILED]} failed)" if counts[PAGE_OCR_FAILED] else ""))
+
+def summarize_page_routes(pages):
+    """Counts the pages of an ``extract_pages_from_pdf`` result by extraction method."""
+    counts = {PAGE_TEXT_LAYER: 0, PAGE_OCR: 0, PAGE_OCR_FAILED: 0}
+    for page in pages:
+        counts[page["method"]] += 1
+    return counts
+
+def join_page_texts(pages):
+    """Joins page texts into the document text: OCRed pages are newline-terminated."""
+    return "".join(page["text"] + "\n" if page["method"] == PAGE_OCR else page["text"]
+                   for page in pages)
+
+def extract_pages_from_pdf(pdf_path, parallel=None, max_workers=None, lang=None, dpi=None,
+                           max_resident_pages=None):
+    """Extracts the text of each page, using the text layer where it is usable and OCR elsewhere.
+
+    Returns one ``{"page", "method", "text"}`` dict per page, where ``method``
+    records the path taken: PAGE_TEXT_LAYER, PAGE_OCR or PAGE_OCR_FAILED.
+    With ``parallel=True`` (or OCR_PARALLEL set) the pages are OCRed
+    concurrently on the shared process pool. Otherwise pages are rasterized
+    and OCRed as a stream, keeping at most ``max_resident_pages`` page images
+    in memory.
+    """
+    logger.info(f"Attempting to extract text from PDF: {pdf_path}")
+    parallel = OCR_PARALLEL if parallel is None else parallel
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    try:
+        pages = _plan_pages(pdf_path)
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF {pdf_path}: {e}. Make sure Poppler is installed and configured correctly.")
+        return []
+    _ocr_planned_pages(pdf_path, pages, parallel, max_workers, lang, dpi, max_resident_pages)
+    return pages
+
+def _ocr_planned_pages(pdf_path, pages, parallel, max_workers, lang, dpi, max_resident_pages):
+    """OCRs the pages that ``_plan_pages`` routed to OCR, storing the text on each page."""
+    ocr_pages = _pages_needing_ocr(pages)
+    if ocr_pages:
+        if parallel:
+            futures = _submit_ocr_pages(get_ocr_pool(max_workers), pdf_path, list(ocr_pages), lang, dpi)
+            results = _iter_pool_ocr(futures)
+        else:
+            results = _iter_sequential_ocr(pdf_path, list(ocr_pages), lang, dpi, max_resident_pages)
+        _collect_ocr_results(pdf_path, ocr_pages, results)
+    _log_page_routes(pdf_path, pages)
+
+def extract_text_from_pdf(pdf_path, parallel=None, max_workers=None, lang=None, dpi=None,
+                          max_resident_pages=None):
+    """Extracts text from a PDF file, OCRing only the pages without a usable text layer."""
+    pages = extract_pages_from_pdf(pdf_path, parallel, max_workers, lang, dpi, max_resident_pages)
+    return join_page_texts(pages)
+
+def extract_pages_from_pdfs(pdf_paths, max_workers=None, lang=None, dpi=None):
+    """Extracts the pages of many PDFs, sharing one process pool for all OCR pages.
+
+    Pages of every PDF in the batch are queued on the pool at once so idle
+    workers pick up pages of the next document while the current one is still
+    being OCRed. Returns the page lists in the same order as ``pdf_paths``.
+    """
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    pool = get_ocr_pool(max_workers)
+    documents = []
+    for pdf_path in pdf_paths:
+        logger.info(f"Attempting to extract text from PDF: {pdf_path}")
+        try:
+            pages = _plan_pages(pdf_path)
+        except Exception as e:
+            logger.error(f"Error extracting text from PDF {pdf_path}: {e}. Make sure Poppler is installed and configured correctly.")
+            pages = []
+        ocr_pages = _pages_needing_ocr(pages)
+        futures = _submit_ocr_pages(pool, pdf_path, list(ocr_pages), lang, dpi) if ocr_pages else []
+        documents.append((pdf_path, pages, ocr_pages, futures))
+
+    results = []
+    for pdf_path, pages, ocr_pages, futures in documents:
+        if ocr_pages:
+            _collect_ocr_results(pdf_path, ocr_pages, _iter_pool_ocr(futures))
+        _log_page_routes(pdf_path, pages)
+        results.append(pages)
+    return results
+
+def extract_text_from_pdfs(pdf_paths, max_workers=None, lang=None, dpi=None):
+    """Extracts text from many PDFs in parallel. Returns the texts in the order of ``pdf_paths``."""
+    return [join_page_texts(pages) for pages in extract_pages_from_pdfs(pdf_paths, max_workers, lang, dpi)]
+
+def _open_page_reader(pdf_path):
+    """Returns a PyPDF2 reader (None if the PDF cannot be parsed) and the page count."""
+    try:
+        from PyPDF2 import PdfReader
+        reader = PdfReader(pdf_path.open_stream() if isinstance(pdf_path, InMemoryPdf) else pdf_path)
+        return reader, len(reader.pages)
+    except Exception as e:
+        logger.warning(f"Direct text extraction failed for {pdf_path}: {e}. Attempting OCR.")
+        return None, pdfinfo_from_path(rasterizer_path(pdf_path))['Pages']
+
+def _read_text_layer(pdf_path, reader, page_number):
+    if reader is None:
+        return ""
+    try:
+        with stage("text_layer", page=page_number):
+            return reader.pages[page_number - 1].extract_text() or ""
+    except Exception as e:
+        logger.warning(f"Direct text extraction failed for page {page_number} of {pdf_path}: {e}.")
+        return ""
+
+def _read_page(pdf_path, reader, page_number, lang, dpi):
+    """Reads one page from its text layer, OCRing it if the text layer is not usable."""
+    page_text = _read_text_layer(pdf_path, reader, page_number)
+    page = {"page": page_number, "method": PAGE_TEXT_LAYER, "text": page_text}
+    if not is_plausible_text_layer(page_text):
+        page["method"] = PAGE_OCR
+        try:
+            for _, image in iter_pdf_page_images(pdf_path, dpi, page_numbers=[page_number]):
+                logger.info(f"Performing OCR on page {page_number} of {pdf_path}")
+                page["text"] = _ocr_image(image, lang, dpi, page_number)
+        except Exception as e:
+            count_failure("ocr", e)
+            logger.error(f"Error extracting text from page {page_number} of PDF {pdf_path} using OCR: {e}")
+            page["method"] = PAGE_OCR_FAILED
+    return page
+
+def iter_pdf_pages(pdf_path, lang=None, dpi=None):
+    """Yields the pages of a PDF one at a time as ``{"page", "method", "text"}`` dicts.
+
+    Each page's text layer is read, and the page OCRed if needed, only when
+    the consumer asks for it, so a consumer that stops early never pays for
+    the remaining pages.
+    """
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    reader, page_count = _open_page_reader(pdf_path)
+    for page_number in range(1, page_count + 1):
+        yield _read_page(pdf_path, reader, page_number, lang, dpi)
+
+def read_first_page(pdf_path, lang=None, dpi=None, ocr_single_page=False):
+    """Reads only the first page of a PDF, for a quick look before full processing.
+
+    The text layer is used when it is usable, otherwise the page is OCRed.
+    A single-page scan is not OCRed unless ``ocr_single_page`` is set: the
+    full extraction would OCR the same page again, so callers should rather
+    look at its result. Returns the ``{"page", "method", "text"}`` dict of
+    page 1, or None.
+    """
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    reader, page_count = _open_page_reader(pdf_path)
+    if not page_count:
+        return None
+    page_text = _read_text_layer(pdf_path, reader, 1)
+    if is_plausible_text_layer(page_text):
+        return {"page": 1, "method": PAGE_TEXT_LAYER, "text": page_text}
+    if page_count == 1 and not ocr_single_page:
+        return None
+    page = _read_page(pdf_path, reader, 1, lang, dpi)
+    return page if page["method"] != PAGE_OCR_FAILED else None
+
+def first_page_fingerprint(pdf_path, subject=None, lang=None, dpi=None):
+    """Fingerprints the first page of a PDF before full processing, for the near-duplicate check.
+
+    Returns ``(fingerprint, data, tipo_termo)`` where ``data`` holds the
+    fields found on that page and ``tipo_termo`` the type read from its title
+    or from ``subject``, or ``(None, None, None)`` when ``read_first_page``
+    gives no text.
+    """
+    page = read_first_page(pdf_path, lang, dpi)
+    fingerprint = simhash(page["text"]) if page else None
+    if fingerprint is None:
+        return None, None, None
+    return fingerprint, extract_text_fields(page["text"]), termo_type(page["text"], subject)
+
+def first_page_of_extraction(pdf_path, text):
+    """Returns the text of page 1 of a PDF whose full ``text`` was already extracted, without OCRing it again.
+
+    Text-layer pages are joined without a separator, so page 1 is read again
+    from its text layer when that is usable, which is cheap. Otherwise page 1
+    was OCRed, and its text runs up to the form feed that ends every OCRed
+    page. Returns None if page 1 cannot be recovered.
+    """
+    try:
+        reader, page_count = _open_page_reader(pdf_path)
+    except Exception as e:
+        logger.warning(f"Could not open {pdf_path} to read its first page: {e}")
+        return None
+    if not page_count:
+        return None
+    page_text = _read_text_layer(pdf_path, reader, 1)
+    if is_plausible_text_layer(page_text):
+        return page_text
+    return first_page_text(text) if "\f" in text else None
+
+def extraction_fingerprint(pdf_path, text):
+    """Fingerprints page 1 of an extracted PDF (see ``first_page_of_extraction``). Returns None if it cannot be read."""
+    first_page = first_page_of_extraction(pdf_path, text)
+    return simhash(first_page) if first_page else None
+
+def _crop_region(image, region):
+    _, left, top, right, bottom = region
+    width, height = image.size
+    return image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+
+def _ocr_layout_regions(pdf_path, pages, regions, lang, dpi):
+    """OCRs only the layout regions of the pages that need OCR. Returns the pages the text is made of.
+
+    Pages with a usable text layer are kept whole, as they cost nothing to
+    read; the pages with regions come back as copies holding their region
+    texts, leaving ``pages`` free for a full-page fallback; pages that need
+    OCR but have no region are left out.
+    """
+    regions_by_page = {}
+    for region in regions:
+        regions_by_page.setdefault(int(region[0]), []).append(region)
+    ocr_page_numbers = [page_number for page_number in _pages_needing_ocr(pages) if page_number in regions_by_page]
+    region_texts = {}
+    for page_number, image in iter_pdf_page_images(pdf_path, dpi, page_numbers=ocr_page_numbers):
+        crops = [_crop_region(image, region) for region in regions_by_page[page_number]]
+        try:
+            texts = _ocr_images(crops, lang, dpi, [page_number] * len(crops))
+        finally:
+            for crop in crops:
+                crop.close()
+        region_texts[page_number] = "\n".join(texts)
+    return [page if page["method"] == PAGE_TEXT_LAYER else dict(page, text=region_texts[page["page"]])
+            for page in pages if page["method"] == PAGE_TEXT_LAYER or page["page"] in region_texts]
+
+def missing_fields(data):
+    """Returns the REQUIRED_FIELDS that an ``extract_data_from_text`` result lacks."""
+    return [field for field in REQUIRED_FIELDS if not data.get(field)]
+
+def extract_with_layout(pdf_path, regions=None, parallel=None, max_workers=None, lang=None, dpi=None,
+                        max_resident_pages=None):
+    """Extracts a termo by OCRing only its layout regions. Returns ``(text, data)``.
+
+    Scanned pages are OCRed only inside ``regions`` (OCR_LAYOUT_REGIONS by
+    default), which skips the boilerplate and most of the pixels of a
+    standard termo. If any of the REQUIRED_FIELDS comes back empty, the
+    document is OCRed in full as ``extract_text_from_pdf`` would. The text
+    returned by the region path joins the text-layer pages with the region
+    texts of the scanned pages, so its ``data`` has ``"text_complete": False``
+    and ``database.complete_extracted_texts`` can OCR the whole pages later.
+    """
+    text, data, _ = _extract_with_layout(pdf_path, regions, parallel, max_workers, lang, dpi, max_resident_pages)
+    return text, data
+
+def _extract_with_layout(pdf_path, regions=None, parallel=None, max_workers=None, lang=None, dpi=None,
+                         max_resident_pages=None):
+    """``extract_with_layout``, also returning the planned pages, whose methods record any OCR failure."""
+    logger.info(f"Attempting layout-aware extraction from PDF: {pdf_path}")
+    parallel = OCR_PARALLEL if parallel is None else parallel
+    regions = regions or OCR_LAYOUT_REGIONS
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    try:
+        pages = _plan_pages(pdf_path)
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF {pdf_path}: {e}. Make sure Poppler is installed and configured correctly.")
+        return "", extract_text_fields(""), []
+
+    region_pages = {int(region[0]) for region in regions}
+    if region_pages & set(_pages_needing_ocr(pages)):
+        try:
+            read_pages = _ocr_layout_regions(pdf_path, pages, regions, lang, dpi)
+            text = join_page_texts(read_pages)
+            data = extract_text_fields(text)
+            missing = missing_fields(data)
+        except Exception as e:
+            count_failure("ocr", e)
+            logger.error(f"Layout OCR failed for PDF {pdf_path}: {e}")
+            missing = list(REQUIRED_FIELDS)
+        if not missing:
+            inc("pdf_layout_documents_total", result="regions")
+            logger.info(f"Extracted every required field from the layout regions of {pdf_path}; "
+                        f"{len(pages) - len(read_pages)} scanned pages without regions were not OCRed")
+            _log_page_routes(pdf_path, read_pages)
+            return text, dict(data, text_complete=False), read_pages
+        inc("pdf_layout_documents_total", result="fallback")
+        logger.info(f"Layout regions of {pdf_path} lack {', '.join(missing)}; falling back to full-page OCR")
+
+    _ocr_planned_pages(pdf_path, pages, parallel, max_workers, lang, dpi, max_resident_pages)
+    text = join_page_texts(pages)
+    return text, extract_text_fields(text), pages
+
+def _find_label(text, label, pos=0):
+    """Returns the ``(start, end)`` span of the first occurrence of a label at or after ``pos``."""
+    if label == "rg":
+        start = text.find(_RG_LABEL_PREFIX, pos)
+        while start >= 0:
+            match = _RG_LABEL_RE.match(text, start)
+            if match:
+                return match.span()
+            start = text.find(_RG_LABEL_PREFIX, start + 1)
+        return None
+    literal = _LABELS[label]
+    start = text.find(literal, pos)
+    return (start, start + len(literal)) if start >= 0 else None
+
+def _field_between(text, start_label, end_label):
+    """Returns the stripped text between a start label and the first end label after it."""
+    start = _find_label(text, start_label)
+    if start is None:
+        return None
+    value_start = start[1]
+    if start_label == "rg":
+        # The R.G. label is sometimes followed by a second "nº:"
+        prefix_match = _RG_EXTRA_LABEL_RE.match(text, value_start)
+        if prefix_match:
+            value_start = prefix_match.end()
+    end = _find_label(text, end_label, value_start)
+    if end is None:
+        return None
+    return text[value_start:end[0]].strip()
+
+def _parse_equipment_line(line):
+    """Splits an equipment line into its name, IMEI and patrimônio."""
+    tokens = _EQUIPMENT_TOKEN_RE.findall(line)
+    if not tokens:
+        return _EQUIPMENT_PREFIX_RE.sub("", line).strip(), None, None
+
+    imeis = [imei for imei, _ in tokens if imei]
+    if len(imeis) == len(_IMEI_LABEL_RE.findall(line)):
+        imei = imeis[0] if imeis else None
+        patrimonio = next((patrimonio for _, patrimonio in tokens if patrimonio), None)
+        equipment_name = _EQUIPMENT_TOKEN_RE.sub("", line).strip()
+    else:
+        # An "imei:" label is part of another token's value, e.g. "patrimonio: imei: 123".
+        # Resolve it the way sequential IMEI-then-patrimônio removal does.
+        imei_match = _IMEI_RE.search(line)
+        imei = imei_match.group(1) if imei_match else None
+        equipment_name = _IMEI_RE.sub("", line).strip()
+        patrimonio_match = _PATRIMONIO_RE.search(equipment_name)
+        patrimonio = patrimonio_match.group(1) if patrimonio_match else None
+        equipment_name = _PATRIMONIO_RE.sub("", equipment_name).strip()
+
+    equipment_name = _EQUIPMENT_PREFIX_RE.sub("", equipment_name).strip()
+    return equipment_name, imei, patrimonio
 
 def extract_data_from_text(text):
-    """Extracts specific data points from the given text."""
+    """Extracts specific data points from the given text.
+
+    Each field is sliced out between its label and the first following
+    label, both located with plain substring searches.
+    """
     data = {
         "nome": None,
         "matricula": None,
@@ -104,65 +850,24 @@ def extract_data_from_text(text):
         "data": None
     }
 
-    # Use the user-provided logic for extraction
-    # Nome
-    nome_match = re.search(r"empregado:\s*(.*?)\s*matricula:", text, re.DOTALL)
-    if nome_match:
-        data["nome"] = nome_match.group(1).strip()
-
-    # Matricula
-    matricula_match = re.search(r"matricula:\s*(.*?)\s*funcao:", text, re.DOTALL)
-    if matricula_match:
-        data["matricula"] = matricula_match.group(1).strip()
-
-    # Função
-    funcao_match = re.search(r"funcao:\s*(.*?)\s*r\.g\. n(?:º|°)?:", text, re.DOTALL)
-    if funcao_match:
-        data["funcao"] = funcao_match.group(1).strip()
-
-    # RG
-    rg_match = re.search(r"r\.g\. n(?:º|°)?:(?:\s*nº:)?\s*(.*?)\s*empregador:", text, re.DOTALL)
-    if rg_match:
-        data["rg"] = rg_match.group(1).strip()
-
-    # Empregador
-    empregador_match = re.search(r"empregador:\s*(.*?)\s*cpf:", text, re.DOTALL)
-    if empregador_match:
-        data["empregador"] = empregador_match.group(1).strip()
-
-    # CPF - Adjusted to be more precise and stop before the junk text
-    cpf_match = re.search(r"cpf:\s*([\d\.\-]{11,14}|)", text, re.DOTALL)
-    if cpf_match:
-        data["cpf"] = cpf_match.group(1).strip()
-        if not data["cpf"]:
-            data["cpf"] = ""
-
-    # Equipamentos - Refined based on new user feedback
-    equipamentos_block_match = re.search(r"ferramentas:\s*(.*?)\s*declaro", text, re.DOTALL)
-    if equipamentos_block_match:
-        equipamentos_block = equipamentos_block_match.group(1).strip()
-        
+    # Nome, matrícula, função, RG and empregador sit between consecutive labels
+    for field, start_label, end_label in _LABELED_FIELDS:
+        data[field] = _field_between(text, start_label, end_label)
+
+    # CPF - Capture only the CPF pattern, allowing it to be empty
+    cpf_label = _find_label(text, "cpf")
+    if cpf_label is not None:
+        data["cpf"] = _CPF_VALUE_RE.match(text, cpf_label[1]).group(1).strip()
+
+    # Equipamentos - the block between "ferramentas:" and "declaro", one equipment per line
+    equipamentos_block = _field_between(text, "ferramentas", "declaro")
+    if equipamentos_block:
         for line in equipamentos_block.split('\n'):
             line = line.strip()
             if not line:
                 continue
 
-            equipment_name = line
-            imei = None
-            patrimonio = None
-
-            imei_match = re.search(r"imei:\s*(\S+)", equipment_name, re.IGNORECASE)
-            if imei_match:
-                imei = imei_match.group(1).strip()
-                equipment_name = re.sub(r"imei:\s*\S+", "", equipment_name, flags=re.IGNORECASE).strip()
-
-            patrimonio_match = re.search(r"patrimonio:\s*(\S+)", equipment_name, re.IGNORECASE)
-            if patrimonio_match:
-                patrimonio = patrimonio_match.group(1).strip()
-                equipment_name = re.sub(r"patrimonio:\s*\S+", "", equipment_name, flags=re.IGNORECASE).strip()
-            
-            equipment_name = re.sub(r"^equipamento:\s*", "", equipment_name, flags=re.IGNORECASE).strip()
-
+            equipment_name, imei, patrimonio = _parse_equipment_line(line)
             if equipment_name:
                 equipment_info = {"nome_equipamento": equipment_name}
                 if imei:
@@ -172,20 +877,201 @@ def extract_data_from_text(text):
                 data["equipamentos"].append(equipment_info)
 
     # Date
-    date_match = re.search(r"sao paulo,\s*(\d{1,2})\s*de\s*([a-zçãõáéíóúàèìòùâêîôûäëïöüñ]+)\s*de\s*(\d{4})", text)
-    if date_match:
-        day = date_match.group(1)
-        month_name = date_match.group(2)
-        year = date_match.group(3)
-        
-        month_mapping = {
-            "janeiro": "01", "fevereiro": "02", "marco": "03", "abril": "04", "maio": "05", "junho": "06",
-            "julho": "07", "agosto": "08", "setembro": "09", "outubro": "10", "novembro": "11", "dezembro": "12"
-        }
-        month = month_mapping.get(month_name, "00")
+    start = text.find(_DATE_PREFIX)
+    while start >= 0:
+        date_match = _DATE_RE.match(text, start)
+        if not date_match:
+            start = text.find(_DATE_PREFIX, start + 1)
+            continue
+        day, month_name, year = date_match.groups()
+        month = _MONTHS.get(month_name, "00")
         if month != "00":
             data["data"] = f"{day}/{month}/{year}"
         else:
             logger.warning(f"Could not parse month name: {month_name}")
+        break
 
     return data
+
+class IncrementalExtractor:
+    """Parses termo fields from a stream of pages, reading only as many pages as needed.
+
+    ``pages`` is an iterator of page dicts such as ``iter_pdf_pages`` yields.
+    ``extract_fields`` pulls pages until every one of REQUIRED_FIELDS has been
+    found; ``full_text`` reads the remaining pages later on, e.g. to archive
+    the whole document. Fields take the first occurrence of their labels, so
+    pages read after the fields are complete cannot change them.
+    """
+
+    def __init__(self, pages):
+        self._pages = iter(pages)
+        self._normalized_parts = []
+        self.pages = []
+        self.exhausted = False
+        self.data = extract_data_from_text("")
+
+    @property
+    def complete(self):
+        return not missing_fields(self.data)
+
+    @property
+    def text(self):
+        """The text of the pages read so far, joined like ``join_page_texts``."""
+        return join_page_texts(self.pages)
+
+    def _read_page(self):
+        page = next(self._pages, None)
+        if page is None:
+            self.exhausted = True
+        else:
+            self.pages.append(page)
+        return page
+
+    def extract_fields(self):
+        """Reads pages until the required fields are found or the document ends. Returns the field dict."""
+        while not self.complete:
+            page = self._read_page()
+            if page is None:
+                break
+            with stage("normalize"):
+                self._normalized_parts.append(normalize_text(join_page_texts([page])))
+            with stage("extract_fields"):
+                self.data = extract_data_from_text("".join(self._normalized_parts))
+        return self.data
+
+    def full_text(self):
+        """Reads every remaining page and returns the text of the whole document."""
+        while self._read_page() is not None:
+            pass
+        return self.text
+
+    def close(self):
+        """Stops the page stream without reading the remaining pages."""
+        close = getattr(self._pages, "close", None)
+        if close:
+            close()
+
+def extract_until_complete(pdf_path, lang=None, dpi=None, full_text=False):
+    """Extracts the fields of a PDF, stopping at the first page where all of them are found.
+
+    Returns ``(text, data)``. With ``full_text`` the remaining pages are read
+    once the fields are parsed, and ``text`` covers the whole document;
+    otherwise it covers only the pages that were read, and ``data`` has
+    ``"text_complete": False`` when pages were left unread.
+    """
+    text, data, _ = _extract_until_complete(pdf_path, lang, dpi, full_text)
+    return text, data
+
+def _extract_until_complete(pdf_path, lang, dpi, full_text=False):
+    """``extract_until_complete``, also returning the pages that were read."""
+    logger.info(f"Attempting early-terminating extraction from PDF: {pdf_path}")
+    extractor = IncrementalExtractor(iter_pdf_pages(pdf_path, lang, dpi))
+    try:
+        data = extractor.extract_fields()
+        if full_text:
+            extractor.full_text()
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF {pdf_path}: {e}. Make sure Poppler is installed and configured correctly.")
+        return "", extract_data_from_text(""), []
+    finally:
+        extractor.close()
+    if not extractor.exhausted:
+        logger.info(f"Found every required field after {len(extractor.pages)} pages of {pdf_path}; skipped the rest")
+        data = dict(data, text_complete=False)
+    _log_page_routes(pdf_path, extractor.pages)
+    return extractor.text, data, extractor.pages
+
+def _settings_version():
+    """The part of the cache version given by the settings that change the text of every document."""
+    version = (f"{EXTRACTOR_VERSION}:text_layer:{TEXT_LAYER_MIN_CHARS}:{TEXT_LAYER_MIN_ALNUM_RATIO}"
+               f":backend:{ocr_backend_name()}")
+    if OCR_PREPROCESS:
+        version += (f":preprocess:{OCR_PREPROCESS_DPI}:{OCR_THRESHOLD_WINDOW_INCHES}:{OCR_THRESHOLD_OFFSET}"
+                    f":{OCR_DESKEW_MAX_ANGLE}")
+    return version
+
+def process_pdf(pdf_path, cache=None, lang=None, dpi=None, layout=None, early_stop=None, full_text=None, **kwargs):
+    """Extracts the raw text and the field data of a PDF, reusing cached results.
+
+    ``pdf_path`` is a file path or an ``InMemoryPdf``.
+
+    Results are cached by the SHA-256 of the PDF contents together with the
+    OCR language, DPI, EXTRACTOR_VERSION and the settings that change what
+    is read (``_settings_version``), so a re-sent attachment skips
+    rasterization and OCR entirely. Pass ``cache=False`` to bypass the cache.
+    With ``layout=True`` (or OCR_LAYOUT_MODE set) scanned pages are OCRed
+    through ``extract_with_layout``. With ``early_stop=True`` (or
+    OCR_EARLY_STOP set) fields are parsed page by page until every required
+    field is found; the layout mode takes precedence when both are set,
+    since it already confines OCR to the pages holding the fields. Then,
+    with ``full_text="eager"`` (the OCR_FULL_TEXT default), the remaining
+    pages are read and the whole text is returned and cached as a full
+    extraction. With ``full_text="lazy"`` they are not read: the text covers
+    the pages read, ``data`` has ``"text_complete": False``, the result is
+    cached apart from full extractions, and the ingestion paths store the
+    flag so ``database.complete_extracted_texts`` reads the rest later.
+    Returns a ``(text, data)`` tuple. Raises ``IncompleteExtractionError``,
+    without caching anything, if any page could not be OCRed, including the
+    full-page fallback of the layout mode.
+    """
+    lang = lang or OCR_LANG
+    dpi = dpi or OCR_DPI
+    layout = OCR_LAYOUT_MODE if layout is None else layout
+    early_stop = OCR_EARLY_STOP if early_stop is None else early_stop
+    full_text = OCR_FULL_TEXT if full_text is None else full_text
+    if cache is None:
+        cache = get_extraction_cache()
+    version = _settings_version()
+    if layout:
+        # The regions decide what is OCRed, so results of different regions must not share entries
+        version += f":layout:{json.dumps(kwargs.get('regions') or OCR_LAYOUT_REGIONS)}"
+    elif early_stop and full_text == 'lazy':
+        # Partial texts must never be served to readers expecting the whole document
+        version += ":early"
+
+    with document_trace(str(pdf_path)) as trace:
+        key = None
+        if cache:
+            pdf_hash = pdf_path.sha256() if isinstance(pdf_path, InMemoryPdf) else hash_pdf_file(pdf_path)
+            key = ExtractionCache.make_key(pdf_hash, lang, dpi, version)
+            cached = cache.get(key)
+            trace["cache_hit"] = cached is not None
+            if cached is not None:
+                logger.info(f"Using cached extraction result for PDF: {pdf_path}")
+                return cached["text"], cached["data"]
+
+        if layout:
+            text, data, pages = _extract_with_layout(pdf_path, lang=lang, dpi=dpi, **kwargs)
+        elif early_stop:
+            text, data, pages = _extract_until_complete(pdf_path, lang, dpi, full_text=full_text != 'lazy')
+        else:
+            pages = extract_pages_from_pdf(pdf_path, lang=lang, dpi=dpi, **kwargs)
+            text = join_page_texts(pages)
+            data = extract_text_fields(text)
+        trace["pages"] = len(pages)
+        failed_pages = [page["page"] for page in pages if page["method"] == PAGE_OCR_FAILED]
+        if failed_pages:
+            raise IncompleteExtractionError(pdf_path, failed_pages, text, data)
+        if key and text.strip():
+            cache.put(key, text, data)
+        return text, data
+
+def extract_text_fields(text):
+    """Normalizes extracted text and parses its fields, timing both stages."""
+    with stage("normalize"):
+        normalized = normalize_text(text)
+    with stage("extract_fields"):
+        return extract_data_from_text(normalized)
+
+def process_pdf_data(data, name="attachment.pdf", keep_original=False, storage_dir=None, **kwargs):
+    """Extracts a PDF given as bytes, a buffer or a file-like object, without writing it to disk.
+
+    The original is written to PDF_STORAGE_DIR (or ``storage_dir``) only when
+    ``keep_original`` is set. Other keyword arguments go to ``process_pdf``.
+    Returns ``(text, data, pdf_filepath)``, where ``pdf_filepath`` is None
+    unless the original was kept.
+    """
+    with InMemoryPdf(data, name) as source:
+        text, extracted = process_pdf(source, **kwargs)
+        pdf_filepath = store_pdf(source, storage_dir) if keep_original else None
+    return text, extracted, pdf_filepath
@@ -0,0 +1,125 @@
+import io
+import os
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Where originals are written when a caller asks to keep the PDF (PdfDocument.pdf_filepath)
+PDF_STORAGE_DIR = os.environ.get(
+    'PDF_STORAGE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pdfs'),
+)
+# Fallback for the rasterizer when memfd_create is unavailable: tmpfs if present
+_SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+class InMemoryPdf:
+    """A PDF held in memory, e.g. an email attachment, processed without writing it to disk.
+
+    The text layer is parsed straight from the buffer. pdftoppm needs a file
+    name, so ``rasterizer_path`` exposes the bytes through a memory-backed
+    file (memfd on Linux, tmpfs or a temporary file elsewhere), created only
+    when a page actually has to be rasterized. Use as a context manager, or
+    call ``close``, to release it.
+    """
+
+    def __init__(self, data, name="attachment.pdf"):
+        if isinstance(data, memoryview) and data.contiguous and isinstance(data.obj, bytes) \
+                and data.nbytes == len(data.obj):
+            data = data.obj # The whole bytes object: no need to copy it
+        elif hasattr(data, 'read'):
+            data = data.read()
+        if not isinstance(data, bytes):
+            # bytearray and partial views are copied once so the buffer cannot change under us
+            data = bytes(data)
+        self.data = data
+        self.name = name
+        self._fd = None
+        self._tmp_path = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return self.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open_stream(self):
+        """Returns a binary stream over the PDF. BytesIO shares the bytes object rather than copying it."""
+        return io.BytesIO(self.data)
+
+    def sha256(self):
+        return hashlib.sha256(memoryview(self.data)).hexdigest()
+
+    @property
+    def rasterizer_path(self):
+        """A file name that other processes (pdftoppm, OCR workers) can open to read the PDF."""
+        with self._lock:
+            if self._fd is None and self._tmp_path is None:
+                self._materialize()
+            if self._fd is not None:
+                return f"/proc/{os.getpid()}/fd/{self._fd}"
+            return self._tmp_path
+
+    def _materialize(self):
+        if hasattr(os, 'memfd_create'):
+            try:
+                fd = os.memfd_create(self.name, 0)
+                self._write_all(fd)
+                self._fd = fd
+                return
+            except OSError as e:
+                logger.warning(f"memfd_create failed for {self.name}: {e}. Falling back to a temporary file.")
+        fd, self._tmp_path = tempfile.mkstemp(suffix='.pdf', dir=_SHARED_MEMORY_DIR)
+        try:
+            self._write_all(fd)
+        finally:
+            os.close(fd)
+
+    def _write_all(self, fd):
+        view = memoryview(self.data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            if self._tmp_path is not None:
+                try:
+                    os.remove(self._tmp_path)
+                except OSError:
+                    pass
+                self._tmp_path = None
+
+def open_pdf_stream(pdf_path):
+    """Opens a path or an InMemoryPdf as a binary stream, for PyPDF2."""
+    if isinstance(pdf_path, InMemoryPdf):
+        return pdf_path.open_stream()
+    return open(pdf_path, 'rb')
+
+def rasterizer_path(pdf_path):
+    """Returns the file name pdf2image should read for a path or an InMemoryPdf."""
+    if isinstance(pdf_path, InMemoryPdf):
+        return pdf_path.rasterizer_path
+    return pdf_path
+
+def store_pdf(source, directory=None):
+    """Writes an InMemoryPdf to PDF_STORAGE_DIR and returns the path of the stored copy."""
+    directory = directory or PDF_STORAGE_DIR
+    os.makedirs(directory, exist_ok=True)
+    # Attachment names come from the sender: keep only safe characters
+    base_name = "".join(char if char.isalnum() or char in "-_." else "_" for char in os.path.basename(source.name))
+    base_name = base_name.lstrip(".") or "attachment.pdf"
+    path = os.path.join(directory, f"{uuid.uuid4().hex}_{base_name}")
+    with open(path, 'wb') as file:
+        file.write(source.data)
+    return path
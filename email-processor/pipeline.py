@@ -0,0 +1,472 @@
+"""Asynchronous ingestion pipeline from the mailbox to the database.
+
+Three stages run concurrently, connected by bounded queues:
+
+    fetch (mailbox) --> extract (process pool) --> write (batched inserts)
+
+A slow OCR job no longer stalls mailbox polling, and a slow database no
+longer stalls OCR. When a downstream stage falls behind its queue fills up
+and the upstream stage waits, so memory stays bounded however large the
+mailbox is. A message is marked as read only once all its PDF attachments
+are saved; on shutdown the fetcher stops and the queued attachments are
+drained through extraction and the database first. A message left unread
+because one attachment failed is fetched again later, and the attachments
+already saved from it are recognized by their ``source_key`` and skipped.
+
+Usage:
+    python pipeline.py [--once]
+"""
+import os
+import sys
+import email
+import signal
+import hashlib
+import asyncio
+import imaplib
+import logging
+import argparse
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from email import policy
+from email.message import EmailMessage
+from database import check_near_duplicate, db, find_document_by_source, insert_documents_checking_duplicates
+from fingerprint import FINGERPRINT_MODE, termo_type
+from metrics import inc
+from pdf_extraction import OCR_WORKERS, extraction_fingerprint, first_page_fingerprint, process_pdf_data
+from pdf_source import InMemoryPdf
+
+logger = logging.getLogger(__name__)
+
+# Mailbox settings, overridable through the environment (.env)
+EMAIL_ADDRESS = os.environ.get('EMAIL_ADDRESS')
+EMAIL_PASSWORD = os.environ.get('EMAIL_PASSWORD')
+IMAP_SERVER = os.environ.get('IMAP_SERVER', 'imap.gmail.com')
+IMAP_FOLDER = os.environ.get('IMAP_FOLDER', 'INBOX')
+# Server-side search; subjects are then matched against EMAIL_SUBJECTS, ignoring case and accents
+IMAP_SEARCH_CRITERIA = os.environ.get('IMAP_SEARCH_CRITERIA', '(UNSEEN SUBJECT "termo")')
+EMAIL_SUBJECTS = [subject.strip() for subject in os.environ.get(
+    'EMAIL_SUBJECTS', 'termo de recebimento,termo de devolução').split(',') if subject.strip()]
+# Seconds between mailbox polls when there is nothing new
+PIPELINE_POLL_SECONDS = float(os.environ.get('PIPELINE_POLL_SECONDS', 60))
+# Attachments waiting for extraction, and results waiting for the database, before upstream stages wait
+PIPELINE_EXTRACT_QUEUE_SIZE = int(os.environ.get('PIPELINE_EXTRACT_QUEUE_SIZE', 8))
+PIPELINE_WRITE_QUEUE_SIZE = int(os.environ.get('PIPELINE_WRITE_QUEUE_SIZE', 100))
+# Documents saved per transaction, and the longest a partial batch waits for more
+PIPELINE_WRITE_BATCH_SIZE = int(os.environ.get('PIPELINE_WRITE_BATCH_SIZE', 50))
+PIPELINE_WRITE_MAX_DELAY = float(os.environ.get('PIPELINE_WRITE_MAX_DELAY', 2.0))
+# Keep the original attachments in PDF_STORAGE_DIR (PdfDocument.pdf_filepath)
+PIPELINE_KEEP_ORIGINALS = os.environ.get('PIPELINE_KEEP_ORIGINALS', 'true').lower() in ('1', 'true', 'yes')
+
+_STOP = object()
+
+def _fold(text):
+    """Lowercases and strips accents, so "Devolução" matches "devolucao"."""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def subject_matches(subject, subjects=None):
+    subjects = EMAIL_SUBJECTS if subjects is None else subjects
+    folded = _fold(subject)
+    return any(_fold(candidate) in folded for candidate in subjects)
+
+def pdf_attachments(message):
+    """Returns ``(filename, bytes)`` for every PDF attached to a parsed email."""
+    attachments = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        if part.get_content_type() == 'application/pdf' or (filename or '').lower().endswith('.pdf'):
+            payload = part.get_payload(decode=True)
+            if payload:
+                attachments.append((filename or 'attachment.pdf', payload))
+    return attachments
+
+class ImapMailbox:
+    """An IMAP folder read through imaplib.
+
+    imaplib blocks and is not thread-safe, so every call runs on one
+    dedicated thread and the event loop stays free. Messages are fetched with
+    BODY.PEEK, leaving them unread until ``mark_seen``. The connection is
+    opened on first use and reopened after an error.
+    """
+
+    def __init__(self, server=None, address=None, password=None, folder=None, criteria=None):
+        self.server = server or IMAP_SERVER
+        self.address = address or EMAIL_ADDRESS
+        self.password = password or EMAIL_PASSWORD
+        self.folder = folder or IMAP_FOLDER
+        self.criteria = criteria or IMAP_SEARCH_CRITERIA
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='imap')
+
+    async def _call(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _connect(self):
+        if self._connection is None:
+            connection = imaplib.IMAP4_SSL(self.server)
+            connection.login(self.address, self.password)
+            connection.select(self.folder)
+            self._connection = connection
+        return self._connection
+
+    def _command(self, *args):
+        try:
+            status, data = self._connect().uid(*args)
+        except (imaplib.IMAP4.abort, OSError):
+            self._disconnect()
+            raise
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"IMAP {args[0]} failed: {data!r}")
+        return data
+
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.logout()
+            except Exception:
+                pass
+            self._connection = None
+
+    async def search(self):
+        """Returns the uids of the candidate messages, oldest first."""
+        data = await self._call(self._command, 'SEARCH', None, self.criteria)
+        return [uid.decode() for uid in data[0].split()]
+
+    async def fetch(self, uid):
+        """Returns the raw RFC 822 bytes of a message without marking it as read."""
+        data = await self._call(self._command, 'FETCH', uid, '(BODY.PEEK[])')
+        for item in data:
+            if isinstance(item, tuple):
+                return item[1]
+        raise imaplib.IMAP4.error(f"Message {uid} has no body")
+
+    async def mark_seen(self, uid):
+        await self._call(self._command, 'STORE', uid, '+FLAGS', '(\\Seen)')
+
+    async def close(self):
+        await self._call(self._disconnect)
+        self._executor.shutdown(wait=True)
+
+class InMemoryMailbox:
+    """A mailbox held in memory, with the interface of ``ImapMailbox``, for tests and benchmarks.
+
+    ``latency`` seconds are awaited on every call to stand in for the server.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = {}
+        self.seen = set()
+        self._next_uid = 1
+
+    def add_message(self, subject, attachments=(), sender='sender@example.com'):
+        """Adds an unread message with ``(filename, bytes)`` PDF attachments. Returns its uid."""
+        message = EmailMessage()
+        message['From'] = sender
+        message['To'] = 'inbox@example.com'
+        message['Subject'] = subject
+        message.set_content("Segue em anexo.")
+        for filename, data in attachments:
+            message.add_attachment(data, maintype='application', subtype='pdf', filename=filename)
+        return self.add_raw(message.as_bytes())
+
+    def add_raw(self, raw):
+        uid = str(self._next_uid)
+        self._next_uid += 1
+        self.messages[uid] = raw
+        return uid
+
+    async def search(self):
+        await asyncio.sleep(self.latency)
+        return [uid for uid in self.messages if uid not in self.seen]
+
+    async def fetch(self, uid):
+        await asyncio.sleep(self.latency)
+        return self.messages[uid]
+
+    async def mark_seen(self, uid):
+        await asyncio.sleep(self.latency)
+        self.seen.add(uid)
+
+    async def close(self):
+        pass
+
+def attachment_source_key(message_key, data):
+    """Identifies one attachment of one message, for ``PdfDocument.source_key``.
+
+    ``message_key`` is the Message-ID of the email, or its uid when it has none.
+    """
+    return f"{message_key}:{hashlib.sha256(data).hexdigest()}"
+
+def _fingerprint_attachment(data, filename, subject):
+    """Fingerprints the first page of an attachment. Runs in the extraction executor."""
+    with InMemoryPdf(data, filename) as source:
+        return first_page_fingerprint(source, subject)
+
+def _extract_attachment(data, filename, keep_original, with_fingerprint):
+    """Extracts one attachment, and fingerprints page 1 of the result if asked.
+
+    Runs in the extraction executor, usually another process. Returns
+    ``(text, data, pdf_filepath, fingerprint)``.
+    """
+    text, extracted, pdf_filepath = process_pdf_data(data, filename, keep_original=keep_original, parallel=False)
+    if not text.strip():
+        raise ValueError("no text could be extracted")
+    fingerprint = None
+    if with_fingerprint:
+        with InMemoryPdf(data, filename) as source:
+            fingerprint = extraction_fingerprint(source, text)
+    return text, extracted, pdf_filepath, fingerprint
+
+class IngestionPipeline:
+    """Moves PDF attachments from a mailbox into PdfDocument rows through bounded queues.
+
+    ``app`` is the Flask app giving access to the database. ``executor`` runs
+    the extraction; by default a process pool of ``workers`` processes, with
+    one extraction in flight per process. Call ``run`` to start, and ``stop``
+    (e.g. from a signal handler) to drain and finish.
+    """
+
+    def __init__(self, mailbox, app, workers=None, executor=None, subjects=None, poll_seconds=None,
+                 extract_queue_size=None, write_queue_size=None, batch_size=None, max_delay=None,
+                 keep_originals=None):
+        self.mailbox = mailbox
+        self.app = app
+        self.workers = workers or OCR_WORKERS
+        self.executor = executor
+        self.subjects = subjects
+        self.poll_seconds = PIPELINE_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.extract_queue_size = extract_queue_size or PIPELINE_EXTRACT_QUEUE_SIZE
+        self.write_queue_size = write_queue_size or PIPELINE_WRITE_QUEUE_SIZE
+        self.batch_size = batch_size or PIPELINE_WRITE_BATCH_SIZE
+        self.max_delay = PIPELINE_WRITE_MAX_DELAY if max_delay is None else max_delay
+        self.keep_originals = PIPELINE_KEEP_ORIGINALS if keep_originals is None else keep_originals
+        self.stats = {"messages": 0, "attachments": 0, "saved": 0, "already_saved": 0, "skipped": 0, "failed": 0}
+        self._stopping = None
+        self._handled = set() # Messages in flight, skipped or failed: not fetched again by this run
+        self._remaining = {} # uid -> attachments of the message not yet saved
+        self._failed = set()
+
+    def stop(self):
+        """Stops fetching new messages; what was already fetched is still extracted and saved."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self, once=False):
+        """Runs until ``stop`` is called, or, with ``once``, until the current messages are saved."""
+        self._stopping = asyncio.Event()
+        extract_queue = asyncio.Queue(self.extract_queue_size)
+        write_queue = asyncio.Queue(self.write_queue_size)
+        own_executor = self.executor is None
+        executor = ProcessPoolExecutor(max_workers=self.workers) if own_executor else self.executor
+        extractors = [asyncio.create_task(self._extract_loop(extract_queue, write_queue, executor))
+                      for _ in range(self.workers)]
+        writer = asyncio.create_task(self._write_loop(write_queue))
+        try:
+            await self._fetch_loop(extract_queue, once)
+        finally:
+            # Drain: every queued attachment goes through extraction, then through the writer
+            for _ in extractors:
+                await extract_queue.put(_STOP)
+            await asyncio.gather(*extractors)
+            await write_queue.put(_STOP)
+            await writer
+            if own_executor:
+                executor.shutdown(wait=True)
+            await self.mailbox.close()
+        logger.info(f"Pipeline finished: {self.stats}")
+        return self.stats
+
+    async def _fetch_loop(self, extract_queue, once):
+        while not self._stopping.is_set():
+            try:
+                uids = [uid for uid in await self.mailbox.search() if uid not in self._handled]
+            except Exception as e:
+                logger.error(f"Could not search the mailbox: {e}")
+                uids = []
+            for uid in uids:
+                if self._stopping.is_set():
+                    break
+                await self._fetch_message(uid, extract_queue)
+            if once:
+                break
+            if not uids:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _fetch_message(self, uid, extract_queue):
+        try:
+            raw = await self.mailbox.fetch(uid)
+        except Exception as e:
+            logger.error(f"Could not fetch message {uid}: {e}")
+            return
+        self._handled.add(uid)
+        message = email.message_from_bytes(raw, policy=policy.default)
+        subject = str(message.get('Subject', ''))
+        if not subject_matches(subject, self.subjects):
+            logger.debug(f"Skipping message {uid} with subject {subject!r}")
+            return
+        attachments = pdf_attachments(message)
+        self.stats["messages"] += 1
+        if not attachments:
+            logger.info(f"Message {uid} ({subject}) has no PDF attachment")
+            await self._mark_seen(uid)
+            return
+        message_key = str(message.get('Message-ID') or f"uid:{uid}").strip()
+        self._remaining[uid] = len(attachments)
+        for filename, data in attachments:
+            # Waits here while extraction is behind: the backpressure on the mailbox
+            await extract_queue.put((uid, subject, filename, data, attachment_source_key(message_key, data)))
+
+    async def _extract_loop(self, extract_queue, write_queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await extract_queue.get()
+            if item is _STOP:
+                return
+            uid, subject, filename, data, source_key = item
+            self.stats["attachments"] += 1
+            fingerprint, duplicate_of_id = None, None
+            try:
+                document_id = await asyncio.to_thread(self._find_saved, source_key)
+                if document_id is not None:
+                    # Saved by an earlier run that left the message unread
+                    logger.info(f"Skipping {filename} from message {uid}: already saved as document {document_id}")
+                    inc("pdf_pipeline_attachments_total", outcome="already_saved")
+                    await self._attachment_done(uid, "already_saved")
+                    continue
+                if FINGERPRINT_MODE == 'skip':
+                    # The first-page pass: a skipped near-duplicate is never fully processed
+                    fingerprint, first_page_data, tipo_termo = await loop.run_in_executor(
+                        executor, _fingerprint_attachment, data, filename, subject)
+                    duplicate_of_id, skip = await asyncio.to_thread(
+                        self._check_duplicate, fingerprint, first_page_data, tipo_termo)
+                    if skip:
+                        await self._skip_duplicate(uid, filename, duplicate_of_id)
+                        continue
+                check_after = fingerprint is None and FINGERPRINT_MODE != 'off'
+                text, extracted, pdf_filepath, extracted_fingerprint = await loop.run_in_executor(
+                    executor, _extract_attachment, data, filename, self.keep_originals, check_after)
+                if check_after:
+                    # Flag mode, or a single-page scan whose first page only the full extraction reads
+                    fingerprint = extracted_fingerprint
+                    duplicate_of_id, skip = await asyncio.to_thread(
+                        self._check_duplicate, fingerprint, extracted, termo_type(text, subject))
+                    if skip:
+                        await self._skip_duplicate(uid, filename, duplicate_of_id)
+                        continue
+            except Exception as e:
+                logger.error(f"Could not extract {filename} from message {uid}: {e}")
+                inc("pdf_pipeline_attachments_total", outcome="failed")
+                await self._attachment_done(uid, "failed")
+                continue
+            result = dict(extracted, subject=subject, filename=filename, extracted_text=text,
+                          processed_at=datetime.now(timezone.utc), pdf_filepath=pdf_filepath,
+                          fingerprint=fingerprint, duplicate_of_id=duplicate_of_id, source_key=source_key)
+            # Waits here while the database is behind: the backpressure on extraction
+            await write_queue.put((uid, result))
+
+    def _find_saved(self, source_key):
+        with self.app.app_context():
+            return find_document_by_source(source_key)
+
+    def _check_duplicate(self, fingerprint, data, tipo_termo):
+        with self.app.app_context():
+            return check_near_duplicate(fingerprint, data, tipo_termo)
+
+    async def _skip_duplicate(self, uid, filename, duplicate_of_id):
+        logger.info(f"Skipping {filename} from message {uid}: near-duplicate of document {duplicate_of_id}")
+        inc("pdf_pipeline_attachments_total", outcome="skipped")
+        await self._attachment_done(uid, "skipped")
+
+    async def _write_loop(self, write_queue):
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - loop.time())
+            try:
+                item = await asyncio.wait_for(write_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            if item is not None and item is not _STOP:
+                if not batch:
+                    deadline = loop.time() + self.max_delay
+                batch.append(item)
+            if batch and (item is None or item is _STOP or len(batch) >= self.batch_size):
+                await self._write_batch(batch)
+                batch = []
+            if item is _STOP:
+                return
+
+    async def _write_batch(self, batch):
+        try:
+            ids, skipped = await asyncio.to_thread(self._save, [result for _, result in batch])
+        except Exception as e:
+            logger.error(f"Could not save {len(batch)} documents: {e}")
+            ids, skipped = [None] * len(batch), {}
+        for index, ((uid, result), document_id) in enumerate(zip(batch, ids)):
+            if index in skipped:
+                await self._skip_duplicate(uid, result["filename"], skipped[index])
+                continue
+            inc("pdf_pipeline_attachments_total", outcome="saved" if document_id is not None else "failed")
+            await self._attachment_done(uid, "saved" if document_id is not None else "failed")
+
+    def _save(self, results):
+        # Checked against the stored documents already; a batch may still hold two re-scans of one termo
+        with self.app.app_context():
+            return insert_documents_checking_duplicates(results, checked=True, batch_size=len(results))
+
+    async def _attachment_done(self, uid, outcome):
+        self.stats[outcome] += 1
+        if outcome == "failed":
+            self._failed.add(uid)
+        self._remaining[uid] -= 1
+        if self._remaining[uid]:
+            return
+        del self._remaining[uid]
+        if uid in self._failed:
+            # Left unread, so the message is retried after a restart or can be handled by hand
+            self._failed.discard(uid)
+            logger.warning(f"Message {uid} left unread: some of its attachments could not be saved")
+        else:
+            await self._mark_seen(uid)
+
+    async def _mark_seen(self, uid):
+        try:
+            await self.mailbox.mark_seen(uid)
+            self._handled.discard(uid) # Read messages no longer come up in the search
+        except Exception as e:
+            logger.error(f"Could not mark message {uid} as read: {e}")
+
+def main(argv=None):
+    from batch_ingest import create_app
+
+    parser = argparse.ArgumentParser(description="Ingest PDF attachments from the mailbox into the database.")
+    parser.add_argument('--once', action='store_true', help="process the current messages and exit")
+    parser.add_argument('--workers', type=int, default=OCR_WORKERS, help="number of extraction processes")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', 'sqlite:///site.db'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    app = create_app(args.database_url)
+    with app.app_context():
+        db.create_all()
+    pipeline = IngestionPipeline(ImapMailbox(), app, workers=args.workers)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, pipeline.stop)
+        return await pipeline.run(once=args.once)
+
+    stats = asyncio.run(run())
+    return 1 if stats["failed"] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
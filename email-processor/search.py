@@ -0,0 +1,296 @@
+import os
+import re
+import logging
+from datetime import date, datetime
+from flask import Blueprint, jsonify, request
+from sqlalchemy import Float, Integer, func, literal_column, or_, select, text, tuple_
+from sqlalchemy.orm import defer
+from database import db, Equipamento, PdfDocument
+
+logger = logging.getLogger(__name__)
+
+# Text search configuration used for the PostgreSQL full-text index
+FTS_LANGUAGE = os.environ.get('FTS_LANGUAGE', 'portuguese')
+if not re.fullmatch(r"[a-z_]+", FTS_LANGUAGE):
+    raise ValueError(f"Invalid FTS_LANGUAGE: {FTS_LANGUAGE}")
+
+# Largest page the search API returns
+SEARCH_MAX_PAGE_SIZE = int(os.environ.get('SEARCH_MAX_PAGE_SIZE', 200))
+
+SQLITE_FTS_TABLE = "pdf_document_fts"
+
+_SQLITE_FTS_STATEMENTS = (
+    # External content table: the text itself stays in pdf_document
+    f"""CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(
+        extracted_text, content='pdf_document', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER pdf_document_fts_insert AFTER INSERT ON pdf_document BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, extracted_text) VALUES (new.id, new.extracted_text);
+    END""",
+    f"""CREATE TRIGGER pdf_document_fts_delete AFTER DELETE ON pdf_document BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, extracted_text)
+        VALUES ('delete', old.id, old.extracted_text);
+    END""",
+    f"""CREATE TRIGGER pdf_document_fts_update AFTER UPDATE OF extracted_text ON pdf_document BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, extracted_text)
+        VALUES ('delete', old.id, old.extracted_text);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, extracted_text) VALUES (new.id, new.extracted_text);
+    END""",
+    # Index the rows that existed before the table was created
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+)
+
+# Same expression in the index and in the queries, so PostgreSQL can use the index
+_POSTGRES_TSVECTOR = f"to_tsvector('{FTS_LANGUAGE}'::regconfig, coalesce(extracted_text, ''))"
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+def init_fulltext_search():
+    """Creates the full-text index over PdfDocument.extracted_text. Safe to call repeatedly.
+
+    On SQLite this is an FTS5 table kept in sync by triggers; on PostgreSQL a
+    GIN index over the tsvector of the text. Other databases fall back to
+    LIKE searches in ``search_documents``.
+    """
+    dialect = _dialect()
+    if dialect == "sqlite":
+        exists = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": SQLITE_FTS_TABLE},
+        ).first()
+        if exists:
+            return
+        for statement in _SQLITE_FTS_STATEMENTS:
+            db.session.execute(text(statement))
+        logger.info("Created SQLite FTS5 index over extracted text.")
+    elif dialect == "postgresql":
+        db.session.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_pdf_document_extracted_text_fts "
+            f"ON pdf_document USING GIN ({_POSTGRES_TSVECTOR})"
+        ))
+        logger.info("Created PostgreSQL GIN index over extracted text.")
+    else:
+        logger.warning(f"Full-text search is not supported on {dialect}; falling back to LIKE searches.")
+    db.session.commit()
+
+def _fts5_query(query):
+    """Turns free text into an FTS5 query matching all of its words, ignoring FTS5 operators."""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"' for word in words)
+
+def _fulltext_filter(statement, query, with_score=True):
+    """Restricts a select over PdfDocument to rows matching ``query``, adding a ``score`` column if asked."""
+    dialect = _dialect()
+    if dialect == "sqlite":
+        matches = text(
+            f"SELECT rowid AS id, -bm25({SQLITE_FTS_TABLE}) AS score "
+            f"FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH :fts_query"
+        ).columns(id=Integer, score=Float).bindparams(fts_query=_fts5_query(query)).subquery()
+        statement = statement.join(matches, matches.c.id == PdfDocument.id)
+        return statement.add_columns(matches.c.score) if with_score else statement
+    if dialect == "postgresql":
+        vector = literal_column(_POSTGRES_TSVECTOR)
+        tsquery = func.plainto_tsquery(literal_column(f"'{FTS_LANGUAGE}'::regconfig"), query)
+        statement = statement.where(vector.op("@@")(tsquery))
+        return statement.add_columns(func.ts_rank(vector, tsquery).label("score")) if with_score else statement
+    statement = statement.where(PdfDocument.extracted_text.ilike(f"%{query}%"))
+    return statement.add_columns(literal_column("0.0", Float).label("score")) if with_score else statement
+
+def filter_documents(statement, query=None, cpf=None, matricula=None, nome=None, subject=None,
+                     date_from=None, date_to=None, with_score=False):
+    """Restricts a select over PdfDocument to the documents matching the search filters.
+
+    Shared by search and export; the filters are those of ``search_documents``.
+    With ``with_score`` a ``score`` column is added, 0 when there is no
+    ``query``. Returns None when ``query`` has no words that could match.
+    """
+    if query and query.strip():
+        if _dialect() == "sqlite" and not _fts5_query(query):
+            return None
+        statement = _fulltext_filter(statement, query, with_score)
+    elif with_score:
+        statement = statement.add_columns(literal_column("0.0", Float).label("score"))
+    if cpf:
+        statement = statement.where(PdfDocument.cpf == cpf)
+    if matricula:
+        statement = statement.where(PdfDocument.matricula == matricula)
+    if subject:
+        statement = statement.where(PdfDocument.subject == subject)
+    if nome:
+        if _dialect() == "postgresql":
+            # Served by the varchar_pattern_ops index ix_pdf_document_nome_pattern
+            statement = statement.where(PdfDocument.nome.startswith(nome, autoescape=True))
+        else:
+            # SQLite never uses an index for its case-insensitive LIKE, but a range
+            # of the binary collation is a search of ix_pdf_document_nome
+            statement = statement.where(PdfDocument.nome >= nome, PdfDocument.nome < nome + "\uffff")
+    if date_from:
+        statement = statement.where(PdfDocument.data_documento >= date_from)
+    if date_to:
+        statement = statement.where(PdfDocument.data_documento <= date_to)
+    return statement
+
+def _deferred_columns(with_text, with_equipment):
+    """Loader options leaving the large text columns unloaded until accessed."""
+    options = []
+    if not with_text:
+        options.append(defer(PdfDocument.extracted_text))
+    if not with_equipment:
+        options.append(defer(PdfDocument.equipamentos))
+    return options
+
+def search_documents(query=None, cpf=None, matricula=None, nome=None, subject=None,
+                     date_from=None, date_to=None, limit=50, offset=0, with_text=False, with_equipment=False):
+    """Searches processed documents, ranking full-text matches first.
+
+    ``query`` is matched against the extracted text through the full-text
+    index. ``cpf``, ``matricula`` and ``subject`` must match exactly, ``nome``
+    is a case-sensitive prefix, and ``date_from``/``date_to`` bound
+    ``data_documento``; each of these is an index lookup on its column,
+    which the database may combine with the others or with the full-text
+    match. ``extracted_text`` and ``equipamentos`` are loaded
+    on first access unless ``with_text``/``with_equipment`` are set. Returns
+    a list of ``(PdfDocument, score)`` pairs; the score is higher for better
+    matches and 0 when there is no query.
+    """
+    statement = filter_documents(select(PdfDocument).options(*_deferred_columns(with_text, with_equipment)),
+                                 query, cpf, matricula, nome, subject, date_from, date_to, with_score=True)
+    if statement is None:
+        return []
+    order_by = [literal_column("score").desc()] if query and query.strip() else []
+    order_by += [PdfDocument.data_documento.desc(), PdfDocument.id.desc()]
+    statement = statement.order_by(*order_by).limit(limit).offset(offset)
+    return [(document, score) for document, score in db.session.execute(statement)]
+
+def encode_cursor(document):
+    """Returns the opaque cursor of the page that starts after ``document``.
+
+    A document without ``processed_at`` gives a cursor with an empty timestamp.
+    """
+    processed_at = document.processed_at.isoformat() if document.processed_at else ""
+    return f"{processed_at}_{document.id}"
+
+def decode_cursor(cursor):
+    """Parses a cursor from ``encode_cursor`` into ``(processed_at, id)``. Raises ValueError if it is malformed."""
+    processed_at, _, document_id = cursor.rpartition("_")
+    return (datetime.fromisoformat(processed_at) if processed_at else None), int(document_id)
+
+def _after_cursor(statement, cursor):
+    """Restricts a select ordered by ``_keyset_order`` to the rows after ``cursor``."""
+    processed_at, document_id = decode_cursor(cursor)
+    if processed_at is None:
+        return statement.where(PdfDocument.processed_at.is_(None), PdfDocument.id < document_id)
+    return statement.where(or_(
+        tuple_(PdfDocument.processed_at, PdfDocument.id) < (processed_at, document_id),
+        PdfDocument.processed_at.is_(None),
+    ))
+
+# Newest first; documents without processed_at (rows older than the column) come last
+_keyset_order = (PdfDocument.processed_at.desc().nulls_last(), PdfDocument.id.desc())
+
+def search_documents_page(query=None, cpf=None, matricula=None, nome=None, subject=None,
+                          date_from=None, date_to=None, after=None, limit=50,
+                          with_text=False, with_equipment=False):
+    """Returns one page of matching documents, newest first, for the search API.
+
+    Takes the filters of ``search_documents``, but pages by keyset instead of
+    offset: ``after`` is the cursor returned with the previous page, and the
+    next page starts right after it through the (processed_at, id) index, so
+    deep pages cost as little as the first. Full-text matches are filtered,
+    not ranked. Documents without ``processed_at`` come after all the others.
+    Returns ``(documents, next_cursor)``, where ``next_cursor`` is None on
+    the last page.
+    """
+    statement = filter_documents(select(PdfDocument).options(*_deferred_columns(with_text, with_equipment)),
+                                 query, cpf, matricula, nome, subject, date_from, date_to)
+    if statement is None:
+        return [], None
+    if after:
+        statement = _after_cursor(statement, after)
+    statement = statement.order_by(*_keyset_order).limit(limit + 1)
+    documents = list(db.session.scalars(statement))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1])
+
+def find_documents_by_imei(imei):
+    """Returns the documents listing a device with the given IMEI, newest first."""
+    return _documents_with_equipment(Equipamento.imei == imei)
+
+def find_documents_by_patrimonio(patrimonio):
+    """Returns the documents listing the given patrimônio number, newest first."""
+    return _documents_with_equipment(Equipamento.patrimonio == patrimonio)
+
+def _documents_with_equipment(condition):
+    document_ids = select(Equipamento.document_id).where(condition)
+    statement = (
+        select(PdfDocument)
+        .where(PdfDocument.id.in_(document_ids))
+        .order_by(PdfDocument.data_documento.desc(), PdfDocument.id.desc())
+    )
+    return list(db.session.scalars(statement))
+
+def parse_filters(args):
+    """Reads the search filters from request arguments. Raises ValueError on a malformed date."""
+    filters = {name: args.get(name) or None for name in ("query", "cpf", "matricula", "nome", "subject")}
+    for name in ("date_from", "date_to"):
+        filters[name] = date.fromisoformat(args[name]) if args.get(name) else None
+    return filters
+
+def parse_flag(args, name):
+    """Reads a boolean request argument: "1", "true" or "yes" turn it on."""
+    return args.get(name, "").lower() in ("1", "true", "yes")
+
+def document_dict(document, with_text=False, with_equipment=False):
+    """Serializes a PdfDocument for the search API, with the deferred columns only if asked."""
+    result = {
+        "id": document.id,
+        "subject": document.subject,
+        "filename": document.filename,
+        "processed_at": document.processed_at.isoformat() if document.processed_at else None,
+        "data_documento": document.data_documento.isoformat() if document.data_documento else None,
+        "nome": document.nome,
+        "matricula": document.matricula,
+        "funcao": document.funcao,
+        "empregador": document.empregador,
+        "rg": document.rg,
+        "cpf": document.cpf,
+        "duplicate_of_id": document.duplicate_of_id,
+    }
+    if with_equipment:
+        result["equipamentos"] = document.equipamentos_list
+    if with_text:
+        result["extracted_text"] = document.extracted_text
+    return result
+
+search_blueprint = Blueprint('search', __name__)
+
+@search_blueprint.route('/api/documents')
+def documents_endpoint():
+    """Search API, one page at a time; register with ``app.register_blueprint(search_blueprint)``.
+
+    Takes the filters of ``search_documents_page`` as query arguments (dates
+    as YYYY-MM-DD), ``limit``, and ``after``: the ``next_cursor`` of the
+    previous page. ``with_text=1`` and ``with_equipment=1`` add those columns.
+    """
+    with_text = parse_flag(request.args, "with_text")
+    with_equipment = parse_flag(request.args, "with_equipment")
+    try:
+        filters = parse_filters(request.args)
+        limit = int(request.args.get("limit", 50))
+        if not 1 <= limit <= SEARCH_MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {SEARCH_MAX_PAGE_SIZE}")
+        documents, next_cursor = search_documents_page(
+            **filters, after=request.args.get("after"), limit=limit,
+            with_text=with_text, with_equipment=with_equipment,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "documents": [document_dict(document, with_text, with_equipment) for document in documents],
+        "next_cursor": next_cursor,
+    })
@@ -0,0 +1,46 @@
+import os
+import sys
+import random
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import pdf_extraction # noqa: E402
+from batch_ingest import ingest, iter_source_files # noqa: E402
+from database import PdfDocument, db # noqa: E402
+from synthetic_termos import make_termo, write_text_pdf # noqa: E402
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(pdf_extraction, "get_extraction_cache", lambda: None)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def test_files_are_recognized_from_another_working_directory(app, tmp_path, monkeypatch):
+    rng = random.Random(9)
+    (tmp_path / "pdfs").mkdir()
+    for number in range(2):
+        write_text_pdf(str(tmp_path / "pdfs" / f"termo-{number}.pdf"), make_termo(rng, pages=1)[0])
+
+    monkeypatch.chdir(tmp_path)
+    assert ingest(iter_source_files("pdfs"), str(tmp_path / "first.jsonl"), workers=1) == []
+    monkeypatch.chdir(tmp_path / "pdfs")
+    assert ingest(iter_source_files("."), str(tmp_path / "first.jsonl"), workers=1) == []
+    # A new checkpoint, so only the stored paths can tell the files apart
+    assert ingest(iter_source_files("."), str(tmp_path / "second.jsonl"), workers=1) == []
+
+    paths = db.session.scalars(select(PdfDocument.pdf_filepath)).all()
+    pdf_dir = os.path.realpath(tmp_path / "pdfs")
+    assert sorted(paths) == [os.path.join(pdf_dir, f"termo-{number}.pdf") for number in range(2)]
+    assert db.session.scalar(select(func.count(PdfDocument.fingerprint))) == 2
@@ -0,0 +1,71 @@
+import os
+import sys
+import random
+
+import pytest
+from flask import Flask
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import pdf_extraction # noqa: E402
+from database import PdfDocument, bulk_insert_documents, complete_extracted_texts, db # noqa: E402
+from extraction_cache import ExtractionCache # noqa: E402
+from pdf_extraction import process_pdf # noqa: E402
+from synthetic_termos import make_termo, write_text_pdf # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(pdf_extraction, "get_extraction_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def termo_path(tmp_path):
+    """A three-page text-layer termo whose fields are all on page 1."""
+    path = str(tmp_path / "termo.pdf")
+    write_text_pdf(path, make_termo(random.Random(13), pages=3)[0])
+    return path
+
+
+def test_lazy_early_stop_returns_partial_text_marked_incomplete(cache, termo_path):
+    full_text, full_data = process_pdf(termo_path, early_stop=False)
+    text, data = process_pdf(termo_path, early_stop=True, full_text="lazy")
+
+    assert full_text.startswith(text) and len(text) < len(full_text)
+    assert data.pop("text_complete") is False
+    assert data == full_data
+
+
+def test_eager_early_stop_returns_the_whole_text(cache, termo_path):
+    full_text, full_data = process_pdf(termo_path, early_stop=False, cache=False)
+    assert process_pdf(termo_path, early_stop=True, full_text="eager") == (full_text, full_data)
+
+
+def test_partial_text_is_never_served_to_full_text_readers(cache, termo_path):
+    partial_text, _ = process_pdf(termo_path, early_stop=True, full_text="lazy")
+    full_text, data = process_pdf(termo_path, early_stop=False)
+
+    assert len(full_text) > len(partial_text)
+    assert "text_complete" not in data
+
+
+def test_complete_extracted_texts_reads_the_rest_of_lazy_documents(cache, termo_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        text, data = process_pdf(termo_path, early_stop=True, full_text="lazy")
+        document_id, = bulk_insert_documents([dict(data, subject="termo", filename="termo.pdf",
+                                                   extracted_text=text, pdf_filepath=termo_path)])
+        assert db.session.get(PdfDocument, document_id).text_complete is False
+
+        assert complete_extracted_texts() == 1
+        document = db.session.get(PdfDocument, document_id)
+        assert document.text_complete is True
+        assert document.extracted_text == process_pdf(termo_path, early_stop=False, cache=False)[0]
+        assert complete_extracted_texts() == 0
+        db.session.remove()
@@ -0,0 +1,44 @@
+import os
+import sys
+import random
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import pdf_extraction # noqa: E402
+from extraction_cache import ExtractionCache # noqa: E402
+from pdf_extraction import process_pdf # noqa: E402
+from synthetic_termos import make_termo, write_text_pdf # noqa: E402
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / "cache"))
+
+
+def test_overwritten_entries_are_not_counted_twice(cache):
+    cache.put("key", "first", {})
+    for _ in range(20):
+        cache.put("key", "second text", {"nome": "Fulano"})
+
+    assert cache._size == cache._directory_size()
+
+
+@pytest.mark.parametrize("setting, value", [
+    ("TEXT_LAYER_MIN_CHARS", 10_000),
+    ("TEXT_LAYER_MIN_ALNUM_RATIO", 0.99),
+    ("OCR_BACKEND", "batch"),
+])
+def test_settings_changing_the_text_change_the_cache_key(cache, tmp_path, monkeypatch, setting, value):
+    path = str(tmp_path / "termo.pdf")
+    write_text_pdf(path, make_termo(random.Random(3), pages=1)[0])
+    process_pdf(path, cache=cache, early_stop=False)
+
+    monkeypatch.setattr(pdf_extraction, setting, value)
+    monkeypatch.setattr(pdf_extraction, "extract_pages_from_pdf", lambda *args, **kwargs: [
+        {"page": 1, "method": pdf_extraction.PAGE_TEXT_LAYER, "text": "re-extracted"}])
+    text, _ = process_pdf(path, cache=cache, early_stop=False)
+
+    assert text == "re-extracted"
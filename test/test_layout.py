@@ -0,0 +1,45 @@
+import os
+import sys
+import random
+
+import pytest
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import pdf_extraction # noqa: E402
+from metrics import counter_value, reset_metrics # noqa: E402
+from pdf_extraction import PAGE_OCR, PAGE_TEXT_LAYER, extract_with_layout # noqa: E402
+from synthetic_termos import make_termo # noqa: E402
+
+
+@pytest.fixture
+def scanned_first_page(monkeypatch):
+    """A two-page termo whose first page is a scan and whose second has a text layer.
+
+    Rasterization and OCR are faked: the "scan" reads back as the text of page 1.
+    """
+    page_lines, _ = make_termo(random.Random(12), pages=2)
+    first, second = ("\n".join(lines) + "\n" for lines in page_lines)
+    monkeypatch.setattr(pdf_extraction, "_plan_pages", lambda pdf_path: [
+        {"page": 1, "method": PAGE_OCR, "text": ""},
+        {"page": 2, "method": PAGE_TEXT_LAYER, "text": second},
+    ])
+    monkeypatch.setattr(pdf_extraction, "iter_pdf_page_images",
+                        lambda pdf_path, dpi, page_numbers: ((number, Image.new("L", (100, 140), 255))
+                                                             for number in page_numbers))
+    monkeypatch.setattr(pdf_extraction, "_ocr_images", lambda images, lang, dpi, page_numbers: [first] * len(images))
+    reset_metrics()
+    return first, second
+
+
+def test_region_text_keeps_the_text_layer_pages(scanned_first_page):
+    first, second = scanned_first_page
+    text, data = extract_with_layout("termo.pdf")
+
+    assert text == first + "\n" + second
+    assert data["text_complete"] is False
+    assert counter_value("pdf_layout_documents_total", result="regions") == 1
+    assert counter_value("pdf_pages_total", method=PAGE_OCR) == 1
+    assert counter_value("pdf_pages_total", method=PAGE_TEXT_LAYER) == 1
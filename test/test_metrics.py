@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+import pdf_extraction # noqa: E402
+from metrics import counter_value, reset_metrics # noqa: E402
+from pdf_extraction import PAGE_OCR, PAGE_OCR_FAILED # noqa: E402
+
+
+@pytest.fixture
+def scanned_page():
+    reset_metrics()
+    return [{"page": 1, "method": PAGE_OCR, "text": ""}]
+
+
+def failing(*args, **kwargs):
+    raise RuntimeError("failed")
+
+
+def test_rasterization_failure_is_counted_once(monkeypatch, scanned_page):
+    monkeypatch.setattr(pdf_extraction, "convert_from_path", failing)
+    pdf_extraction._ocr_planned_pages("termo.pdf", scanned_page, False, None, "por", 200, 1)
+
+    assert scanned_page[0]["method"] == PAGE_OCR_FAILED
+    assert counter_value("pdf_failures_total", stage="rasterize") == 1
+    assert counter_value("pdf_failures_total", stage="ocr") == 0
+
+
+def test_ocr_failure_outside_a_stage_is_counted_as_ocr(monkeypatch, scanned_page):
+    monkeypatch.setattr(pdf_extraction, "convert_from_path",
+                        lambda *args, **kwargs: [Image.new("L", (100, 140), 255)])
+    monkeypatch.setattr(pdf_extraction, "_ocr_images", failing)
+    pdf_extraction._ocr_planned_pages("termo.pdf", scanned_page, False, None, "por", 200, 1)
+
+    assert scanned_page[0]["method"] == PAGE_OCR_FAILED
+    assert counter_value("pdf_failures_total", stage="rasterize") == 0
+    assert counter_value("pdf_failures_total", stage="ocr") == 1
@@ -0,0 +1,116 @@
+import os
+import sys
+import random
+
+import pytest
+from flask import Flask
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import database # noqa: E402
+from database import ( # noqa: E402
+    PdfDocument,
+    bulk_insert_documents,
+    check_near_duplicate,
+    db,
+    insert_documents_checking_duplicates,
+)
+from fingerprint import simhash, termo_type # noqa: E402
+from pdf_extraction import extract_text_fields # noqa: E402
+from synthetic_termos import make_termo # noqa: E402
+
+TITLES = {
+    "recebimento": "TERMO DE RECEBIMENTO DE EQUIPAMENTOS",
+    "devolucao": "TERMO DE DEVOLUÇÃO DE EQUIPAMENTOS",
+}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def first_page(page_lines, title):
+    return "\n".join([title] + page_lines[0][1:])
+
+
+def result_of(text, subject="termo"):
+    return dict(extract_text_fields(text), subject=subject, filename="termo.pdf", extracted_text=text,
+                fingerprint=simhash(text))
+
+
+def save(text, subject="termo"):
+    return bulk_insert_documents([result_of(text, subject)])[0]
+
+
+def add_ocr_noise(text, rng, rate=0.005):
+    """Replaces a small fraction of the letters, like a re-scan read by OCR."""
+    return "".join(rng.choice("aeiourstnl") if char.isalpha() and rng.random() < rate else char for char in text)
+
+
+@pytest.mark.parametrize("mode", ["flag", "skip"])
+def test_devolucao_is_not_a_near_duplicate_of_its_recebimento(app, monkeypatch, mode):
+    monkeypatch.setattr(database, "FINGERPRINT_MODE", mode)
+    rng = random.Random(19)
+    for _ in range(100):
+        page_lines, _ = make_termo(rng, pages=1, equipment_count=rng.randint(1, 8))
+        save(first_page(page_lines, TITLES["recebimento"]))
+        # Same person, equipment and date: only the title differs
+        devolucao = first_page(page_lines, TITLES["devolucao"])
+        assert termo_type(devolucao) == "devolucao"
+        duplicate_of_id, skip = check_near_duplicate(simhash(devolucao), extract_text_fields(devolucao),
+                                                     termo_type(devolucao))
+        assert (duplicate_of_id, skip) == (None, False)
+
+
+def test_distinct_termos_are_not_near_duplicates(app, monkeypatch):
+    monkeypatch.setattr(database, "FINGERPRINT_MODE", "flag")
+    rng = random.Random(20)
+    texts = [first_page(make_termo(rng, pages=1, equipment_count=rng.randint(1, 8))[0], TITLES["recebimento"])
+             for _ in range(200)]
+    for text in texts[:100]:
+        save(text)
+    for text in texts[100:]:
+        assert check_near_duplicate(simhash(text), extract_text_fields(text), termo_type(text)) == (None, False)
+
+
+def test_rescan_is_flagged_and_skipped_only_when_the_fields_match(app, monkeypatch):
+    rng = random.Random(21)
+    page_lines, _ = make_termo(rng, pages=1, equipment_count=3)
+    original = first_page(page_lines, TITLES["devolucao"])
+    document_id = save(original)
+    rescan = add_ocr_noise(original, rng)
+
+    monkeypatch.setattr(database, "FINGERPRINT_MODE", "flag")
+    assert check_near_duplicate(simhash(rescan), extract_text_fields(original), "devolucao") == (document_id, False)
+    monkeypatch.setattr(database, "FINGERPRINT_MODE", "skip")
+    assert check_near_duplicate(simhash(rescan), extract_text_fields(original), "devolucao") == (document_id, True)
+    assert check_near_duplicate(simhash(rescan), {}, "devolucao") == (document_id, False)
+
+
+@pytest.mark.parametrize("mode", ["flag", "skip"])
+def test_rescans_in_one_batch_are_checked_against_each_other(app, monkeypatch, mode):
+    monkeypatch.setattr(database, "FINGERPRINT_MODE", mode)
+    rng = random.Random(22)
+    original, other = (first_page(make_termo(rng, pages=1, equipment_count=3)[0], TITLES["recebimento"])
+                       for _ in range(2))
+    results = [result_of(original), result_of(other), result_of(add_ocr_noise(original, rng))]
+    # The re-scan keeps the fields of the original, as a clean OCR of it would
+    results[2].update(extract_text_fields(original))
+
+    ids, skipped = insert_documents_checking_duplicates(results)
+
+    assert ids[0] is not None and ids[1] is not None
+    if mode == "flag":
+        assert skipped == {}
+        assert db.session.get(PdfDocument, ids[2]).duplicate_of_id == ids[0]
+        assert db.session.get(PdfDocument, ids[1]).duplicate_of_id is None
+    else:
+        assert (ids[2], skipped) == (None, {2: ids[0]})
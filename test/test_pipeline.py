@@ -0,0 +1,194 @@
+import os
+import sys
+import asyncio
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+sys.path.insert(0, os.path.join(HERE, '..', 'benchmark'))
+import pipeline # noqa: E402
+from database import PdfDocument, db # noqa: E402
+from pipeline import InMemoryMailbox, IngestionPipeline # noqa: E402
+from synthetic_termos import make_termo, write_text_pdf # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "FINGERPRINT_MODE", "off")
+    app = Flask(__name__)
+    # A file, so the pipeline's writer thread sees the same database
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'pipeline.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def termo_pdfs(tmp_path):
+    """Returns a function giving the bytes of ``count`` distinct text-layer termos."""
+    rng = random.Random(18)
+
+    def make(count):
+        pdfs = []
+        for _ in range(count):
+            path = tmp_path / f"termo-{rng.getrandbits(32)}.pdf"
+            write_text_pdf(str(path), make_termo(rng, pages=1)[0])
+            pdfs.append(path.read_bytes())
+        return pdfs
+    return make
+
+
+class RecordingMailbox(InMemoryMailbox):
+    """Records the fetches, and how many documents of each message were saved when it was first marked as read."""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.subjects = {}
+        self.fetched = []
+        self.saved_when_seen = {}
+
+    def add_message(self, subject, attachments=(), sender='sender@example.com'):
+        uid = super().add_message(subject, attachments, sender)
+        self.subjects[uid] = subject
+        return uid
+
+    async def fetch(self, uid):
+        self.fetched.append(uid)
+        return await super().fetch(uid)
+
+    async def mark_seen(self, uid):
+        with self.app.app_context():
+            self.saved_when_seen.setdefault(uid, db.session.scalar(
+                select(func.count(PdfDocument.id)).where(PdfDocument.subject == self.subjects[uid])))
+        await super().mark_seen(uid)
+
+
+class GatedExecutor(ThreadPoolExecutor):
+    """Holds every extraction until ``gate`` is set."""
+
+    def __init__(self):
+        super().__init__(max_workers=4)
+        self.gate = threading.Event()
+
+    def submit(self, fn, *args, **kwargs):
+        def gated():
+            self.gate.wait()
+            return fn(*args, **kwargs)
+        return super().submit(gated)
+
+    def shutdown(self, *args, **kwargs):
+        self.gate.set() # Never left waiting when a test fails early
+        super().shutdown(*args, **kwargs)
+
+
+class FlakyExecutor(ThreadPoolExecutor):
+    """Fails the extraction of the attachments named in ``failing``."""
+
+    def __init__(self, failing):
+        super().__init__(max_workers=2)
+        self.failing = set(failing)
+
+    def submit(self, fn, *args, **kwargs):
+        if fn is pipeline._extract_attachment and args[1] in self.failing:
+            fn = failing_extraction
+        return super().submit(fn, *args, **kwargs)
+
+
+def failing_extraction(*args):
+    raise RuntimeError("extraction failed")
+
+
+def run_pipeline(mailbox, app, executor, **kwargs):
+    ingestion = IngestionPipeline(mailbox, app, workers=2, executor=executor, keep_originals=False, max_delay=0,
+                                  **kwargs)
+    return asyncio.run(ingestion.run(once=True))
+
+
+def test_messages_are_marked_seen_once_all_attachments_are_saved(app, termo_pdfs):
+    mailbox = RecordingMailbox(app)
+    pdfs = termo_pdfs(6)
+    attachment_counts = {}
+    for number, count in enumerate((1, 3, 2), start=1):
+        uid = mailbox.add_message(f"Termo de Recebimento {number}",
+                                  [(f"termo-{index}.pdf", pdfs.pop()) for index in range(count)])
+        attachment_counts[uid] = count
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        stats = run_pipeline(mailbox, app, executor, batch_size=1)
+
+    assert stats["saved"] == 6 and stats["failed"] == 0
+    assert mailbox.seen == set(attachment_counts)
+    assert mailbox.saved_when_seen == attachment_counts
+
+
+def test_failing_attachment_leaves_its_message_unread(app, termo_pdfs):
+    mailbox = RecordingMailbox(app)
+    good, other = termo_pdfs(2)
+    broken_uid = mailbox.add_message("Termo de Devolução 1", [("termo.pdf", good), ("broken.pdf", b"not a pdf")])
+    other_uid = mailbox.add_message("Termo de Devolução 2", [("termo.pdf", other)])
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        stats = run_pipeline(mailbox, app, executor)
+
+    assert (stats["saved"], stats["failed"]) == (2, 1)
+    assert broken_uid not in mailbox.seen
+    assert other_uid in mailbox.seen
+    with app.app_context():
+        # The attachment that could be read is saved all the same
+        assert db.session.scalar(
+            select(func.count(PdfDocument.id)).where(PdfDocument.subject == "Termo de Devolução 1")) == 1
+
+
+def test_small_extract_queue_bounds_fetching_ahead_of_extraction(app, termo_pdfs):
+    mailbox = RecordingMailbox(app)
+    for number, pdf in enumerate(termo_pdfs(10), start=1):
+        mailbox.add_message(f"Termo de Recebimento {number}", [("termo.pdf", pdf)])
+
+    async def run(executor):
+        ingestion = IngestionPipeline(mailbox, app, workers=2, executor=executor, keep_originals=False, max_delay=0,
+                                      extract_queue_size=1)
+        task = asyncio.create_task(ingestion.run(once=True))
+        await asyncio.sleep(0.5)
+        # One attachment held by each extractor, one queued, and one fetched and waiting for room
+        fetched_while_blocked = len(mailbox.fetched)
+        executor.gate.set()
+        return fetched_while_blocked, await task
+
+    with GatedExecutor() as executor:
+        fetched_while_blocked, stats = asyncio.run(run(executor))
+
+    assert fetched_while_blocked == 2 + 1 + 1
+    assert stats["saved"] == 10
+    assert len(mailbox.seen) == 10
+
+
+def test_rerun_of_partly_saved_message_does_not_save_its_attachments_twice(app, termo_pdfs):
+    mailbox = RecordingMailbox(app)
+    first, second = termo_pdfs(2)
+    uid = mailbox.add_message("Termo de Recebimento 1", [("first.pdf", first), ("second.pdf", second)])
+
+    with FlakyExecutor({"second.pdf"}) as executor:
+        stats = run_pipeline(mailbox, app, executor)
+    assert (stats["saved"], stats["failed"]) == (1, 1)
+    assert uid not in mailbox.seen
+
+    # The next run finds the message unread again and the failure is gone
+    with FlakyExecutor(set()) as executor:
+        stats = run_pipeline(mailbox, app, executor)
+    assert (stats["saved"], stats["already_saved"], stats["failed"]) == (1, 1, 0)
+    assert uid in mailbox.seen
+    with app.app_context():
+        filenames = db.session.scalars(
+            select(PdfDocument.filename).where(PdfDocument.subject == "Termo de Recebimento 1")).all()
+    assert sorted(filenames) == ["first.pdf", "second.pdf"]
@@ -0,0 +1,45 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import update
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'email-processor'))
+from database import PdfDocument, db # noqa: E402
+from search import search_documents_page # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def test_pages_reach_documents_without_processed_at(app):
+    start = datetime(2024, 1, 1)
+    documents = [PdfDocument("Termo de Recebimento", f"termo-{number}.pdf", "", start + timedelta(days=number))
+                 for number in range(5)]
+    db.session.add_all(documents)
+    db.session.commit()
+    # Rows saved before processed_at was filled in
+    undated = [documents[1].id, documents[3].id]
+    db.session.execute(update(PdfDocument).where(PdfDocument.id.in_(undated)).values(processed_at=None))
+    db.session.commit()
+
+    seen, after = [], None
+    while True:
+        page, after = search_documents_page(after=after, limit=2)
+        seen += [document.id for document in page]
+        if after is None:
+            break
+
+    dated = [documents[4].id, documents[2].id, documents[0].id]
+    assert seen == dated + sorted(undated, reverse=True)